@@ -0,0 +1,100 @@
+import contextlib
+import os
+import time
+
+import experiment
+import remote
+
+# Compiling MAGE and its dependencies takes most of the time to provision a
+# machine (the dependencies include the EMP-toolkit baseline), and every
+# machine would compile the same code. Instead, the first
+# machine builds them and packs each into an archive, named for what it was
+# built from: the dependencies by the install_deps.sh that built them and the
+# OS release, and each MAGE checkout by its commit. The other machines unpack
+# the archives, fetching them from the first machine over the private network
+# (or from here, if they are not on it), after which their builds have
+# nothing left to do. Archives are also kept here, so that provisioning a new
+# cluster with the same code compiles nothing at all.
+
+ARTIFACT_DIRECTORY = "artifacts"
+REMOTE_ARTIFACT_DIRECTORY = "~/work/artifacts"
+# Within the range that the firewall rules open for the WAN experiments, which
+# do not run while a cluster is being provisioned
+ARTIFACT_PORT = 57999
+
+def local_path(name):
+    return os.path.join(ARTIFACT_DIRECTORY, name)
+
+def remote_path(name):
+    return "{0}/{1}".format(REMOTE_ARTIFACT_DIRECTORY, name)
+
+def deps_archive_name(machine):
+    result = remote.exec_sync(machine.public_ip_address, ". /etc/os-release; echo $VERSION_CODENAME", check_exitcode = True, get_output = True)
+    return "deps-{0}-{1}.tar.gz".format(result.stdout.strip(), remote.file_digest("./scripts/install_deps.sh")[:16])
+
+def mage_archive_name(commit):
+    return "mage-{0}.tar.gz".format(commit)
+
+def resolve_commit(machine, repository, checkout):
+    # Returns the commit that checkout names in repository without cloning
+    # it, or None if it cannot be told that way (e.g., an abbreviated hash)
+    result = remote.exec_sync(machine.public_ip_address, "git ls-remote {0} {1} | head -n 1 | cut -f 1".format(repository, checkout), get_output = True)
+    commit = result.stdout.strip()
+    if result.returncode == 0 and len(commit) == 40:
+        return commit
+    if len(checkout) == 40 and all(ch in "0123456789abcdef" for ch in checkout):
+        return checkout
+    return None
+
+def built_commit(machine, directory):
+    result = remote.exec_sync(machine.public_ip_address, "git -C ~/work/{0} rev-parse HEAD".format(directory), check_exitcode = True, get_output = True)
+    return result.stdout.strip()
+
+def push(machine, name):
+    # Copies the archive from here to the machine, if it is kept here
+    if not os.path.exists(local_path(name)):
+        return False
+    remote.exec_sync(machine.public_ip_address, "mkdir -p {0}".format(REMOTE_ARTIFACT_DIRECTORY), check_exitcode = True)
+    remote.copy_to(machine.public_ip_address, False, local_path(name), remote_path(name))
+    return True
+
+def keep(machine, name):
+    # Copies the archive that the machine built to here
+    if not os.path.exists(local_path(name)):
+        os.makedirs(ARTIFACT_DIRECTORY, exist_ok = True)
+        remote.copy_from(machine.public_ip_address, False, remote_path(name), local_path(name) + ".tmp")
+        os.replace(local_path(name) + ".tmp", local_path(name))
+
+def pack_mage(machine, directory, name):
+    # The archive holds the directory's contents, not the directory, so that
+    # a commit built for one directory can be unpacked into another. Tar keeps
+    # the files' modification times, so make finds nothing to rebuild.
+    remote.exec_sync(machine.public_ip_address, "mkdir -p {0} && tar -C ~/work/{2} -czf {1}.tmp . && mv {1}.tmp {1}".format(REMOTE_ARTIFACT_DIRECTORY, remote_path(name), directory), check_exitcode = True)
+
+def unpack_mage_command(name, directory):
+    return "rm -rf ~/work/{1} && mkdir -p ~/work/{1} && tar -C ~/work/{1} -xzf {0}".format(remote_path(name), directory)
+
+@contextlib.contextmanager
+def serve(machine, timeout = 30, interval = 0.5):
+    # Serves the machine's archives over HTTP on its private address, once the
+    # server is accepting connections (wget does not retry refused ones)
+    result = remote.exec_sync(machine.public_ip_address, "cd {0} && (nohup python3 -m http.server {1} --bind {2} > /dev/null 2>&1 & echo $!)".format(REMOTE_ARTIFACT_DIRECTORY, ARTIFACT_PORT, machine.private_ip_address), check_exitcode = True, get_output = True)
+    pid = result.stdout.strip()
+    try:
+        start = time.time()
+        while remote.exec_sync(machine.public_ip_address, experiment.listening_check_command((ARTIFACT_PORT,))).returncode != 0:
+            if time.time() - start > timeout:
+                raise RuntimeError("Artifact server on {0} was not listening after {1} seconds".format(machine.public_ip_address, timeout))
+            time.sleep(interval)
+        yield "http://{0}:{1}".format(machine.private_ip_address, ARTIFACT_PORT)
+    finally:
+        remote.exec_sync(machine.public_ip_address, "kill {0}".format(pid))
+
+def fetch(machine, name, url):
+    # Puts the archive on the machine, downloading it from url if given and
+    # copying it from here otherwise
+    if url is None:
+        if not push(machine, name):
+            raise RuntimeError("Artifact {0} is not in {1}".format(name, ARTIFACT_DIRECTORY))
+        return
+    remote.exec_sync(machine.public_ip_address, "mkdir -p {0} && wget -q -O {1}.tmp {2}/{3} && mv {1}.tmp {1}".format(REMOTE_ARTIFACT_DIRECTORY, remote_path(name), url, name), check_exitcode = True)
@@ -0,0 +1,119 @@
+import collections
+import json
+import math
+import os
+import statistics
+
+# Searches experiment settings, such as the WAN settings (workers per node, OT
+# pipeline depth, and OT daemons), for the fastest by successive halving: every candidate is run a few
+# times, the slower half is dropped, and the survivors are run twice as many
+# times, until one remains. Most runs go to the candidates that are close, so
+# this finds the best settings in far fewer runs than running every candidate
+# the same number of times.
+
+TUNED_WAN_FILE = "tuned_wan.json"
+TUNED_PREFETCH_FILE = "tuned_prefetch.json"
+DEFAULT_ETA = 2
+
+WanSettings = collections.namedtuple("WanSettings", ("workers_per_node", "ot_pipeline_depth", "ot_num_daemons"))
+PrefetchSettings = collections.namedtuple("PrefetchSettings", ("prefetch_buffer_size", "prefetch_lookahead"))
+
+# The ranges searched by default, around the values that
+# populate_top_level_params in scripts/generate_configs.py uses
+DEFAULT_PREFETCH_BUFFER_SIZES = {"halfgates": (64, 128, 256, 512, 1024), "ckks": (4, 8, 16, 32, 64)}
+DEFAULT_PREFETCH_LOOKAHEADS = {"halfgates": (1000, 10000, 100000), "ckks": (10, 100, 1000)}
+
+def wan_settings(workers_per_node, ot_num_connections, ot_concurrency):
+    # The candidates, in the order run-wan would run them, without the
+    # duplicates that arise when ot_concurrency is rounded to a pipeline depth
+    candidates = []
+    for w in workers_per_node:
+        for ot_num_daemons in ot_num_connections:
+            for c in ot_concurrency:
+                settings = WanSettings(w, max(c // (ot_num_daemons * w), 1), ot_num_daemons)
+                if settings not in candidates:
+                    candidates.append(settings)
+    return candidates
+
+def prefetch_settings(buffer_sizes, lookaheads):
+    return [PrefetchSettings(b, l) for b in buffer_sizes for l in lookaheads]
+
+def successive_halving(candidates, measure, min_trials = 1, eta = DEFAULT_ETA):
+    # measure(candidate, trial) runs the given trial (numbered from 1) and
+    # returns its running time in ms, or None if it failed. Returns the best
+    # candidate and the times measured for every candidate.
+    times = {candidate: [] for candidate in candidates}
+    survivors = list(candidates)
+    trials = min_trials
+    while True:
+        for candidate in survivors:
+            while len(times[candidate]) < trials:
+                result = measure(candidate, len(times[candidate]) + 1)
+                times[candidate].append(math.inf if result is None else result)
+        survivors.sort(key = lambda candidate: statistics.median(times[candidate]))
+        print("Round with {0} trials: {1}".format(trials, ", ".join("{0} {1:.0f} ms".format(tuple(candidate), statistics.median(times[candidate])) for candidate in survivors)))
+        if len(survivors) == 1:
+            break
+        survivors = survivors[:max(1, len(survivors) // eta)]
+        trials *= eta
+    best = survivors[0]
+    if math.isinf(statistics.median(times[best])):
+        raise RuntimeError("Every candidate failed")
+    return (best, times)
+
+def count_runs(num_candidates, min_trials = 1, eta = DEFAULT_ETA):
+    # The number of runs that successive_halving makes
+    runs = 0
+    survivors = num_candidates
+    trials = min_trials
+    done = 0
+    while True:
+        runs += survivors * (trials - done)
+        if survivors <= 1:
+            return runs
+        survivors = max(1, survivors // eta)
+        done = trials
+        trials *= eta
+
+def load_tuned(filename):
+    try:
+        with open(filename, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def tuned_entry(keys, filename):
+    entry = load_tuned(filename)
+    for key in keys:
+        entry = entry.get(key, {})
+    return entry if len(entry) != 0 else None
+
+def save_tuned(keys, best, times, details, filename):
+    # Stores the best candidate's fields, and how it was found, under the
+    # nested keys
+    tuned = load_tuned(filename)
+    entry = dict(best._asdict())
+    entry["median_ms"] = statistics.median(times[best])
+    entry["trials"] = len(times[best])
+    entry["total_runs"] = sum(len(t) for t in times.values())
+    entry.update(details)
+    parent = tuned
+    for key in keys[:-1]:
+        parent = parent.setdefault(key, {})
+    parent[keys[-1]] = entry
+    with open(filename + ".tmp", "w") as f:
+        json.dump(tuned, f, indent = 4, sort_keys = True)
+    os.replace(filename + ".tmp", filename)
+
+def tuned_wan_settings(setup, location, program):
+    # setup is "wan" or "paired-wan"
+    entry = tuned_entry((setup, location, program), TUNED_WAN_FILE)
+    if entry is None:
+        return None
+    return WanSettings(entry["workers_per_node"], entry["ot_pipeline_depth"], entry["ot_num_daemons"])
+
+def tuned_prefetch_settings(protocol, mem_limit, program):
+    entry = tuned_entry((protocol, mem_limit, program), TUNED_PREFETCH_FILE)
+    if entry is None:
+        return None
+    return PrefetchSettings(entry["prefetch_buffer_size"], entry["prefetch_lookahead"])
@@ -10,6 +10,7 @@ import cluster
 SUBSCRIPTION_ID = "a8bdae60-f431-4620-bf0a-fad96eb36ca4"
 LOCATION = "westus2"
 MAGE_IMAGE_ID = "/subscriptions/a8bdae60-f431-4620-bf0a-fad96eb36ca4/resourceGroups/MAGE-2/providers/Microsoft.Compute/images/mage-deps-v7"
+IMAGE_RESOURCE_GROUP = "MAGE-2"
 
 credential = DefaultAzureCredential()
 
@@ -22,7 +23,7 @@ wdisk_name = lambda cluster_name, instance_id: vm_name(cluster_name, instance_id
 ip_name = lambda cluster_name, instance_id: vm_name(cluster_name, instance_id) + "-ip"
 nic_name = lambda cluster_name, instance_id: vm_name(cluster_name, instance_id) + "-nic"
 
-def spawn_cluster(c, name, count, image_name, disk_layout_name, use_large_work_disk = False, subscription_id = SUBSCRIPTION_ID, location = LOCATION):
+def spawn_cluster(c, name, count, image_name, disk_layout_name, use_large_work_disk = False, subscription_id = SUBSCRIPTION_ID, location = LOCATION, image_id = None):
     cloud_init_file = "cloud-init-azure.yaml"
     if disk_layout_name == "paired-noswap":
         cloud_init_file = "cloud-init-azure-paired.yaml"
@@ -149,7 +150,7 @@ def spawn_cluster(c, name, count, image_name, disk_layout_name, use_large_work_d
 
         if image_name == "mage":
             image_reference = {
-                "id": MAGE_IMAGE_ID
+                "id": MAGE_IMAGE_ID if image_id is None else image_id
             }
         else:
             image_reference = {
@@ -205,6 +206,31 @@ def spawn_cluster(c, name, count, image_name, disk_layout_name, use_large_work_d
 
     return c
 
+def image_names(subscription_id = SUBSCRIPTION_ID):
+    compute_client = ComputeManagementClient(credential, subscription_id)
+    return [image.name for image in compute_client.images.list_by_resource_group(IMAGE_RESOURCE_GROUP)]
+
+# Reference: https://docs.microsoft.com/en-us/azure/virtual-machines/linux/capture-image
+def capture_image(m, cluster_name, image_name, subscription_id = SUBSCRIPTION_ID, location = LOCATION):
+    # The machine must already have been deprovisioned (waagent -deprovision+user)
+    compute_client = ComputeManagementClient(credential, subscription_id)
+
+    resource_group = rg_name(cluster_name)
+
+    poller = compute_client.virtual_machines.begin_deallocate(resource_group, m.vm_name)
+    deallocate_result = poller.result()
+    compute_client.virtual_machines.generalize(resource_group, m.vm_name)
+
+    poller = compute_client.images.begin_create_or_update(IMAGE_RESOURCE_GROUP, image_name,
+    {
+        "location": location,
+        "source_virtual_machine": {
+            "id": m.vm_id
+        }
+    })
+    image_result = poller.result()
+    return image_result.id
+
 def deallocate_cluster(name, exception_if_not_exist = True, subscription_id = SUBSCRIPTION_ID):
     resource_client = ResourceManagementClient(credential, subscription_id)
 
@@ -0,0 +1,156 @@
+import json
+import os
+
+import configs
+import experiment
+import remote
+
+# Finds, for each protocol and memory limit, the largest num_pages for which
+# MAGE stays within the limit. populate_top_level_params in
+# scripts/generate_configs.py estimates num_pages from the limit with a fixed
+# allowance for everything besides the page frames; here the allowance and the
+# cost of each page are measured instead. MAGE's peak RSS is sampled at two
+# page counts with no memory limit and fit to rss = fixed_bytes + page_bytes *
+# num_pages. The safe page count is the largest n with fixed_bytes +
+# page_bytes * n within the limit, less a safety margin. That count is then
+# checked with one worker under the limit's cgroup, and backed off until MAGE
+# completes. Only that count, for one worker per node, is stored for configs
+# to use. For k workers per node, which share the node's cgroup, the fit gives
+# the largest n with k * (fixed_bytes + page_bytes * n) within the limit, but
+# these runs cannot check it, so it is recorded with the fit as extrapolated,
+# and configs for k > 1 keep the estimate from generate_configs.py.
+#
+# The calibration program must touch more pages than the largest page count
+# probed, or the fit will underestimate the cost of each page.
+
+# The cgroups that scripts/provision.sh creates, as memory limits
+CGROUP_LIMITS = ("1gb", "2gb", "4gb", "8gb", "16gb", "32gb")
+DEFAULT_LIMITS = CGROUP_LIMITS + ("max",)
+
+# The page counts probed are those that the formula gives for these limits
+PROBE_LIMITS = ("1gb", "4gb")
+
+DEFAULT_MARGIN = 0.05
+BACKOFF = 0.95
+MAX_BACKOFFS = 3
+
+CALIBRATION_DIRECTORY = "~/config-calibrate"
+
+def formula_num_pages(protocol, limit):
+    config = {}
+    configs.generate_configs.populate_top_level_params(protocol, "60gb" if limit == "max" else limit, 1, config)
+    return config["num_pages"]
+
+def limit_bytes(limit, machine_memory_bytes):
+    if limit == "max":
+        return machine_memory_bytes
+    return int(limit[:-2]) << 30
+
+def calibration_worker_ids(c, protocol):
+    if protocol == "halfgates":
+        return (0, c.num_lan_machines // 2)
+    return (0,)
+
+def machine_memory(c, worker_ids):
+    # Returns the smallest MemTotal among the machines, in bytes
+    def mem_total(machine, global_id):
+        result = remote.exec_sync(machine.public_ip_address, "grep MemTotal /proc/meminfo", check_exitcode = True, get_output = True)
+        return int(result.stdout.split()[1]) << 10
+    return min(c.for_each_concurrently(mem_total, worker_ids))
+
+def push_calibration_config(c, worker_ids, protocol, num_pages):
+    base_path = configs.generate_configs.config_path("max", protocol, 1, 1)
+    return configs.push_config_variant(c, worker_ids, base_path, {"num_pages": num_pages}, "{0}/{1}".format(CALIBRATION_DIRECTORY, num_pages))
+
+def peak_rss(c, worker_ids, log_name):
+    # Returns the largest RSS sampled for MAGE across the workers
+    def read_peak(machine, global_id):
+        result = remote.exec_sync(machine.public_ip_address, "python3 ~/sample_resources.py --dump ~/logs/{0}.samples".format(log_name), check_exitcode = True, get_output = True)
+        lines = result.stdout.splitlines()
+        column = lines[0].split(",").index("rss_bytes")
+        return max([int(line.split(",")[column]) for line in lines[1:]], default = 0)
+    return max(c.for_each_concurrently(read_peak, worker_ids))
+
+def completed(c, worker_ids, log_name):
+    # MAGE ends its log with the total running time, in ms, unless it was
+    # killed, and writes an empty .result file if its output was correct
+    def check(machine, global_id):
+        result = remote.exec_sync(machine.public_ip_address, "tail -n 1 ~/logs/{0}.log && (cat ~/logs/{0}.result 2>/dev/null || true)".format(log_name), get_output = True)
+        lines = result.stdout.splitlines()
+        return result.returncode == 0 and len(lines) == 1 and lines[0].endswith("ms")
+    return all(c.for_each_concurrently(check, worker_ids))
+
+def run_calibration(c, protocol, problem_name, problem_size, limit, num_pages, generate_fresh_input):
+    worker_ids = calibration_worker_ids(c, protocol)
+    config_file = push_calibration_config(c, worker_ids, protocol, num_pages)
+    log_name = "calibrate_{0}_{1}_{2}".format(protocol, limit, num_pages)
+    # A page count too large for the limit gets MAGE killed, which completed
+    # detects, so that is not an error here
+    experiment.run_lan_experiment(c, problem_name, problem_size, protocol, "mage", limit, worker_ids, log_name, 1, generate_fresh_input = generate_fresh_input, config_file = config_file, check_exitcode = False)
+    return log_name
+
+def fit(points):
+    # Least-squares fit of rss = fixed_bytes + page_bytes * num_pages
+    n = len(points)
+    mean_x = sum(x for x, y in points) / n
+    mean_y = sum(y for x, y in points) / n
+    variance = sum((x - mean_x) ** 2 for x, y in points)
+    if variance == 0:
+        raise RuntimeError("Need at least two distinct page counts to calibrate")
+    page_bytes = sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+    if page_bytes <= 0:
+        raise RuntimeError("Peak RSS did not grow with num_pages; use a larger calibration program")
+    return (mean_y - page_bytes * mean_x, page_bytes)
+
+def safe_num_pages(budget, fixed_bytes, page_bytes, workers_per_node, margin):
+    return int((budget * (1.0 - margin) / workers_per_node - fixed_bytes) // page_bytes)
+
+def calibrate_protocol(c, protocol, program, limits, workers_per_node, margin):
+    problem_name, problem_size = program
+    worker_ids = calibration_worker_ids(c, protocol)
+    machine_memory_bytes = machine_memory(c, worker_ids)
+
+    points = []
+    for probe_limit in PROBE_LIMITS:
+        num_pages = formula_num_pages(protocol, probe_limit)
+        log_name = run_calibration(c, protocol, problem_name, problem_size, "max", num_pages, len(points) == 0)
+        rss = peak_rss(c, worker_ids, log_name)
+        print("{0}: num_pages = {1}, peak RSS = {2:.1f} MiB".format(protocol, num_pages, rss / (1 << 20)))
+        points.append((num_pages, rss))
+    fixed_bytes, page_bytes = fit(points)
+    print("{0}: {1:.1f} MiB fixed + {2:.1f} KiB per page".format(protocol, fixed_bytes / (1 << 20), page_bytes / (1 << 10)))
+
+    num_pages = {}
+    extrapolated = {}
+    for limit in limits:
+        budget = limit_bytes(limit, machine_memory_bytes)
+        scale = 1.0
+        for attempt in range(MAX_BACKOFFS + 1):
+            candidate = int(safe_num_pages(budget, fixed_bytes, page_bytes, 1, margin) * scale)
+            if candidate <= 0:
+                raise RuntimeError("{0} is too small to run {1} with MAGE".format(limit, protocol))
+            log_name = run_calibration(c, protocol, problem_name, problem_size, limit, candidate, False)
+            if completed(c, worker_ids, log_name):
+                break
+            print("{0} with {1}: num_pages = {2} did not complete".format(protocol, limit, candidate))
+            scale *= BACKOFF
+        else:
+            raise RuntimeError("Could not find a safe num_pages for {0} with {1}".format(protocol, limit))
+        num_pages[limit] = {"1": candidate}
+        extrapolated[limit] = {str(k): int(safe_num_pages(budget, fixed_bytes, page_bytes, k, margin) * scale) for k in workers_per_node if k != 1}
+        print("{0} with {1}: num_pages = {2} (formula gives {3})".format(protocol, limit, candidate, formula_num_pages(protocol, limit)))
+
+    fitted = {"fixed_bytes": fixed_bytes, "page_bytes": page_bytes, "probes": points, "machine_memory_bytes": machine_memory_bytes, "margin": margin, "extrapolated_num_pages": extrapolated}
+    return (num_pages, fitted)
+
+def save_calibration(protocol, num_pages, fitted, filename = configs.CALIBRATION_FILE):
+    # Merges the results for this protocol into the calibration file
+    calibration = {"num_pages": {}, "fits": {}}
+    if os.path.exists(filename):
+        with open(filename, "r") as f:
+            calibration = json.load(f)
+    calibration.setdefault("num_pages", {}).setdefault(protocol, {}).update(num_pages)
+    calibration.setdefault("fits", {})[protocol] = fitted
+    with open(filename + ".tmp", "w") as f:
+        json.dump(calibration, f, indent = 4, sort_keys = True)
+    os.replace(filename + ".tmp", filename)
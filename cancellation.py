@@ -0,0 +1,83 @@
+import contextlib
+import threading
+import time
+
+# Lets a task of run_concurrently (in cluster.py) give up as soon as another
+# task of the same call fails, instead of waiting out its timeout for peers
+# that will never start. run_concurrently gives each call an event, which it
+# sets with cancel when a task fails, and runs each task with the events of
+# every call it is nested in. The loops that wait on other machines check
+# them, and the processes that tasks wait on (e.g., ssh running a command on
+# a machine) are killed.
+
+class Cancelled(RuntimeError):
+    pass
+
+context = threading.local()
+
+# Maps each event to the processes started by tasks that it cancels
+process_lock = threading.Lock()
+processes = {}
+
+def current_events():
+    return getattr(context, "events", ())
+
+def run_with(events, function):
+    previous = current_events()
+    context.events = events
+    try:
+        check()
+        return function()
+    finally:
+        context.events = previous
+
+def shielded(function):
+    # Runs function as if it were not in any task, e.g., to clean up after one
+    return run_with((), function)
+
+def cancel(event):
+    with process_lock:
+        event.set()
+        to_kill = [process for process in processes.get(event, ())]
+    for process in to_kill:
+        try:
+            process.kill()
+        except OSError:
+            pass
+
+@contextlib.contextmanager
+def killed_on_cancel(process):
+    # Kills the process if the task is cancelled while this is in effect
+    events = current_events()
+    with process_lock:
+        for event in events:
+            processes.setdefault(event, set()).add(process)
+        if any(event.is_set() for event in events):
+            process.kill()
+    try:
+        yield process
+    finally:
+        with process_lock:
+            for event in events:
+                registered = processes[event]
+                registered.discard(process)
+                if len(registered) == 0:
+                    del processes[event]
+
+def check():
+    if any(event.is_set() for event in current_events()):
+        raise Cancelled("Cancelled because another task failed")
+
+def sleep(seconds, poll_interval = 0.5):
+    # Like time.sleep, but raises Cancelled as soon as the task is cancelled
+    events = current_events()
+    if len(events) == 0:
+        time.sleep(seconds)
+        return
+    deadline = time.time() + seconds
+    while True:
+        check()
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+        events[-1].wait(min(remaining, poll_interval))
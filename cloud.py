@@ -1,7 +1,60 @@
+import json
+import os
+import re
 import threading
+import time
+import cancellation
 import cluster
 import azure_cloud
 import google_cloud
+import remote
+
+# Written by "magebench.py bake-image"; "spawn -i" uses the images it lists,
+# falling back to MAGE_IMAGE_ID on Azure and the newest image in the family on
+# Google Cloud
+BAKED_IMAGES_FILE = "images.json"
+IMAGE_NAME_FORMAT = "mage-deps-v{0}"
+IMAGE_NAME_PATTERN = re.compile(r"^mage-deps-v(\d+)$")
+
+def load_baked_images(filename = BAKED_IMAGES_FILE):
+    try:
+        with open(filename, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_baked_images(entries, filename = BAKED_IMAGES_FILE):
+    # Merges the entries, one for each provider, into the file
+    images = load_baked_images(filename)
+    images.update(entries)
+    with open(filename + ".tmp", "w") as f:
+        json.dump(images, f, indent = 4, sort_keys = True)
+    os.replace(filename + ".tmp", filename)
+
+def baked_image_id(provider):
+    entry = load_baked_images().get(provider)
+    return None if entry is None else entry["id"]
+
+def next_image_version(providers, project_gcloud):
+    # One more than the newest version on any of the providers, so that an
+    # image baked from the same code has the same name on each
+    names = []
+    if "azure" in providers:
+        names.extend(azure_cloud.image_names())
+    if "gcloud" in providers:
+        names.extend(google_cloud.image_names(project_gcloud))
+    versions = [int(match.group(1)) for match in map(IMAGE_NAME_PATTERN.match, names) if match is not None]
+    return max(versions, default = 0) + 1
+
+def capture_image(c, m, image_name, project_gcloud):
+    # Turns the machine into an image, after which it cannot be used
+    if m.provider == "azure":
+        # This removes the mage user, which may end the SSH session with an
+        # error; exec_probe tolerates that, where exec_sync would exit
+        remote.exec_probe(m.public_ip_address, "sudo waagent -deprovision+user -force")
+        return azure_cloud.capture_image(m, c.name, image_name)
+    else:
+        return google_cloud.capture_image(m, image_name, project_gcloud)
 
 def spawn_cluster(name, num_lan_machines, image_name, use_large_work_disk, setup, project_gcloud, *wan_machine_locations):
     num_wan_machines = len(set(wan_machine_locations))
@@ -31,7 +84,7 @@ def spawn_cluster(name, num_lan_machines, image_name, use_large_work_disk, setup
     def init(_, id):
         if id == 0 and num_lan_machines > 0:
             # Initializes all machines from indices 0 to num_lan_machines - 1
-            azure_cloud.spawn_cluster(c, name, num_lan_machines, image_name, setup, use_large_work_disk)
+            azure_cloud.spawn_cluster(c, name, num_lan_machines, image_name, setup, use_large_work_disk, image_id = baked_image_id("azure"))
         elif id >= num_lan_machines:
             if setup in ("paired-swap", "paired-noswap"):
                 wan_index = (id // num_lan_machines) - 1
@@ -42,7 +95,7 @@ def spawn_cluster(name, num_lan_machines, image_name, use_large_work_disk, setup
                     gcp_instance_name = "{0}-{1}-{2}".format(name, wan_location, location_id)
                     if (id % num_lan_machines) == 0:
                         c.location_to_id[wan_location] = id
-                    google_cloud.spawn_instance(c.machines[id], gcp_instance_name, "n2-highmem-4", 2, image_name, setup, *region_zone, project_gcloud)
+                    google_cloud.spawn_instance(c.machines[id], gcp_instance_name, "n2-highmem-4", 2, image_name, setup, *region_zone, project_gcloud, baked_image_id("gcloud"))
             else:
                 wan_index = id - num_lan_machines
                 wan_location = wan_machine_locations[wan_index]
@@ -50,7 +103,7 @@ def spawn_cluster(name, num_lan_machines, image_name, use_large_work_disk, setup
                 with gcp_lock:
                     gcp_instance_name = "{0}-{1}".format(name, wan_location)
                     c.location_to_id[wan_location] = id
-                    google_cloud.spawn_instance(c.machines[id], gcp_instance_name, "n2-highcpu-2", 1, image_name, setup, *region_zone, project_gcloud)
+                    google_cloud.spawn_instance(c.machines[id], gcp_instance_name, "n2-highcpu-2", 1, image_name, setup, *region_zone, project_gcloud, baked_image_id("gcloud"))
 
     c.for_each_concurrently(init)
     c.num_lan_machines = num_lan_machines
@@ -61,7 +114,7 @@ def deallocate_cluster(c):
     gcp_lock = threading.Lock()
 
     def deallocate(m, id):
-        if id == 0:
+        if id == 0 and c.num_lan_machines > 0:
             azure_cloud.deallocate_cluster(c.name)
         elif id >= c.num_lan_machines:
             with gcp_lock:
@@ -88,3 +141,34 @@ def deallocate_cluster_by_info(name, num_lan_machines, setup, *wan_machine_locat
         else:
             vm_name = "-".join((name, wan_machine_locations[i]))
             google_cloud.deallocate_instance_by_info(target_zone, vm_name)
+
+# Block devices that cloud-init creates for each disk layout (see the
+# cloud-init-*.yaml files); provision.sh expects all of them to exist.
+def expected_block_devices(m, setup):
+    if m.provider == "azure":
+        if setup == "paired-noswap":
+            return ("/dev/disk/cloud/azure_resource-part1",)
+        elif setup == "paired-swap":
+            return ("/dev/disk/cloud/azure_resource-part1", "/dev/disk/cloud/azure_resource-part2")
+        else:
+            return ("/dev/disk/cloud/azure_resource-part2", "/dev/disk/cloud/azure_resource-part3")
+    else:
+        if setup in ("paired-noswap", "paired-swap"):
+            return ("/dev/nvme0n1p1", "/dev/nvme0n2p1")
+        else:
+            return ("/dev/nvme0n1p2", "/dev/nvme0n1p3")
+
+def wait_for_machine(m, setup, timeout = 900, interval = 5):
+    checks = ["cloud-init status | grep -q 'status: done'"]
+    checks.extend("test -b {0}".format(device) for device in expected_block_devices(m, setup))
+    command = " && ".join(checks)
+    start = time.time()
+    while not remote.exec_probe(m.public_ip_address, command):
+        if remote.exec_probe(m.public_ip_address, "cloud-init status | grep -q 'status: error'"):
+            # The machine will never be ready, so don't wait out the timeout
+            result = remote.exec_sync(m.public_ip_address, "cloud-init status --long; sudo tail -n 20 /var/log/cloud-init-output.log", get_output = True)
+            raise RuntimeError("cloud-init failed on machine {0}:\n{1}".format(m.vm_name, result.stdout))
+        if time.time() - start > timeout:
+            raise RuntimeError("Machine {0} was not ready after {1} seconds".format(m.vm_name, timeout))
+        cancellation.sleep(interval)
+    return time.time() - start
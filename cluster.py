@@ -1,7 +1,60 @@
+import concurrent.futures
 import json
 import threading
+import time
 import types
 
+import cancellation
+
+class TaskError(RuntimeError):
+    def __init__(self, key, cause):
+        super().__init__("Task {0} failed: {1!r}".format(key, cause))
+        self.key = key
+        self.cause = cause
+
+def run_concurrently(tasks, max_concurrency = None, timings = None):
+    # Runs each (key, function) pair in a thread pool and returns the results
+    # in order. If any task fails, tasks that have not started yet are
+    # cancelled, running ones are cancelled at their next wait and have the
+    # processes they wait on killed (see cancellation.py), and the failure is
+    # raised once they return. The
+    # default is to run every task at once, which callers whose tasks must
+    # all be running at the same time (e.g., the workers of one experiment)
+    # rely on.
+    tasks = list(tasks)
+    if len(tasks) == 0:
+        return []
+    if max_concurrency is None:
+        max_concurrency = len(tasks)
+    cancelled = threading.Event()
+    events = cancellation.current_events() + (cancelled,)
+    def timed(key, function):
+        start = time.time()
+        try:
+            return cancellation.run_with(events, function)
+        finally:
+            if timings is not None:
+                timings[key] = time.time() - start
+    results = [None for _ in tasks]
+    with concurrent.futures.ThreadPoolExecutor(max_workers = min(max_concurrency, len(tasks))) as executor:
+        futures = {executor.submit(timed, key, function): i for i, (key, function) in enumerate(tasks)}
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                i = futures[future]
+                error = future.exception()
+                if error is None:
+                    results[i] = future.result()
+                elif isinstance(error, Exception):
+                    raise TaskError(tasks[i][0], error) from error
+                else:
+                    raise error # e.g., SystemExit from remote.exec_sync
+        except BaseException:
+            cancellation.cancel(cancelled)
+            for future in futures:
+                future.cancel()
+            raise
+    return results
+
 class Machine(object):
     def __init__(self):
         self.public_ip_address = None
@@ -52,30 +105,18 @@ class Cluster(object):
                 machines.append(self.location_to_id[loc])
         return machines
 
-    def for_each_concurrently(self, predicate, ids = None):
+    def for_each_concurrently(self, predicate, ids = None, max_concurrency = None, timings = None):
         if ids is None:
             ids = range(len(self.machines))
-        threads = [None for _ in ids]
-        def iteration(i, id):
-            threads[i] = threading.Thread(target = lambda: predicate(self.machines[id], id))
-            threads[i].start()
-        for i, id in enumerate(ids):
-            iteration(i, id)
-        for t in threads:
-            t.join()
+        tasks = [(id, lambda id = id: predicate(self.machines[id], id)) for id in ids]
+        return run_concurrently(tasks, max_concurrency, timings)
 
-    def for_each_multiple_concurrently(self, predicate, times, ids = None):
+    def for_each_multiple_concurrently(self, predicate, times, ids = None, max_concurrency = None, timings = None):
         if ids is None:
             ids = range(len(self.machines))
-        threads = [[None for _ in range(times)] for _ in ids]
-        for i, id in enumerate(ids):
-            for j in range(times):
-                t = threading.Thread(target = lambda: predicate(self.machines[id], id, j))
-                threads[i][j] = t
-                t.start()
-        for lst in threads:
-            for t in lst:
-                t.join()
+        tasks = [((id, j), lambda id = id, j = j: predicate(self.machines[id], id, j)) for id in ids for j in range(times)]
+        results = run_concurrently(tasks, max_concurrency, timings)
+        return [results[i * times:(i + 1) * times] for i in range(len(ids))]
 
     def as_dict(self):
         d = dict(self.__dict__)
@@ -0,0 +1,117 @@
+import concurrent.futures
+import gzip
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import tarfile
+
+import yaml
+
+import remote
+
+# The config generators in scripts/generate_configs.py, which is a standalone
+# script so that it can also be run on the nodes
+spec = importlib.util.spec_from_file_location("generate_configs", os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts", "generate_configs.py"))
+generate_configs = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(generate_configs)
+
+# Written by "magebench.py calibrate"; see calibration.py
+CALIBRATION_FILE = "calibration.json"
+
+# libyaml's emitter produces the same YAML as the pure-Python one, only faster
+Dumper = getattr(yaml, "CDumper", yaml.Dumper)
+
+def dump_config(config_dict):
+    return yaml.dump(config_dict, Dumper = Dumper, sort_keys = False, default_flow_style = False).encode()
+
+def load_calibration(filename = CALIBRATION_FILE):
+    # Returns the calibrated num_pages for each protocol, memory bound, and
+    # number of workers per node, or an empty dictionary if there are none
+    try:
+        with open(filename, "r") as f:
+            return json.load(f).get("num_pages", {})
+    except FileNotFoundError:
+        return {}
+
+def config_sets(cluster, global_id):
+    # Returns (id, lan/location, directory, no_swap_drive) for each set of
+    # configs that the machine needs
+    sets = []
+    if global_id < cluster.num_lan_machines:
+        sets.append((global_id, "lan", "config", cluster.setup.startswith("paired")))
+    if cluster.setup in ("paired-noswap", "paired-swap"):
+        for location, loc_id in cluster.location_to_id.items():
+            if global_id in range(cluster.num_lan_machines) or global_id in range(loc_id, loc_id + cluster.num_lan_machines):
+                sets.append((global_id, "{0}-paired".format(location), "config-{0}-paired".format(location), False))
+    else:
+        for location, loc_id in cluster.location_to_id.items():
+            if global_id == 0 or global_id == loc_id:
+                sets.append((0, location, "config-{0}".format(location), False))
+    return sets
+
+def render_config(cluster_dict, id, location, no_swap_drive, path, calibration = None):
+    paths, config = generate_configs.config_generator(cluster_dict, id, location, no_swap_drive, calibration)
+    return dump_config(config(path))
+
+def render_config_archive(cluster_dict, sets, calibration = None):
+    # Returns a gzipped tar archive with a directory for each set of configs.
+    # The archive's bytes depend only on the configs, so its digest identifies
+    # them.
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj = buffer, mode = "wb", mtime = 0) as compressed, tarfile.open(fileobj = compressed, mode = "w") as archive:
+        for id, location, directory, no_swap_drive in sets:
+            paths, config = generate_configs.config_generator(cluster_dict, id, location, no_swap_drive, calibration)
+            for path in paths():
+                data = dump_config(config(path))
+                info = tarfile.TarInfo(os.path.join(directory, path))
+                info.size = len(data)
+                info.mode = 0o644
+                archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+def install_command(digest):
+    # Unpacks the archive on stdin into ~/.configs/<digest>, then points each
+    # ~/config* directory at it by renaming a symlink over it, so that an
+    # experiment never sees a partially-written set of configs
+    generation = "~/.configs/{0}".format(digest)
+    return " && ".join((
+        "rm -rf {0} {0}.tmp".format(generation),
+        "mkdir -p {0}.tmp".format(generation),
+        "tar -xzf - -C {0}.tmp".format(generation),
+        "mv {0}.tmp {0}".format(generation),
+        "for d in {0}/*; do n=$(basename $d); if [ -d ~/$n ] && [ ! -L ~/$n ]; then rm -rf ~/$n; fi; ln -sfn $d ~/$n.link && mv -Tf ~/$n.link ~/$n; done".format(generation),
+        "find ~/.configs -mindepth 1 -maxdepth 1 ! -name {0} -exec rm -rf {{}} +".format(digest),
+    ))
+
+def push_configs(c, max_concurrency = None):
+    # Renders every machine's configs here, in parallel, and sends each machine
+    # its configs as one archive
+    cluster_dict = c.as_dict()
+    calibration = load_calibration()
+    ids = [id for id in range(len(c.machines)) if len(config_sets(c, id)) != 0]
+    with concurrent.futures.ProcessPoolExecutor() as pool:
+        archives = dict(zip(ids, pool.map(render_config_archive, [cluster_dict] * len(ids), [config_sets(c, id) for id in ids], [calibration] * len(ids))))
+
+    def push(machine, id):
+        archive = archives[id]
+        digest = hashlib.sha256(archive).hexdigest()[:16]
+        remote.exec_sync(machine.public_ip_address, install_command(digest), check_exitcode = True, input_data = archive)
+        return len(archive)
+    return dict(zip(ids, c.for_each_concurrently(push, ids, max_concurrency)))
+
+def push_config_variant(c, node_ids, base_path, overrides, directory):
+    # Pushes, as directory/base_path on each of the LAN machines, its config
+    # at base_path with the given fields replaced, and returns that path
+    cluster_dict = c.as_dict()
+    calibration = load_calibration()
+    config_file = "{0}/{1}".format(directory, base_path)
+    def push(machine, global_id):
+        id, location, config_directory, no_swap_drive = config_sets(c, global_id)[0]
+        paths, config = generate_configs.config_generator(cluster_dict, id, location, no_swap_drive, calibration)
+        config_dict = config(base_path)
+        config_dict.update(overrides)
+        remote.exec_sync(machine.public_ip_address, "mkdir -p $(dirname {0}) && cat > {0}.tmp && mv {0}.tmp {0}".format(config_file), check_exitcode = True, input_data = dump_config(config_dict))
+    c.for_each_concurrently(push, node_ids)
+    return config_file
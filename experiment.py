@@ -1,4 +1,10 @@
+import contextlib
+import sys
+import threading
 import time
+
+import cancellation
+import configs
 import remote
 
 def wan_party_from_global_id(cluster, global_id):
@@ -13,13 +19,288 @@ def party_from_global_id(cluster, global_id):
     else:
         return 1 # garbler
 
+# These match the ports that scripts/generate_configs.py assigns to worker i.
+# Workers listen on their internal port for the other workers in their party,
+# and evaluator workers listen on their external port for the garbler workers.
+INTERNAL_PORT_BASE = 56000
+EXTERNAL_PORT_BASE = 57000
+
+# The EMP baseline's evaluator listens on this port (see run_halfgates_baseline.sh).
+EMP_PORT = 50000
+
+def lan_party_machine_ids(cluster, global_id, workers_per_party):
+    # Mirrors how generate_config_dict in scripts/generate_configs.py pairs up machines
+    allocated_workers_per_party = cluster.num_lan_machines // 2
+    first_worker_id = workers_per_party * (global_id // workers_per_party)
+    if first_worker_id < allocated_workers_per_party:
+        evaluator_ids = range(first_worker_id, first_worker_id + workers_per_party)
+        garbler_ids = range(first_worker_id + allocated_workers_per_party, first_worker_id + allocated_workers_per_party + workers_per_party)
+    else:
+        evaluator_ids = range(first_worker_id - allocated_workers_per_party, first_worker_id - allocated_workers_per_party + workers_per_party)
+        garbler_ids = range(first_worker_id, first_worker_id + workers_per_party)
+    return (evaluator_ids, garbler_ids)
+
+def listening_check_command(ports, program = None):
+    # If program is given, the listener must be a process with that name
+    # (seeing other users' processes takes sudo)
+    if program is None:
+        return " && ".join("ss -Hltn 'sport = :{0}' | grep -q .".format(port) for port in ports)
+    return " && ".join("sudo ss -Hltnp 'sport = :{0}' | grep -q '\"{1}\"'".format(port, program) for port in ports)
+
+def wait_for_listeners(cluster, endpoints, timeout = 1800, interval = 1, program = None):
+    # endpoints maps global machine IDs to the ports that must be accepting
+    # connections there. Callers kill any of the program's processes left
+    # over from an earlier run before launching it (see kill_programs), so
+    # a listener that is the program is the one just launched.
+    pending = {id: tuple(ports) for id, ports in endpoints.items() if len(ports) != 0}
+    start = time.time()
+    while True:
+        for id, ports in tuple(pending.items()):
+            if remote.exec_sync(cluster.machines[id].public_ip_address, listening_check_command(ports, program)).returncode == 0:
+                del pending[id]
+        if len(pending) == 0:
+            return time.time() - start
+        if time.time() - start > timeout:
+            raise RuntimeError("Timed out waiting for listeners: {0}".format(pending))
+        cancellation.sleep(interval)
+
+def wait_for_party_start(cluster, party, worker_id, party_machine_ids, evaluator_machine_ids = None):
+    # A worker starts once the lower-numbered workers of its party are listening,
+    # and a garbler worker additionally waits for every evaluator worker
+    endpoints = {}
+    for j in range(worker_id):
+        endpoints.setdefault(party_machine_ids[j], []).append(INTERNAL_PORT_BASE + j)
+    if party == 1 and evaluator_machine_ids is not None:
+        for j, machine_id in enumerate(evaluator_machine_ids):
+            endpoints.setdefault(machine_id, []).append(EXTERNAL_PORT_BASE + j)
+    wait_for_listeners(cluster, endpoints, program = "mage")
+
+def worker_ports(num_workers):
+    return [INTERNAL_PORT_BASE + i for i in range(num_workers)] + [EXTERNAL_PORT_BASE + i for i in range(num_workers)]
+
+def time_wait_check_command(ports):
+    return "ss -Htan state time-wait '( {0} )' | grep -q .".format(" or ".join("sport = :{0}".format(port) for port in ports))
+
+def wait_for_time_wait(cluster, node_ids, ports, timeout = 120, interval = 2):
+    # Sockets from the previous experiment linger in TIME-WAIT for up to a
+    # minute, and MAGE cannot bind its ports until they are gone. Only wait if
+    # one of the ports this experiment needs is actually still in TIME-WAIT.
+    command = time_wait_check_command(ports)
+    pending = list(node_ids)
+    start = time.time()
+    while True:
+        pending = [id for id in pending if remote.exec_sync(cluster.machines[id].public_ip_address, command).returncode == 0]
+        if len(pending) == 0:
+            return time.time() - start
+        if time.time() - start > timeout:
+            raise RuntimeError("Ports {0} still in TIME-WAIT on machines {1} after {2} seconds".format(ports, pending, timeout))
+        cancellation.sleep(interval)
+
+# Where "magebench.py fetch-logs --archive" moves the logs it fetched
+ARCHIVED_LOGS_DIRECTORY = "~/logs-fetched"
+
+def list_log_files(cluster, node_ids = None):
+    # Lists, for each machine, its non-empty logs and its empty .result files,
+    # which run_mage.sh leaves when MAGE's output was correct, including those
+    # that "magebench.py fetch-logs --archive" has moved aside
+    if node_ids is None:
+        node_ids = range(len(cluster.machines))
+    def list_logs(machine, id):
+        result = remote.exec_sync(machine.public_ip_address, "find ~/logs {0} -maxdepth 1 -type f \\( \\( -name '*.log' ! -empty \\) -o \\( -name '*.result' -empty \\) \\) -printf '%f\\n' 2> /dev/null".format(ARCHIVED_LOGS_DIRECTORY), get_output = True)
+        return set(result.stdout.split())
+    return dict(zip(node_ids, cluster.for_each_concurrently(list_logs, node_ids)))
+
+def logs_present(log_files, log_name, expect_result = True):
+    # WAN experiments write one log per worker, named <log_name>_w<worker>.log.
+    # MAGE also checks its output on at least one machine, so unless the run
+    # was a baseline, an empty .result must be there too.
+    def present(extension):
+        for files in log_files.values():
+            if log_name + extension in files:
+                return True
+            for file in files:
+                if file.startswith(log_name + "_w") and file.endswith(extension):
+                    return True
+        return False
+    return present(".log") and (not expect_result or present(".result"))
+
+def wan_node_ids(cluster, location, nodes_per_party):
+    # The Azure machines, then the machines at the given location
+    return list(range(nodes_per_party)) + list(range(cluster.location_to_id[location], cluster.location_to_id[location] + nodes_per_party))
+
+def worker_total_times_ms(cluster, node_ids, log_pattern):
+    # Returns the running time, in ms, that each worker printed at the end of
+    # its log, given a shell pattern for the log names (e.g., log_name + "_w*"
+    # for a WAN experiment); a worker that did not finish has none
+    def read_times(machine, global_id):
+        result = remote.exec_sync(machine.public_ip_address, "for f in ~/logs/{0}.log; do tail -n 1 $f; done".format(log_pattern), get_output = True)
+        times = []
+        for line in result.stdout.splitlines():
+            tokens = line.split()
+            if len(tokens) == 2 and tokens[1] == "ms" and tokens[0].isdigit():
+                times.append(int(tokens[0]))
+        return times
+    return [t for times in cluster.for_each_concurrently(read_times, node_ids) for t in times]
+
+# The second MAGE checkout that "magebench.py ab" compares against ~/work/mage
+MAGE_B_DIRECTORY = "mage-b"
+
+# Configs known to exist on each machine, as (ip_address, config_file) pairs
+config_lock = threading.Lock()
+present_configs = set()
+
+def ensure_config(cluster, node_ids, config_file):
+    # When configs are generated lazily (see provision_cluster in
+    # magebench.py), each one is rendered here the first time an experiment
+    # needs it on a machine, and reused afterwards
+    def ensure(machine, global_id):
+        key = (machine.public_ip_address, config_file)
+        with config_lock:
+            if key in present_configs:
+                return
+        for id, location, directory, no_swap_drive in configs.config_sets(cluster, global_id):
+            prefix = "~/{0}/".format(directory)
+            if config_file.startswith(prefix):
+                data = configs.render_config(cluster.as_dict(), id, location, no_swap_drive, config_file[len(prefix):], configs.load_calibration())
+                remote.exec_sync(machine.public_ip_address, "test -e {0} || (mkdir -p $(dirname {0}) && cat > {0}.tmp && mv {0}.tmp {0})".format(config_file), check_exitcode = True, input_data = data)
+                break
+        else:
+            raise RuntimeError("Machine {0} has no configs matching {1}".format(global_id, config_file))
+        with config_lock:
+            present_configs.add(key)
+    cluster.for_each_concurrently(ensure, node_ids)
+
 def clear_memory_caches(cluster, node_ids):
     cluster.for_each_concurrently(lambda machine, id: remote.exec_sync(machine.public_ip_address, "sudo swapoff -a; sudo sync; echo 3 | sudo tee /proc/sys/vm/drop_caches"), node_ids)
 
 def clear_output_files(cluster, node_ids, prefix):
     cluster.for_each_concurrently(lambda machine, id: remote.exec_sync(machine.public_ip_address, "rm -f ~/work/mage/bin/{0}* ~/work/scratch/*".format(prefix)), node_ids)
 
-def run_paired_wan_experiment(cluster, problem_name, problem_size, scenario, mem_limit, location, log_name, workers_per_node, nodes_per_party, ot_pipeline_depth, ot_num_daemons, generate_fresh_input = True, generate_fresh_memprog = True):
+# How often scripts/sample_resources.py samples each node's resource usage
+# while MAGE runs; 0 turns sampling off.
+SAMPLE_INTERVAL_MS = 200
+
+class WorkerProgress(object):
+    # Parses a worker's MAGE log one line at a time, following the format
+    # that MageMeasurement in graphs.ipynb reads.
+    def __init__(self, label):
+        self.label = label
+        self.start = time.time()
+        self.num_lines = 0
+        self.stats = {} # Maps each stat name to [count, sum in ns]
+        self.computation_ms = None
+        self.total_ms = None
+        self.reported_lines = 0
+        self.reported_time = self.start
+
+    def feed(self, line):
+        self.num_lines += 1
+        tokens = line.split()
+        if len(tokens) >= 18 and tokens[1] == "(ns)" and tokens[17].isdigit():
+            stats = self.stats.setdefault(tokens[0], [0, 0])
+            stats[0] += 1
+            stats[1] += int(tokens[17])
+        elif len(tokens) == 3 and tokens[0] == "Timer:" and tokens[2] == "ns" and tokens[1].isdigit():
+            self.computation_ms = int(tokens[1]) / 1000000.0
+        elif len(tokens) == 2 and tokens[1] == "ms" and tokens[0].isdigit():
+            self.total_ms = int(tokens[0])
+
+    def report(self):
+        now = time.time()
+        rate = (self.num_lines - self.reported_lines) / max(now - self.reported_time, 0.001)
+        self.reported_lines = self.num_lines
+        self.reported_time = now
+        summary = "{0}: {1:.0f} s, {2} lines ({3:.1f}/s)".format(self.label, now - self.start, self.num_lines, rate)
+        if len(self.stats) != 0:
+            summary += ", " + ", ".join("{0} {1:.3f} s".format(name, total / 1000000000.0) for name, (count, total) in sorted(self.stats.items()))
+        if self.computation_ms is not None:
+            summary += ", computation {0:.3f} s".format(self.computation_ms / 1000.0)
+        if self.total_ms is not None:
+            summary += ", done in {0:.3f} s".format(self.total_ms / 1000.0)
+        return summary
+
+class LogStreamer(object):
+    # Runs commands that write a MAGE log while following the log over the
+    # same SSH connection, and prints every worker's progress periodically.
+    def __init__(self, interval = 10):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.workers = []
+        self.stopped = threading.Event()
+        self.reporter = None
+
+    def __enter__(self):
+        self.reporter = threading.Thread(target = self.report_until_stopped, daemon = True)
+        self.reporter.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.reporter.join()
+        self.print_progress()
+
+    def print_progress(self):
+        with self.lock:
+            for worker in self.workers:
+                print(worker.report())
+        sys.stdout.flush()
+
+    def report_until_stopped(self):
+        while not self.stopped.wait(self.interval):
+            self.print_progress()
+
+    def run(self, ip_address, command, log_name, label, check_exitcode = False):
+        # The old log is removed first so that tail does not replay it, and
+        # tail exits once the command does. The command's own output goes to
+        # stderr, leaving stdout for the log, and the exit status is the
+        # command's.
+        log_file = "~/logs/{0}.log".format(log_name)
+        process = remote.exec_async(ip_address, "rm -f {0}; {1} 1>&2 & tail -n +1 -F --pid=$! {0} 2>/dev/null; wait $!".format(log_file, command))
+        progress = WorkerProgress(label)
+        with self.lock:
+            self.workers.append(progress)
+
+        def forward_stderr():
+            for line in process.stderr:
+                sys.stderr.buffer.write(line)
+            sys.stderr.flush()
+        forwarder = threading.Thread(target = forward_stderr, daemon = True)
+        forwarder.start()
+
+        with cancellation.killed_on_cancel(process):
+            for line in process.stdout:
+                with self.lock:
+                    progress.feed(line.decode(errors = "replace"))
+            process.wait()
+        forwarder.join()
+        cancellation.check()
+        if check_exitcode and process.returncode != 0:
+            raise RuntimeError("{0} exited with status {1}".format(label, process.returncode))
+        return process
+
+def kill_programs(cluster, node_ids, programs):
+    # Also run before each experiment, since a program left over from a
+    # crashed run could hold the ports and be taken for one of this run's
+    # workers by wait_for_listeners
+    def kill(machine, global_id):
+        remote.exec_sync(machine.public_ip_address, "sudo pkill -x '{0}'".format("|".join(programs)))
+    try:
+        cancellation.shielded(lambda: cluster.for_each_concurrently(kill, node_ids))
+    except Exception as e:
+        print("Could not kill {0} on machines {1}: {2}".format(", ".join(programs), list(node_ids), e))
+
+@contextlib.contextmanager
+def killed_on_failure(cluster, node_ids, programs):
+    # If a worker fails, its peers would wait for it forever. Cancelling them
+    # only kills their SSH sessions, which leaves the programs running on the
+    # machines, so they are killed there too.
+    try:
+        yield
+    except BaseException:
+        kill_programs(cluster, node_ids, programs)
+        raise
+
+def run_paired_wan_experiment(cluster, problem_name, problem_size, scenario, mem_limit, location, log_name, workers_per_node, nodes_per_party, ot_pipeline_depth, ot_num_daemons, generate_fresh_input = True, generate_fresh_memprog = True, streamer = None, sample_interval_ms = SAMPLE_INTERVAL_MS):
     protocol = "halfgates"
     program_name = "{0}_{1}".format(problem_name, problem_size)
     config_file = "~/config-{0}-paired/{1}/config_{2}_{3}_{4}_{5}.yaml".format(location, mem_limit if scenario == "mage" else "unbounded", protocol, workers_per_node * nodes_per_party, ot_pipeline_depth, ot_num_daemons)
@@ -32,18 +313,20 @@ def run_paired_wan_experiment(cluster, problem_name, problem_size, scenario, mem
     elif not isinstance(log_name, str):
         raise RuntimeError("log_name must be a string, int or None (got {0})".format(repr(log_name)))
 
-    node_ids = list(range(nodes_per_party)) + list(range(cluster.location_to_id[location], cluster.location_to_id[location] + nodes_per_party))
+    node_ids = wan_node_ids(cluster, location, nodes_per_party)
     def copy_scripts(machine, global_id):
-        for script in ("./scripts/generate_input.sh", "./scripts/generate_memprog.sh", "./scripts/run_mage.sh"):
-            remote.copy_to(machine.public_ip_address, False, script)
+        for script in ("./scripts/generate_input.sh", "./scripts/generate_memprog.sh", "./scripts/run_mage.sh", "./scripts/sample_resources.py"):
+            remote.deploy_script(machine.public_ip_address, script)
     cluster.for_each_concurrently(copy_scripts, node_ids)
 
     def generate_input(machine, global_id, thread_id):
         id = ((global_id * workers_per_node) + thread_id) % (workers_per_node * nodes_per_party)
-        remote.exec_sync(machine.public_ip_address, "~/generate_input.sh {0} {1} {2} {3} {4}".format(problem_name, problem_size, protocol, id, workers_per_node * nodes_per_party))
+        remote.exec_sync(machine.public_ip_address, "~/generate_input.sh {0} {1} {2} {3} {4}".format(problem_name, problem_size, protocol, id, workers_per_node * nodes_per_party), check_exitcode = True)
     if generate_fresh_input:
         cluster.for_each_multiple_concurrently(generate_input, workers_per_node, node_ids)
 
+    ensure_config(cluster, node_ids, config_file)
+
     def generate_memprog(machine, global_id):
         party = wan_party_from_global_id(cluster, global_id)
         for thread_id in range(workers_per_node):
@@ -53,26 +336,32 @@ def run_paired_wan_experiment(cluster, problem_name, problem_size, scenario, mem
             else:
                 # So we don't count this as a "planning" measurement
                 log_name_to_use = ""
-            remote.exec_sync(machine.public_ip_address, "~/generate_memprog.sh {0} {1} {2} {3} {4} {5} {6}".format(problem_name, problem_size, protocol, config_file, party, id, log_name_to_use))
+            remote.exec_sync(machine.public_ip_address, "~/generate_memprog.sh {0} {1} {2} {3} {4} {5} {6}".format(problem_name, problem_size, protocol, config_file, party, id, log_name_to_use), check_exitcode = True)
     if generate_fresh_memprog:
         cluster.for_each_concurrently(generate_memprog, node_ids)
 
     def run_mage(machine, global_id, thread_id):
         party = wan_party_from_global_id(cluster, global_id)
         id = ((global_id * workers_per_node) + thread_id) % (workers_per_node * nodes_per_party)
-        time.sleep(10 * id)
-        if party == 1:
-            time.sleep(10 * workers_per_node * nodes_per_party + 20) # Wait for all evaluator workers to start first
+        garbler_machine_ids = [i // workers_per_node for i in range(workers_per_node * nodes_per_party)]
+        evaluator_machine_ids = [cluster.location_to_id[location] + (i // workers_per_node) for i in range(workers_per_node * nodes_per_party)]
+        wait_for_party_start(cluster, party, id, garbler_machine_ids if party == 1 else evaluator_machine_ids, evaluator_machine_ids)
         log_name_to_use = "{0}_w{1}".format(log_name, id)
-        remote.exec_sync(machine.public_ip_address, "~/run_mage.sh {0} {1} {2} {3} {4} {5} {6} {7} {8}".format(scenario, mem_limit, protocol, config_file, party, id, program_name, log_name_to_use, "true"))
+        command = "~/run_mage.sh {0} {1} {2} {3} {4} {5} {6} {7} {8} {9}".format(scenario, mem_limit, protocol, config_file, party, id, program_name, log_name_to_use, "true", sample_interval_ms)
+        if streamer is None:
+            remote.exec_sync(machine.public_ip_address, command, check_exitcode = True)
+        else:
+            streamer.run(machine.public_ip_address, command, log_name_to_use, "machine {0} worker {1}".format(global_id, id), check_exitcode = True)
 
+    kill_programs(cluster, node_ids, ("mage",))
     if protocol != "ckks":
-        time.sleep(70) # Wait for TIME-WAIT state to expire
+        wait_for_time_wait(cluster, node_ids, worker_ports(workers_per_node * nodes_per_party))
     clear_memory_caches(cluster, node_ids)
-    cluster.for_each_multiple_concurrently(run_mage, workers_per_node, node_ids)
+    with killed_on_failure(cluster, node_ids, ("mage",)):
+        cluster.for_each_multiple_concurrently(run_mage, workers_per_node, node_ids)
     clear_output_files(cluster, node_ids, problem_name)
 
-def run_wan_experiment(cluster, problem_name, problem_size, scenario, mem_limit, location, log_name, workers_per_node, ot_pipeline_depth, ot_num_daemons, generate_fresh_input = True, generate_fresh_memprog = True):
+def run_wan_experiment(cluster, problem_name, problem_size, scenario, mem_limit, location, log_name, workers_per_node, ot_pipeline_depth, ot_num_daemons, generate_fresh_input = True, generate_fresh_memprog = True, streamer = None, sample_interval_ms = SAMPLE_INTERVAL_MS):
     protocol = "halfgates"
     program_name = "{0}_{1}".format(problem_name, problem_size)
     config_file = "~/config-{0}/{1}/config_{2}_{3}_{4}_{5}.yaml".format(location, "1gb" if scenario == "mage" else "unbounded", protocol, workers_per_node, ot_pipeline_depth, ot_num_daemons)
@@ -85,17 +374,19 @@ def run_wan_experiment(cluster, problem_name, problem_size, scenario, mem_limit,
     elif not isinstance(log_name, str):
         raise RuntimeError("log_name must be a string, int or None (got {0})".format(repr(log_name)))
 
-    node_ids = (0, cluster.location_to_id[location])
+    node_ids = wan_node_ids(cluster, location, 1)
     def copy_scripts(machine, global_id):
-        for script in ("./scripts/generate_input.sh", "./scripts/generate_memprog.sh", "./scripts/run_mage.sh"):
-            remote.copy_to(machine.public_ip_address, False, script)
+        for script in ("./scripts/generate_input.sh", "./scripts/generate_memprog.sh", "./scripts/run_mage.sh", "./scripts/sample_resources.py"):
+            remote.deploy_script(machine.public_ip_address, script)
     cluster.for_each_concurrently(copy_scripts, node_ids)
 
     def generate_input(machine, global_id, thread_id):
-        remote.exec_sync(machine.public_ip_address, "~/generate_input.sh {0} {1} {2} {3} {4}".format(problem_name, problem_size, protocol, thread_id, workers_per_node))
+        remote.exec_sync(machine.public_ip_address, "~/generate_input.sh {0} {1} {2} {3} {4}".format(problem_name, problem_size, protocol, thread_id, workers_per_node), check_exitcode = True)
     if generate_fresh_input:
         cluster.for_each_multiple_concurrently(generate_input, workers_per_node, node_ids)
 
+    ensure_config(cluster, node_ids, config_file)
+
     def generate_memprog(machine, global_id, thread_id):
         party = wan_party_from_global_id(cluster, global_id)
         if scenario == "mage":
@@ -103,24 +394,33 @@ def run_wan_experiment(cluster, problem_name, problem_size, scenario, mem_limit,
         else:
             # So we don't count this as a "planning" measurement
             log_name_to_use = ""
-        remote.exec_sync(machine.public_ip_address, "~/generate_memprog.sh {0} {1} {2} {3} {4} {5} {6}".format(problem_name, problem_size, protocol, config_file, party, thread_id, log_name_to_use))
+        remote.exec_sync(machine.public_ip_address, "~/generate_memprog.sh {0} {1} {2} {3} {4} {5} {6}".format(problem_name, problem_size, protocol, config_file, party, thread_id, log_name_to_use), check_exitcode = True)
     if generate_fresh_memprog:
         cluster.for_each_multiple_concurrently(generate_memprog, workers_per_node, node_ids)
 
     def run_mage(machine, global_id, thread_id):
         party = wan_party_from_global_id(cluster, global_id)
-        time.sleep(10 * thread_id)
-        if party == 1:
-            time.sleep(10 * workers_per_node + 20) # Wait for all evaluator workers to start first
+        evaluator_machine_ids = [cluster.location_to_id[location]] * workers_per_node
+        wait_for_party_start(cluster, party, thread_id, [global_id] * workers_per_node, evaluator_machine_ids)
         log_name_to_use = "{0}_w{1}".format(log_name, thread_id)
-        remote.exec_sync(machine.public_ip_address, "~/run_mage.sh {0} {1} {2} {3} {4} {5} {6} {7} {8}".format(scenario, mem_limit, protocol, config_file, party, thread_id, program_name, log_name_to_use, "true"))
+        command = "~/run_mage.sh {0} {1} {2} {3} {4} {5} {6} {7} {8} {9}".format(scenario, mem_limit, protocol, config_file, party, thread_id, program_name, log_name_to_use, "true", sample_interval_ms)
+        if streamer is None:
+            remote.exec_sync(machine.public_ip_address, command, check_exitcode = True)
+        else:
+            streamer.run(machine.public_ip_address, command, log_name_to_use, "machine {0} worker {1}".format(global_id, thread_id), check_exitcode = True)
 
+    kill_programs(cluster, node_ids, ("mage",))
     if protocol != "ckks":
-        time.sleep(70) # Wait for TIME-WAIT state to expire
+        wait_for_time_wait(cluster, node_ids, worker_ports(workers_per_node))
     clear_memory_caches(cluster, node_ids)
-    cluster.for_each_multiple_concurrently(run_mage, workers_per_node, node_ids)
+    with killed_on_failure(cluster, node_ids, ("mage",)):
+        cluster.for_each_multiple_concurrently(run_mage, workers_per_node, node_ids)
 
-def run_lan_experiment(cluster, problem_name, problem_size, protocol, scenario, mem_limit, worker_ids, log_name = "/dev/null", workers_per_party = None, generate_fresh_input = True, generate_fresh_memprog = True):
+def lan_config_path(protocol, scenario, mem_limit, workers_per_party):
+    # The config that a LAN experiment uses, relative to ~/config
+    return configs.generate_configs.config_path(mem_limit if scenario == "mage" else "unbounded", protocol, workers_per_party, 1)
+
+def run_lan_experiment(cluster, problem_name, problem_size, protocol, scenario, mem_limit, worker_ids, log_name = "/dev/null", workers_per_party = None, generate_fresh_input = True, generate_fresh_memprog = True, streamer = None, sample_interval_ms = SAMPLE_INTERVAL_MS, config_file = None, mage_dir = None, check_exitcode = True):
     if workers_per_party is None:
         if protocol == "halfgates":
             assert len(worker_ids) % 2 == 0
@@ -133,7 +433,10 @@ def run_lan_experiment(cluster, problem_name, problem_size, protocol, scenario,
     assert len(cluster.machines) == cluster.num_lan_machines
 
     program_name = "{0}_{1}".format(problem_name, problem_size)
-    config_file = "~/config/{0}/config_{1}_{2}_{3}.yaml".format(mem_limit if scenario == "mage" else "unbounded", protocol, workers_per_party, 1)
+    custom_config = config_file is not None
+    environment = {"MAGE_DIR": mage_dir} if mage_dir is not None else None
+    if not custom_config:
+        config_file = "~/config/" + lan_config_path(protocol, scenario, mem_limit, workers_per_party)
 
     if isinstance(log_name, int):
         log_name = program_name + "_t{0}".format(log_name)
@@ -144,11 +447,15 @@ def run_lan_experiment(cluster, problem_name, problem_size, protocol, scenario,
 
     def generate_input(machine, global_id):
         local_id = global_id % workers_per_party
-        remote.exec_script(machine.public_ip_address, "./scripts/generate_input.sh", "{0} {1} {2} {3} {4}".format(problem_name, problem_size, protocol, local_id, workers_per_party))
+        remote.exec_script(machine.public_ip_address, "./scripts/generate_input.sh", "{0} {1} {2} {3} {4}".format(problem_name, problem_size, protocol, local_id, workers_per_party), check_exitcode = True, environment = environment)
 
     if generate_fresh_input:
         cluster.for_each_concurrently(generate_input, worker_ids)
 
+    if not custom_config:
+        # A custom config is the caller's to put in place
+        ensure_config(cluster, worker_ids, config_file)
+
     def generate_memprog(machine, global_id):
         party = party_from_global_id(cluster, global_id)
         local_id = global_id % workers_per_party
@@ -157,7 +464,7 @@ def run_lan_experiment(cluster, problem_name, problem_size, protocol, scenario,
         else:
             # So we don't count this as a "planning" measurement
             log_name_to_use = ""
-        remote.exec_script(machine.public_ip_address, "./scripts/generate_memprog.sh", "{0} {1} {2} {3} {4} {5} {6}".format(problem_name, problem_size, protocol, config_file, party, local_id, log_name_to_use))
+        remote.exec_script(machine.public_ip_address, "./scripts/generate_memprog.sh", "{0} {1} {2} {3} {4} {5} {6}".format(problem_name, problem_size, protocol, config_file, party, local_id, log_name_to_use), check_exitcode = True, environment = environment)
 
     if generate_fresh_memprog:
         cluster.for_each_concurrently(generate_memprog, worker_ids)
@@ -165,15 +472,23 @@ def run_lan_experiment(cluster, problem_name, problem_size, protocol, scenario,
     def run_mage(machine, global_id):
         party = party_from_global_id(cluster, global_id)
         local_id = global_id % workers_per_party
-        time.sleep(10 * local_id)
-        if party == 1:
-            time.sleep(10 * workers_per_party + 20) # Wait for all evaluator workers to start first
-        remote.exec_script(machine.public_ip_address, "./scripts/run_mage.sh", "{0} {1} {2} {3} {4} {5} {6} {7} {8}".format(scenario, mem_limit, protocol, config_file, party, local_id, program_name, log_name, "true"))
+        evaluator_ids, garbler_ids = lan_party_machine_ids(cluster, global_id, workers_per_party)
+        # CKKS runs as a single party, so there are no evaluator workers to wait for
+        wait_for_party_start(cluster, party, local_id, garbler_ids if party == 1 else evaluator_ids, evaluator_ids if protocol == "halfgates" else None)
+        remote.deploy_script(machine.public_ip_address, "./scripts/sample_resources.py")
+        args = "{0} {1} {2} {3} {4} {5} {6} {7} {8} {9}".format(scenario, mem_limit, protocol, config_file, party, local_id, program_name, log_name, "true", sample_interval_ms)
+        if streamer is None:
+            remote.exec_script(machine.public_ip_address, "./scripts/run_mage.sh", args, check_exitcode = check_exitcode, environment = environment)
+        else:
+            command = remote.with_environment(remote.deploy_script(machine.public_ip_address, "./scripts/run_mage.sh") + " " + args, environment)
+            streamer.run(machine.public_ip_address, command, log_name, "machine {0}".format(global_id), check_exitcode)
 
+    kill_programs(cluster, worker_ids, ("mage",))
     if protocol != "ckks":
-        time.sleep(70) # Wait for TIME-WAIT state to expire
+        wait_for_time_wait(cluster, worker_ids, worker_ports(workers_per_party))
     clear_memory_caches(cluster, worker_ids)
-    cluster.for_each_concurrently(run_mage, worker_ids)
+    with killed_on_failure(cluster, worker_ids, ("mage",)):
+        cluster.for_each_concurrently(run_mage, worker_ids)
 
 def run_halfgates_baseline_experiment(cluster, problem_size, scenario, worker_ids, log_name = "/dev/null"):
     assert len(worker_ids) == 2
@@ -182,31 +497,33 @@ def run_halfgates_baseline_experiment(cluster, problem_size, scenario, worker_id
 
     def run_halfgates_baseline(machine, global_id):
         party = party_from_global_id(cluster, global_id)
-        if party == 1:
-            time.sleep(30)
         if global_id == worker_ids[0]:
             other_worker_id = worker_ids[1]
         else:
             assert global_id == worker_ids[1]
             other_worker_id = worker_ids[0]
-        remote.exec_script(machine.public_ip_address, "./scripts/run_halfgates_baseline.sh", "{0} {1} {2} {3} {4}".format(scenario, party, problem_size, cluster.machines[other_worker_id].private_ip_address, log_name))
+        if party == 1:
+            wait_for_listeners(cluster, {other_worker_id: (EMP_PORT,)}, program = "merge_sorted")
+        remote.exec_script(machine.public_ip_address, "./scripts/run_halfgates_baseline.sh", "{0} {1} {2} {3} {4}".format(scenario, party, problem_size, cluster.machines[other_worker_id].private_ip_address, log_name), check_exitcode = True)
 
-    time.sleep(70)
+    kill_programs(cluster, worker_ids, ("merge_sorted",))
+    wait_for_time_wait(cluster, worker_ids, (EMP_PORT,))
     clear_memory_caches(cluster, worker_ids)
-    cluster.for_each_concurrently(run_halfgates_baseline, worker_ids)
+    with killed_on_failure(cluster, worker_ids, ("merge_sorted",)):
+        cluster.for_each_concurrently(run_halfgates_baseline, worker_ids)
 
 def run_ckks_baseline_experiment(cluster, problem_size, scenario, worker_ids, log_name = "/dev/null", generate_fresh_input = True):
     if not isinstance(log_name, str):
         raise RuntimeError("log_name must be a string (got {0})".format(repr(log_name)))
 
     def generate_input(machine, global_id):
-        remote.exec_script(machine.public_ip_address, "./scripts/generate_input.sh", "{0} {1} {2} {3} {4}".format("real_statistics", problem_size, "ckks", 0, 1))
+        remote.exec_script(machine.public_ip_address, "./scripts/generate_input.sh", "{0} {1} {2} {3} {4}".format("real_statistics", problem_size, "ckks", 0, 1), check_exitcode = True)
 
     if generate_fresh_input:
         cluster.for_each_concurrently(generate_input, worker_ids)
 
     def run_ckks_baseline(machine, global_id):
-        remote.exec_script(machine.public_ip_address, "./scripts/run_ckks_baseline.sh", "{0} {1} {2}".format(scenario, problem_size, log_name))
+        remote.exec_script(machine.public_ip_address, "./scripts/run_ckks_baseline.sh", "{0} {1} {2}".format(scenario, problem_size, log_name), check_exitcode = True)
 
     # time.sleep(70)
     clear_memory_caches(cluster, worker_ids)
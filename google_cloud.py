@@ -4,6 +4,7 @@ import cluster
 
 GCP_PROJECT = "rise-mage"
 GCP_FIREWALL_RULE = "mage-wan"
+IMAGE_FAMILY = "mage-deps"
 
 oregon = ("us-west1", "b")
 iowa = ("us-central1", "b")
@@ -36,8 +37,21 @@ def wait_for_operation(compute, project, zone, operation):
 
         time.sleep(1)
 
+def wait_for_global_operation(compute, project, operation):
+    while True:
+        result = compute.globalOperations().get(
+            project=project,
+            operation=operation).execute()
+
+        if result['status'] == 'DONE':
+            if 'error' in result:
+                raise Exception(result['error'])
+            return result
+
+        time.sleep(1)
+
 # Reference: https://cloud.google.com/compute/docs/reference/rest/v1/instances/insert
-def spawn_instance(m, name, instance_type, num_local_ssds, image_name, disk_layout_name, region, zone_letter, project_name = GCP_PROJECT):
+def spawn_instance(m, name, instance_type, num_local_ssds, image_name, disk_layout_name, region, zone_letter, project_name = GCP_PROJECT, image_link = None):
     cloud_init_file = "cloud-init-gcp.yaml"
     if disk_layout_name == "paired-noswap":
         cloud_init_file = "cloud-init-gcp-paired.yaml"
@@ -51,8 +65,9 @@ def spawn_instance(m, name, instance_type, num_local_ssds, image_name, disk_layo
     # Based on https://cloud.google.com/compute/docs/tutorials/python-guide
 
     if image_name == "mage":
-        image_response = compute.images().getFromFamily(project = project_name, family = "mage-deps").execute()
-        image_link = image_response["selfLink"]
+        if image_link is None:
+            image_response = compute.images().getFromFamily(project = project_name, family = IMAGE_FAMILY).execute()
+            image_link = image_response["selfLink"]
     else:
         image_response = compute.images().getFromFamily(project = "ubuntu-os-cloud", family = "ubuntu-2004-lts").execute()
         image_link = image_response["selfLink"]
@@ -175,7 +190,27 @@ def spawn_instance(m, name, instance_type, num_local_ssds, image_name, disk_layo
     m.disk_name = info["disks"][0]["deviceName"]
     m.gcp_zone = target_zone
     m.provider = "gcloud"
-    m.image = image_name
+    m.image_name = image_name
+
+def image_names(project_name = GCP_PROJECT):
+    response = compute.images().list(project = project_name, filter = "family = {0}".format(IMAGE_FAMILY)).execute()
+    return [image["name"] for image in response.get("items", [])]
+
+# Reference: https://cloud.google.com/compute/docs/images/create-delete-deprecate-private-images
+def capture_image(m, image_name, project_name = GCP_PROJECT):
+    # The boot disk is named after the instance, and must not be in use
+    operation = compute.instances().stop(project = project_name, zone = m.gcp_zone, instance = m.vm_name, discardLocalSsd = True).execute()
+    wait_for_operation(compute, project_name, m.gcp_zone, operation["name"])
+
+    operation = compute.images().insert(project = project_name, body = {
+        "name": image_name,
+        "family": IMAGE_FAMILY,
+        "sourceDisk": "projects/{0}/zones/{1}/disks/{2}".format(project_name, m.gcp_zone, m.vm_name)
+    }).execute()
+    wait_for_global_operation(compute, project_name, operation["name"])
+
+    info = compute.images().get(project = project_name, image = image_name).execute()
+    return info["selfLink"]
 
 def deallocate_instance(m, project_name = GCP_PROJECT):
     deallocate_instance_by_info(m.gcp_zone, m.vm_name, project_name)
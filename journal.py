@@ -0,0 +1,55 @@
+import json
+import os
+import threading
+import time
+
+JOURNAL_FILE = "journal.jsonl"
+
+class SweepJournal(object):
+    # An append-only record of every experiment that a sweep has run, one JSON
+    # object per line, so that an interrupted sweep can be resumed. Entries
+    # are tied to the cluster they ran on, since the logs stay on its machines
+    # until they are fetched; a cluster_name of None loads every entry.
+    def __init__(self, cluster_name, filename = JOURNAL_FILE):
+        self.cluster_name = cluster_name
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(filename):
+            with open(filename, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue # Partially-written line from an interrupted run
+                    if cluster_name is None or entry.get("cluster") == cluster_name:
+                        self.entries[entry["log_name"]] = entry
+
+    def completed(self, log_name):
+        entry = self.entries.get(log_name)
+        return entry is not None and entry["outcome"] == "ok"
+
+    def elapsed_times(self):
+        with self.lock:
+            return [entry["seconds"] for entry in self.entries.values() if entry["outcome"] == "ok"]
+
+    def record(self, log_name, outcome, start, end, error = None):
+        entry = {"cluster": self.cluster_name, "log_name": log_name, "outcome": outcome, "start": start, "end": end, "seconds": end - start}
+        if error is not None:
+            entry["error"] = error
+        with self.lock:
+            self.entries[log_name] = entry
+            with open(self.filename, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def run(self, log_name, function):
+        start = time.time()
+        try:
+            result = function()
+        except BaseException as e:
+            self.record(log_name, "failed", start, time.time(), repr(e))
+            raise
+        self.record(log_name, "ok", start, time.time())
+        return result
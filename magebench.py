@@ -1,15 +1,24 @@
 #!/usr/bin/env python3
 import argparse
+import json
 import os
 import shutil
 import socket
 import sys
 import time
 
+import artifacts
+import autotune
+import calibration
 import cloud
 import cluster
+import configs
 import experiment
+import journal
+import plan
 import remote
+import scheduler
+import trials
 
 def validate_protocol(protocol):
     protocol = protocol.lower()
@@ -26,36 +35,132 @@ def validate_scenario(scenario):
 
 def copy_ckks_keys(machine, id):
     remote.copy_to(machine.public_ip_address, True, "./ckks_keys", "~")
-    remote.exec_sync(machine.public_ip_address, "cp ~/ckks_keys/* ~/work/mage/bin")
+    remote.exec_sync(machine.public_ip_address, "cp ~/ckks_keys/* ~/work/mage/bin; if [ -d ~/work/{0}/bin ]; then cp ~/ckks_keys/* ~/work/{0}/bin; fi".format(experiment.MAGE_B_DIRECTORY))
 
-def generate_ckks_keys(c):
+def generate_ckks_keys(c, max_concurrency = None):
     shutil.rmtree("./ckks_keys", ignore_errors = True)
     remote.exec_sync(c.machines[0].public_ip_address, "cd ~/work/mage/bin; ./ckks_utils keygen; mkdir -p ~/ckks_keys; cp *.ckks ~/ckks_keys")
     try:
         remote.copy_from(c.machines[0].public_ip_address, True, "~/ckks_keys", ".")
-        c.for_each_concurrently(copy_ckks_keys, range(1, len(c.machines)))
+        c.for_each_concurrently(copy_ckks_keys, range(1, len(c.machines)), max_concurrency)
     finally:
         shutil.rmtree("./ckks_keys")
 
-def provision_cluster(c, repository, checkout):
-    def provision_machine(machine, id):
+def mage_builds(repository, checkout, checkout_b = None, repository_b = None):
+    # Returns (directory, repository, checkout) for each build of MAGE
+    builds = [("mage", repository, checkout)]
+    if checkout_b is not None:
+        # A second checkout for "ab", built next to the first
+        builds.append((experiment.MAGE_B_DIRECTORY, repository if repository_b is None else repository_b, checkout_b))
+    return builds
+
+def setup_code(machine, directory, repository, checkout):
+    if directory == "mage":
+        remote.exec_script(machine.public_ip_address, "./scripts/setup_code.sh", "{0} {1} {2}".format(machine.image_name, repository, checkout))
+    else:
+        remote.exec_script(machine.public_ip_address, "./scripts/setup_code.sh", "mage {0} {1} {2}".format(repository, checkout, directory))
+
+def install_mage_deps(machine, deps_name):
+    remote.exec_script(machine.public_ip_address, "./scripts/install_deps.sh", "--install-mage-deps", environment = {"MAGE_DEPS_ARCHIVE": artifacts.remote_path(deps_name)})
+
+def build_once(machine, builds, build_deps):
+    # Builds everything on this machine, or unpacks what an earlier cluster
+    # built, and returns the names of the archives
+    deps_name = None
+    if build_deps:
+        deps_name = artifacts.deps_archive_name(machine)
+        artifacts.push(machine, deps_name)
+        install_mage_deps(machine, deps_name)
+        artifacts.keep(machine, deps_name)
+    mage_names = []
+    for directory, repository, checkout in builds:
+        commit = artifacts.resolve_commit(machine, repository, checkout)
+        if commit is not None and artifacts.push(machine, artifacts.mage_archive_name(commit)):
+            print("Using the build of {0} ({1}) from {2}".format(checkout, commit, artifacts.ARTIFACT_DIRECTORY))
+            remote.exec_sync(machine.public_ip_address, artifacts.unpack_mage_command(artifacts.mage_archive_name(commit), directory), check_exitcode = True)
+            setup_code(machine, directory, repository, checkout)
+        else:
+            setup_code(machine, directory, repository, checkout)
+            commit = artifacts.built_commit(machine, directory)
+            artifacts.pack_mage(machine, directory, artifacts.mage_archive_name(commit))
+            artifacts.keep(machine, artifacts.mage_archive_name(commit))
+        mage_names.append(artifacts.mage_archive_name(commit))
+    return (deps_name, mage_names)
+
+def provision_cluster(c, repository, checkout, wait_until_ready = False, max_concurrency = None, lazy_configs = False, checkout_b = None, repository_b = None):
+    builds = mage_builds(repository, checkout, checkout_b, repository_b)
+    build_deps = any(machine.image_name != "mage" for machine in c.machines)
+
+    def prepare_machine(machine, id):
+        if wait_until_ready:
+            boot_time = cloud.wait_for_machine(machine, c.setup)
+            print("Machine {0} ready after {1:.0f} seconds".format(id, boot_time))
         if machine.image_name != "mage":
-            remote.exec_script(machine.public_ip_address, "./scripts/install_deps.sh", "--install-mage-deps --install-utils --setup-wan-tcp")
+            remote.exec_script(machine.public_ip_address, "./scripts/install_deps.sh", "--install-utils --setup-wan-tcp")
         remote.exec_script(machine.public_ip_address, "./scripts/provision.sh", "{0} {1}".format(machine.provider, c.setup))
-        remote.exec_script(machine.public_ip_address, "./scripts/setup_code.sh", "{0} {1} {2}".format(machine.image_name, repository, checkout))
         remote.copy_to(machine.public_ip_address, False, "./cluster.json", "~")
-        if id < c.num_lan_machines:
-            remote.exec_script(machine.public_ip_address, "./scripts/generate_configs.py", "~/cluster.json {0} lan ~/config {1}".format(id, "true" if c.setup.startswith("paired") else "false"))
-        if c.setup in ("paired-noswap", "paired-swap"):
-            for location, loc_id in c.location_to_id.items():
-                if id in range(c.num_lan_machines) or id in range(loc_id, loc_id + c.num_lan_machines):
-                    remote.exec_script(machine.public_ip_address, "./scripts/generate_configs.py", "~/cluster.json {0} {1}-paired ~/config-{1}-paired".format(id, location))
-        else:
-            for location, loc_id in c.location_to_id.items():
-                if id == 0 or id == loc_id:
-                    remote.exec_script(machine.public_ip_address, "./scripts/generate_configs.py", "~/cluster.json 0 {0} ~/config-{0}".format(location))
-    c.for_each_concurrently(provision_machine)
-    generate_ckks_keys(c)
+        if lazy_configs:
+            # Each config is generated when an experiment first needs it, so
+            # remove any generated for an earlier cluster.json
+            remote.exec_sync(machine.public_ip_address, "rm -rf ~/config ~/config-* ~/.configs")
+        if machine.image_name != "mage":
+            return artifacts.deps_archive_name(machine)
+        return None
+
+    def install_machine(machine, id, deps_name, mage_names, url):
+        # Unpacks the builder's archives, after which setup_code.sh only has
+        # to check out the commit it was built from, leaving make nothing to do
+        same_release = deps_names[id] in (None, deps_name)
+        if machine.image_name != "mage" and id not in deps_builders:
+            artifacts.fetch(machine, deps_names[id], url if same_release else None)
+            install_mage_deps(machine, deps_names[id])
+        for (directory, repository, checkout), name in zip(builds, mage_names):
+            # MAGE built for another OS release may not run, so it is rebuilt
+            if same_release:
+                artifacts.fetch(machine, name, url)
+                remote.exec_sync(machine.public_ip_address, artifacts.unpack_mage_command(name, directory), check_exitcode = True)
+            setup_code(machine, directory, repository, checkout)
+
+    timings = {}
+    deps_names = c.for_each_concurrently(prepare_machine, max_concurrency = max_concurrency, timings = timings)
+    builder = c.machines[0]
+    start = time.time()
+    deps_name, mage_names = build_once(builder, builds, build_deps)
+    timings[0] += time.time() - start
+    print("Builds ready on machine 0 after {0:.0f} seconds".format(time.time() - start))
+    # The dependencies are only built for one OS release, so if some machines
+    # run another (e.g., the other provider's image is newer), the first of
+    # them builds an archive for it, which the rest get from here
+    deps_builders = {}
+    for id, name in enumerate(deps_names):
+        if name is not None and name != deps_name and name not in deps_builders.values():
+            deps_builders[id] = name
+    def build_deps_for_release(machine, id):
+        print("Machine {0} runs another OS release than machine 0, so it installs {1} itself".format(id, deps_builders[id]))
+        artifacts.push(machine, deps_builders[id])
+        install_mage_deps(machine, deps_builders[id])
+        artifacts.keep(machine, deps_builders[id])
+    release_timings = {}
+    c.for_each_concurrently(build_deps_for_release, sorted(deps_builders), max_concurrency, release_timings)
+    for id, seconds in release_timings.items():
+        timings[id] += seconds
+    if len(c.machines) > 1:
+        # The machines on the builder's network download its archives directly;
+        # the others get them from here
+        with artifacts.serve(builder) as url:
+            def provision_machine(machine, id):
+                install_machine(machine, id, deps_name, mage_names, url if machine.provider == builder.provider else None)
+            install_timings = {}
+            c.for_each_concurrently(provision_machine, range(1, len(c.machines)), max_concurrency, install_timings)
+        for id, seconds in install_timings.items():
+            timings[id] += seconds
+    for id, seconds in sorted(timings.items()):
+        print("Machine {0} provisioned in {1:.0f} seconds".format(id, seconds))
+    if not lazy_configs:
+        start = time.time()
+        sizes = configs.push_configs(c, max_concurrency)
+        print("Configs sent to {0} machines ({1:.1f} MiB) in {2:.0f} seconds".format(len(sizes), sum(sizes.values()) / (1 << 20), time.time() - start))
+    generate_ckks_keys(c, max_concurrency)
 
 def spawn(args):
     if os.path.exists("cluster.json"):
@@ -75,16 +180,22 @@ def spawn(args):
     print("Spawning cluster...")
     c = cloud.spawn_cluster(args.name, args.azure_machine_count, "mage" if args.image else "ubuntu", args.large_work_disk, args.wan_setup, args.project_gcloud, *args.gcloud_machine_locations)
     c.save_to_file("cluster.json")
-    print("Waiting three minutes for the machines to start up...")
-    time.sleep(180)
-    print("Provisioning the machines...")
-    provision_cluster(c, args.repository, args.checkout)
+    print("Provisioning each machine once it has started up...")
+    provision_cluster(c, args.repository, args.checkout, True, args.max_concurrency, args.lazy_configs, args.checkout_b, args.repository_b)
+    print("Done.")
+
+def push_configs(args):
+    c = cluster.Cluster.load_from_file("cluster.json")
+    print("Sending configs to the machines...")
+    start = time.time()
+    sizes = configs.push_configs(c, args.max_concurrency)
+    print("Configs sent to {0} machines ({1:.1f} MiB) in {2:.0f} seconds".format(len(sizes), sum(sizes.values()) / (1 << 20), time.time() - start))
     print("Done.")
 
 def provision(args):
     c = cluster.Cluster.load_from_file("cluster.json")
     print("Provisioning the machines...")
-    provision_cluster(c, args.repository, args.checkout)
+    provision_cluster(c, args.repository, args.checkout, max_concurrency = args.max_concurrency, lazy_configs = args.lazy_configs, checkout_b = args.checkout_b, repository_b = args.repository_b)
     print("Done.")
 
 def parse_program(program):
@@ -105,21 +216,129 @@ def parse_program_list(program_list):
         result.append(parse_program(program))
     return result
 
-def run_lan(args):
-    c = cluster.Cluster.load_from_file("cluster.json")
+def open_sweep(args, c):
+    j = journal.SweepJournal(c.name)
+    log_files = experiment.list_log_files(c) if args.resume else None
+    def skip(log_name, expect_result = True):
+        if log_files is not None and j.completed(log_name) and experiment.logs_present(log_files, log_name, expect_result):
+            print("Skipping {0} (already completed)".format(log_name))
+            return True
+        return False
+    return (j, skip)
+
+def trial_controller(args):
+    # -t is the number of trials, or the minimum if --target-width is given
+    return trials.TrialController(args.trials, args.target_width, args.max_trials, args.confidence)
+
+def record_trial(controller, key, c, node_ids, log_pattern, num_workers):
+    # Adds a trial's total time, that of its slowest worker, unless a worker
+    # did not finish
+    times = experiment.worker_total_times_ms(c, node_ids, log_pattern)
+    if len(times) == num_workers:
+        controller.record(key, max(times))
+
+def stream_experiment(args, run):
+    # Calls run(streamer), following the MAGE logs live if --stream was given
+    if not args.stream:
+        return run(None)
+    with experiment.LogStreamer() as streamer:
+        return run(streamer)
+
+def fill_lan_program_defaults(args, num_machines):
+    # The defaults that run-lan shares with tune-prefetch, which has no
+    # --scenarios
     if args.programs is None:
-        if len(c.machines) == 2:
+        if num_machines == 2:
             args.programs = ("merge_sorted_1048576", "full_sort_1048576", "loop_join_2048", "matrix_vector_multiply_8192", "binary_fc_layer_16384", "real_sum_65536", "real_statistics_16384", "real_matrix_vector_multiply_256", "real_naive_matrix_multiply_128", "real_tiled_matrix_multiply_128")
-        elif len(c.machines) == 8:
+        elif num_machines == 8:
             args.programs = ("merge_sorted_4194304", "full_sort_4194304", "loop_join_4096", "matrix_vector_multiply_16384", "binary_fc_layer_32768", "real_sum_262144", "real_statistics_65536", "real_matrix_vector_multiply_512", "real_naive_matrix_multiply_256", "real_tiled_matrix_multiply_256")
         else:
-            print("Could not infer default list of programs for {0}-machine cluster".format(len(c.machines)))
+            print("Could not infer default list of programs for {0}-machine cluster".format(num_machines))
             args.programs = tuple()
+
+def fill_run_lan_defaults(args, num_machines):
+    fill_lan_program_defaults(args, num_machines)
     if args.scenarios is None:
         args.scenarios = ("mage", "unbounded", "os")
 
+def prefetch_config(c, protocol, scenario, mem_limit, worker_ids, workers_per_party, prefetch):
+    # Pushes the LAN config with the given prefetch settings, or returns None
+    # to use the generated one. Only MAGE's own paging prefetches.
+    if prefetch is None or scenario != "mage":
+        return None
+    base_path = experiment.lan_config_path(protocol, scenario, mem_limit, workers_per_party)
+    return configs.push_config_variant(c, worker_ids, base_path, prefetch._asdict(), "~/config-prefetch/{0}_{1}".format(*prefetch))
+
+def run_lan(args):
+    c = cluster.Cluster.load_from_file("cluster.json")
+    fill_run_lan_defaults(args, len(c.machines))
+
+    num_nodes_per_party = (len(c.machines) // 2) if args.num_nodes is None else args.num_nodes
+    if args.concurrent:
+        sched = scheduler.ExperimentScheduler(c, num_nodes_per_party)
+    j, skip = open_sweep(args, c)
+    controller = trial_controller(args)
+
     parsed_programs = parse_program_list(args.programs)
     for problem_name, problem_size in parsed_programs:
+        if problem_name.startswith("real"):
+            protocol = "ckks"
+            worker_ids = range(len(c.machines) // 2)
+        else:
+            protocol = "halfgates"
+            worker_ids = range(len(c.machines))
+        prefetch = None
+        if args.tuned_prefetch:
+            prefetch = autotune.tuned_prefetch_settings(protocol, args.mem_limit, "{0}_{1}".format(problem_name, problem_size))
+            if prefetch is None:
+                print("No tuned prefetch settings for {0}_{1} with {2}; using the defaults".format(problem_name, problem_size, args.mem_limit))
+        if args.concurrent:
+            # The logs are on whichever machines the scheduler picked
+            search_ids = range(len(c.machines))
+            num_workers = (2 if protocol == "halfgates" else 1) * num_nodes_per_party
+        else:
+            search_ids = worker_ids
+            num_workers = len(worker_ids)
+        for trial in controller.rounds():
+            round_runs = []
+            for scenario in args.scenarios:
+                key = "workers_{0}_{1}_{2}_{3}".format(num_nodes_per_party, problem_name, problem_size, scenario)
+                if not controller.needs(key, trial):
+                    continue
+                log_name = "{0}_t{1}".format(key, trial)
+                round_runs.append((key, log_name))
+                if skip(log_name):
+                    continue
+                if args.concurrent:
+                    sched.submit(log_name, protocol == "halfgates", lambda ids, problem_name = problem_name, problem_size = problem_size, protocol = protocol, scenario = scenario, log_name = log_name, prefetch = prefetch: j.run(log_name, lambda: stream_experiment(args, lambda streamer: experiment.run_lan_experiment(c, problem_name, problem_size, protocol, scenario, args.mem_limit, ids, log_name, num_nodes_per_party, streamer = streamer, sample_interval_ms = args.sample_interval, config_file = prefetch_config(c, protocol, scenario, args.mem_limit, ids, num_nodes_per_party, prefetch)))))
+                else:
+                    j.run(log_name, lambda: stream_experiment(args, lambda streamer: experiment.run_lan_experiment(c, problem_name, problem_size, protocol, scenario, args.mem_limit, worker_ids, log_name, args.num_nodes, streamer = streamer, sample_interval_ms = args.sample_interval, config_file = prefetch_config(c, protocol, scenario, args.mem_limit, worker_ids, num_nodes_per_party, prefetch))))
+            if len(round_runs) == 0:
+                break
+            if controller.adaptive:
+                if args.concurrent:
+                    # Whether another round is needed depends on this one
+                    sched.run()
+                for key, log_name in round_runs:
+                    record_trial(controller, key, c, search_ids, log_name, num_workers)
+    if args.concurrent:
+        sched.run()
+    controller.save(c.name)
+
+AB_RESULTS_FILE = "ab.json"
+
+def run_ab(args):
+    # Runs each experiment with the MAGE checkout in ~/work/mage (A) and the
+    # one built with --checkout-b (B), alternating between them
+    c = cluster.Cluster.load_from_file("cluster.json")
+    fill_run_lan_defaults(args, len(c.machines))
+
+    num_nodes_per_party = (len(c.machines) // 2) if args.num_nodes is None else args.num_nodes
+    j, skip = open_sweep(args, c)
+    sides = (("a", None), ("b", "~/work/{0}".format(experiment.MAGE_B_DIRECTORY)))
+    samples = {}
+
+    for problem_name, problem_size in parse_program_list(args.programs):
         if problem_name.startswith("real"):
             protocol = "ckks"
             worker_ids = range(len(c.machines) // 2)
@@ -128,25 +347,119 @@ def run_lan(args):
             worker_ids = range(len(c.machines))
         for trial in range(1, args.trials + 1):
             for scenario in args.scenarios:
-                num_nodes_per_party = (len(c.machines) // 2) if args.num_nodes is None else args.num_nodes
-                log_name = "workers_{0}_{1}_{2}_{3}_t{4}".format(num_nodes_per_party, problem_name, problem_size, scenario, trial)
-                experiment.run_lan_experiment(c, problem_name, problem_size, protocol, scenario, args.mem_limit, worker_ids, log_name, args.num_nodes)
+                for side, mage_dir in sides:
+                    log_name = "ab_{0}_workers_{1}_{2}_{3}_{4}_t{5}".format(side, num_nodes_per_party, problem_name, problem_size, scenario, trial)
+                    if not skip(log_name):
+                        j.run(log_name, lambda: stream_experiment(args, lambda streamer: experiment.run_lan_experiment(c, problem_name, problem_size, protocol, scenario, args.mem_limit, worker_ids, log_name, args.num_nodes, streamer = streamer, sample_interval_ms = args.sample_interval, mage_dir = mage_dir)))
+                    times = experiment.worker_total_times_ms(c, worker_ids, log_name)
+                    if len(times) == len(worker_ids):
+                        samples.setdefault("{0}_{1}_{2}".format(problem_name, problem_size, scenario), {"a": [], "b": []})[side].append(max(times))
+                    else:
+                        print("{0} did not finish; leaving it out".format(log_name))
+    report_ab(c, samples, args.confidence)
+
+def report_ab(c, samples, confidence):
+    # Prints the speedup of B over A for each workload, and whether it is
+    # significant, and saves it under the cluster's name
+    report = {}
+    for workload, times in sorted(samples.items()):
+        if len(times["a"]) == 0 or len(times["b"]) == 0:
+            continue
+        mean_a = sum(times["a"]) / len(times["a"])
+        mean_b = sum(times["b"]) / len(times["b"])
+        difference, half_width, significant = trials.welch_test(times["a"], times["b"], confidence)
+        if not significant:
+            verdict = "no significant difference"
+        elif difference > 0:
+            verdict = "B is faster"
+        else:
+            verdict = "B is slower (regression)"
+        print("{0}: A {1:.0f} ms, B {2:.0f} ms, speedup {3:.3f}, difference {4:.0f} +/- {5:.0f} ms: {6}".format(workload, mean_a, mean_b, mean_a / mean_b, difference, half_width, verdict))
+        report[workload] = {"a_ms": times["a"], "b_ms": times["b"], "mean_a_ms": mean_a, "mean_b_ms": mean_b, "speedup": mean_a / mean_b, "difference_ms": difference, "ci_half_width_ms": half_width, "confidence": confidence, "significant": significant}
+
+    results = {}
+    if os.path.exists(AB_RESULTS_FILE):
+        with open(AB_RESULTS_FILE, "r") as f:
+            results = json.load(f)
+    results.setdefault(c.name, {}).update(report)
+    with open(AB_RESULTS_FILE + ".tmp", "w") as f:
+        json.dump(results, f, indent = 4, sort_keys = True)
+    os.replace(AB_RESULTS_FILE + ".tmp", AB_RESULTS_FILE)
+
+def tune_prefetch(args):
+    c = cluster.Cluster.load_from_file("cluster.json")
+    fill_lan_program_defaults(args, len(c.machines))
+    if args.mem_limits is None:
+        args.mem_limits = ("1gb",)
+    num_nodes_per_party = (len(c.machines) // 2) if args.num_nodes is None else args.num_nodes
+
+    j, skip = open_sweep(args, c)
+    for problem_name, problem_size in parse_program_list(args.programs):
+        program = "{0}_{1}".format(problem_name, problem_size)
+        if problem_name.startswith("real"):
+            protocol = "ckks"
+            worker_ids = list(range(num_nodes_per_party))
+        else:
+            protocol = "halfgates"
+            half = len(c.machines) // 2
+            worker_ids = list(range(num_nodes_per_party)) + list(range(half, half + num_nodes_per_party))
+        buffer_sizes = autotune.DEFAULT_PREFETCH_BUFFER_SIZES[protocol] if args.buffer_sizes is None else args.buffer_sizes
+        lookaheads = autotune.DEFAULT_PREFETCH_LOOKAHEADS[protocol] if args.lookaheads is None else args.lookaheads
+        candidates = autotune.prefetch_settings(buffer_sizes, lookaheads)
+        fresh_input = [True]
+
+        for mem_limit in args.mem_limits:
+            def measure(prefetch, trial):
+                log_name = "prefetch_{0}_{1}_{2}_{3}_{4}_t{5}".format(mem_limit, prefetch.prefetch_buffer_size, prefetch.prefetch_lookahead, problem_name, problem_size, trial)
+                if not skip(log_name):
+                    try:
+                        j.run(log_name, lambda: stream_experiment(args, lambda streamer: experiment.run_lan_experiment(c, problem_name, problem_size, protocol, "mage", mem_limit, worker_ids, log_name, num_nodes_per_party, generate_fresh_input = fresh_input[0], streamer = streamer, sample_interval_ms = args.sample_interval, config_file = prefetch_config(c, protocol, "mage", mem_limit, worker_ids, num_nodes_per_party, prefetch))))
+                    except cluster.TaskError as e:
+                        print("{0} failed: {1}".format(log_name, e))
+                        return None
+                    fresh_input[0] = False
+                times = experiment.worker_total_times_ms(c, worker_ids, log_name)
+                if len(times) != len(worker_ids):
+                    return None
+                return max(times)
+
+            best, times = autotune.successive_halving(candidates, measure, args.min_trials, args.eta)
+            autotune.save_tuned((protocol, mem_limit, program), best, times, {"num_nodes": num_nodes_per_party}, autotune.TUNED_PREFETCH_FILE)
+            print("Best for {0} with {1}: prefetch_buffer_size = {2}, prefetch_lookahead = {3}".format(program, mem_limit, *best))
+    print("Tuned settings saved to {0}".format(autotune.TUNED_PREFETCH_FILE))
+
+def fill_wan_settings_defaults(args):
+    # The defaults that run-wan shares with autotune-wan, which has no
+    # --scenarios
+    if args.programs is None:
+        args.programs = ("merge_sorted_1048576",)
+    if args.workers_per_node is None:
+        args.workers_per_node = (1,)
+    if args.ot_num_connections is None:
+        args.ot_num_connections = (3,)
+    if args.ot_concurrency is None:
+        args.ot_concurrency = (3,)
+
+def fill_run_wan_defaults(args):
+    fill_wan_settings_defaults(args)
+    if args.scenarios is None:
+        args.scenarios = ("mage",)
 
+def run_wan_settings(args, c, paired, problem_name, problem_size, scenario, settings, log_name):
+    workers_per_node, ot_pipeline_depth, ot_num_daemons = settings
+    if paired:
+        stream_experiment(args, lambda streamer: experiment.run_paired_wan_experiment(c, problem_name, problem_size, scenario, args.mem_limit, args.location, log_name, workers_per_node, c.num_lan_machines, ot_pipeline_depth, ot_num_daemons, streamer = streamer, sample_interval_ms = args.sample_interval))
+    else:
+        stream_experiment(args, lambda streamer: experiment.run_wan_experiment(c, problem_name, problem_size, scenario, args.mem_limit, args.location, log_name, workers_per_node, ot_pipeline_depth, ot_num_daemons, streamer = streamer, sample_interval_ms = args.sample_interval))
 
 def make_run_wan(paired):
     def run_wan(args):
         c = cluster.Cluster.load_from_file("cluster.json")
-        if args.programs is None:
-            args.programs = ("merge_sorted_1048576",)
-        if args.scenarios is None:
-            args.scenarios = ("mage",)
-        if args.workers_per_node is None:
-            args.workers_per_node = (1,)
-        if args.ot_num_connections is None:
-            args.ot_num_connections = (3,)
-        if args.ot_concurrency is None:
-            args.ot_concurrency = (3,)
+        fill_run_wan_defaults(args)
 
+        j, skip = open_sweep(args, c)
+        controller = trial_controller(args)
+        node_ids = experiment.wan_node_ids(c, args.location, c.num_lan_machines if paired else 1)
         parsed_programs = parse_program_list(args.programs)
         for problem_name, problem_size in parsed_programs:
             if problem_name.startswith("real"):
@@ -154,28 +467,87 @@ def make_run_wan(paired):
                 continue
             else:
                 protocol = "halfgates"
-            for trial in range(1, args.trials + 1):
+            candidates = None
+            if args.tuned:
+                tuned = autotune.tuned_wan_settings("paired-wan" if paired else "wan", args.location, "{0}_{1}".format(problem_name, problem_size))
+                if tuned is None:
+                    print("No tuned settings for {0}_{1} in {2}; using the given ones".format(problem_name, problem_size, args.location))
+                else:
+                    candidates = [tuned]
+            if candidates is None:
+                candidates = autotune.wan_settings(args.workers_per_node, args.ot_num_connections, args.ot_concurrency)
+            for trial in controller.rounds():
+                round_runs = []
                 for scenario in args.scenarios:
-                    for workers_per_node in args.workers_per_node:
-                        for ot_num_daemons in args.ot_num_connections:
-                            for ot_concurrency in args.ot_concurrency:
-                                ot_pipeline_depth = max(ot_concurrency // (ot_num_daemons * workers_per_node), 1)
-                                log_name = "wan_{0}_{1}_{2}_{3}_{4}_{5}_{6}_t{7}".format(args.location, workers_per_node, ot_pipeline_depth, ot_num_daemons, problem_name, problem_size, scenario, trial)
-                                if paired:
-                                    log_name = "paired" + log_name
-                                    experiment.run_paired_wan_experiment(c, problem_name, problem_size, scenario, args.mem_limit, args.location, log_name, workers_per_node, c.num_lan_machines, ot_pipeline_depth, ot_num_daemons)
-                                else:
-                                    experiment.run_wan_experiment(c, problem_name, problem_size, scenario, args.mem_limit, args.location, log_name, workers_per_node, 1, ot_pipeline_depth, ot_num_daemons)
+                    for settings in candidates:
+                        key = "wan_{0}_{1}_{2}_{3}_{4}_{5}_{6}".format(args.location, settings.workers_per_node, settings.ot_pipeline_depth, settings.ot_num_daemons, problem_name, problem_size, scenario)
+                        if paired:
+                            key = "paired" + key
+                        if not controller.needs(key, trial):
+                            continue
+                        log_name = "{0}_t{1}".format(key, trial)
+                        round_runs.append((key, log_name, settings))
+                        if skip(log_name):
+                            continue
+                        j.run(log_name, lambda: run_wan_settings(args, c, paired, problem_name, problem_size, scenario, settings, log_name))
+                if len(round_runs) == 0:
+                    break
+                if controller.adaptive:
+                    for key, log_name, settings in round_runs:
+                        record_trial(controller, key, c, node_ids, log_name + "_w*", len(node_ids) * settings.workers_per_node)
+        controller.save(c.name)
     return run_wan
 
-def run_halfgates_baseline(args):
+def autotune_wan(args):
+    c = cluster.Cluster.load_from_file("cluster.json")
+    fill_wan_settings_defaults(args)
+    if args.mem_limit is None:
+        args.mem_limit = "max" if args.paired else "1gb"
+    setup = "paired-wan" if args.paired else "wan"
+    node_ids = experiment.wan_node_ids(c, args.location, c.num_lan_machines if args.paired else 1)
+    candidates = autotune.wan_settings(args.workers_per_node, args.ot_num_connections, args.ot_concurrency)
+    print("Tuning over {0} settings in at most {1} runs per program".format(len(candidates), autotune.count_runs(len(candidates), args.min_trials, args.eta)))
+
+    j, skip = open_sweep(args, c)
+    for problem_name, problem_size in parse_program_list(args.programs):
+        if problem_name.startswith("real"):
+            print("Skipping {0} (only halfgates supported over WAN)".format(problem_name))
+            continue
+
+        def measure(settings, trial):
+            log_name = "autotune{0}_{1}_{2}_{3}_{4}_{5}_{6}_{7}_t{8}".format(setup, args.location, settings.workers_per_node, settings.ot_pipeline_depth, settings.ot_num_daemons, problem_name, problem_size, args.scenario, trial)
+            if not skip(log_name):
+                try:
+                    j.run(log_name, lambda: run_wan_settings(args, c, args.paired, problem_name, problem_size, args.scenario, settings, log_name))
+                except cluster.TaskError as e:
+                    print("{0} failed: {1}".format(log_name, e))
+                    return None
+            times = experiment.worker_total_times_ms(c, node_ids, log_name + "_w*")
+            if len(times) != len(node_ids) * settings.workers_per_node:
+                return None
+            return max(times)
+
+        best, times = autotune.successive_halving(candidates, measure, args.min_trials, args.eta)
+        program = "{0}_{1}".format(problem_name, problem_size)
+        autotune.save_tuned((setup, args.location, program), best, times, {"scenario": args.scenario, "mem_limit": args.mem_limit}, autotune.TUNED_WAN_FILE)
+        print("Best for {0}: workers_per_node = {1}, ot_pipeline_depth = {2}, ot_num_daemons = {3}".format(program, *best))
+    print("Tuned settings saved to {0}".format(autotune.TUNED_WAN_FILE))
+
+def fill_halfgates_baseline_defaults(args):
     if args.sizes is None:
         args.sizes = tuple(2 ** i for i in range(10, 21))
     if args.scenarios is None:
         args.scenarios = ("mage", "unbounded", "os", "emp")
 
+def run_halfgates_baseline(args):
+    fill_halfgates_baseline_defaults(args)
+
     c = cluster.Cluster.load_from_file("cluster.json")
-    assert len(c.machines) == 2
+    if args.concurrent:
+        sched = scheduler.ExperimentScheduler(c, 1)
+    else:
+        assert len(c.machines) == 2
+    j, skip = open_sweep(args, c)
 
     problem_name = "merge_sorted"
     protocol = "halfgates"
@@ -186,18 +558,33 @@ def run_halfgates_baseline(args):
             for scenario in args.scenarios:
                 log_name = "halfgates_baseline_{0}_{1}_{2}_t{3}".format(problem_name, problem_size, scenario, trial)
                 if scenario == "emp":
-                    experiment.run_halfgates_baseline_experiment(c, problem_size, "os", worker_ids, log_name)
+                    run = lambda ids, problem_size = problem_size, log_name = log_name: experiment.run_halfgates_baseline_experiment(c, problem_size, "os", ids, log_name)
+                else:
+                    run = lambda ids, problem_size = problem_size, scenario = scenario, log_name = log_name: experiment.run_lan_experiment(c, problem_name, problem_size, protocol, scenario, args.mem_limit, ids, log_name)
+                if skip(log_name, scenario != "emp"):
+                    continue
+                if args.concurrent:
+                    sched.submit(log_name, True, lambda ids, run = run, log_name = log_name: j.run(log_name, lambda: run(ids)))
                 else:
-                    experiment.run_lan_experiment(c, problem_name, problem_size, protocol, scenario, args.mem_limit, worker_ids, log_name)
+                    j.run(log_name, lambda: run(worker_ids))
+    if args.concurrent:
+        sched.run()
 
-def run_ckks_baseline(args):
+def fill_ckks_baseline_defaults(args):
     if args.sizes is None:
         args.sizes = tuple(2 ** i for i in range(6, 15))
     if args.scenarios is None:
         args.scenarios = ("mage", "unbounded", "os", "seal")
 
+def run_ckks_baseline(args):
+    fill_ckks_baseline_defaults(args)
+
     c = cluster.Cluster.load_from_file("cluster.json")
-    assert len(c.machines) == 1 or len(c.machines) == 2
+    if args.concurrent:
+        sched = scheduler.ExperimentScheduler(c, 1)
+    else:
+        assert len(c.machines) == 1 or len(c.machines) == 2
+    j, skip = open_sweep(args, c)
 
     problem_name = "real_statistics"
     protocol = "ckks"
@@ -208,9 +595,17 @@ def run_ckks_baseline(args):
             for scenario in args.scenarios:
                 log_name = "ckks_baseline_{0}_{1}_{2}_t{3}".format(problem_name, problem_size, scenario, trial)
                 if scenario == "seal":
-                    experiment.run_ckks_baseline_experiment(c, problem_size, "os", worker_ids, log_name)
+                    run = lambda ids, problem_size = problem_size, log_name = log_name: experiment.run_ckks_baseline_experiment(c, problem_size, "os", ids, log_name)
+                else:
+                    run = lambda ids, problem_size = problem_size, scenario = scenario, log_name = log_name: experiment.run_lan_experiment(c, problem_name, problem_size, protocol, scenario, args.mem_limit, ids, log_name)
+                if skip(log_name, scenario != "seal"):
+                    continue
+                if args.concurrent:
+                    sched.submit(log_name, False, lambda ids, run = run, log_name = log_name: j.run(log_name, lambda: run(ids)))
                 else:
-                    experiment.run_lan_experiment(c, problem_name, problem_size, protocol, scenario, args.mem_limit, worker_ids, log_name)
+                    j.run(log_name, lambda: run(worker_ids))
+    if args.concurrent:
+        sched.run()
 
 def deallocate(args):
     print("Deallocating cluster...")
@@ -220,8 +615,53 @@ def deallocate(args):
         os.remove("cluster.json")
     except FileNotFoundError:
         pass
+    remote.forget_machines()
+    experiment.present_configs.clear()
     print("Done.")
 
+# Moves what setup_code.sh built in ~/work to /opt, which provision.sh copies
+# into ~/work on machines spawned from the image, and removes what is left
+BAKE_COMMAND = " && ".join((
+    "sudo rm -rf /opt/mage /opt/emp-tool /opt/emp-ot /opt/emp-sh2pc",
+    "sudo mv ~/work/mage ~/work/emp-tool ~/work/emp-ot ~/work/emp-sh2pc /opt",
+    "rm -rf ~/work ~/yaml-cpp* ~/tfhe ~/SEAL-3.6.1 ~/v3.6.1.tar.gz",
+    "sudo cloud-init clean --logs",
+))
+
+def bake_image(args):
+    if args.providers is None:
+        args.providers = ("azure", "gcloud")
+    if args.name == "":
+        args.name = "mage-bake-{0}".format(socket.gethostname())
+    if args.version is None:
+        args.version = cloud.next_image_version(args.providers, args.project_gcloud)
+    image_name = cloud.IMAGE_NAME_FORMAT.format(args.version)
+    print("Spawning a machine on {0} to bake {1}...".format(" and ".join(args.providers), image_name))
+    c = cloud.spawn_cluster(args.name, 1 if "azure" in args.providers else 0, "ubuntu", False, "regular", args.project_gcloud, *(("oregon",) if "gcloud" in args.providers else ()))
+    if c is None:
+        sys.exit(1)
+    builds = mage_builds(args.repository, args.checkout)
+    def bake(machine, id):
+        boot_time = cloud.wait_for_machine(machine, c.setup)
+        print("Machine {0} ready after {1:.0f} seconds".format(id, boot_time))
+        remote.exec_script(machine.public_ip_address, "./scripts/install_deps.sh", "--install-utils --setup-wan-tcp")
+        # Built on the boot disk, since the image is made from it
+        remote.exec_sync(machine.public_ip_address, "mkdir -p ~/work", check_exitcode = True)
+        deps_name, mage_names = build_once(machine, builds, True)
+        remote.exec_sync(machine.public_ip_address, BAKE_COMMAND, check_exitcode = True)
+        print("Capturing {0} on {1}...".format(image_name, machine.provider))
+        image_id = cloud.capture_image(c, machine, image_name, args.project_gcloud)
+        return (machine.provider, {"name": image_name, "id": image_id, "version": args.version, "repository": args.repository, "checkout": args.checkout, "deps_archive": deps_name, "mage_archive": mage_names[0]})
+    try:
+        entries = dict(c.for_each_concurrently(bake))
+    finally:
+        print("Deallocating the machines used to bake {0}...".format(image_name))
+        cloud.deallocate_cluster(c)
+    cloud.save_baked_images(entries)
+    for provider, entry in sorted(entries.items()):
+        print("{0}: {1}".format(provider, entry["id"]))
+    print("Recorded in {0}; \"{1} spawn -i\" will use these images.".format(cloud.BAKED_IMAGES_FILE, sys.argv[0]))
+
 def purge(args):
     print("Purging cluster...")
     if args.gcloud_machine_locations is None:
@@ -235,6 +675,97 @@ def purge(args):
         pass
     print("Done.")
 
+def calibrate(args):
+    c = cluster.Cluster.load_from_file("cluster.json")
+    if args.protocols is None:
+        args.protocols = ("halfgates", "ckks")
+    if args.limits is None:
+        args.limits = calibration.DEFAULT_LIMITS
+    programs = {"halfgates": parse_program(args.halfgates_program), "ckks": parse_program(args.ckks_program)}
+    workers_per_node = configs.generate_configs.WORKERS_PER_NODE
+    for protocol in args.protocols:
+        num_pages, fitted = calibration.calibrate_protocol(c, protocol, programs[protocol], args.limits, workers_per_node, args.margin)
+        calibration.save_calibration(protocol, num_pages, fitted)
+    print("Calibration saved to {0}".format(configs.CALIBRATION_FILE))
+
+    # Replace the configs generated with the old page counts
+    experiment.present_configs.clear()
+    if args.lazy_configs:
+        c.for_each_concurrently(lambda machine, id: remote.exec_sync(machine.public_ip_address, "rm -rf ~/config ~/config-* ~/.configs"))
+    else:
+        sizes = configs.push_configs(c)
+        print("Configs sent to {0} machines ({1:.1f} MiB)".format(len(sizes), sum(sizes.values()) / (1 << 20)))
+
+def count_experiments(argv, num_lan_machines):
+    args = build_parser().parse_args(argv)
+    if getattr(args, "func", None) is run_ab:
+        fill_run_lan_defaults(args, num_lan_machines)
+        return 2 * len(args.programs) * args.trials * len(args.scenarios)
+    elif getattr(args, "func", None) is tune_prefetch:
+        fill_lan_program_defaults(args, num_lan_machines)
+        runs = 0
+        for program in args.programs:
+            protocol = "ckks" if program.startswith("real") else "halfgates"
+            buffer_sizes = autotune.DEFAULT_PREFETCH_BUFFER_SIZES[protocol] if args.buffer_sizes is None else args.buffer_sizes
+            lookaheads = autotune.DEFAULT_PREFETCH_LOOKAHEADS[protocol] if args.lookaheads is None else args.lookaheads
+            runs += autotune.count_runs(len(buffer_sizes) * len(lookaheads), args.min_trials, args.eta)
+        return runs * (1 if args.mem_limits is None else len(args.mem_limits))
+    elif getattr(args, "func", None) is autotune_wan:
+        fill_wan_settings_defaults(args)
+        programs = [p for p in args.programs if not p.startswith("real")]
+        return len(programs) * autotune.count_runs(len(autotune.wan_settings(args.workers_per_node, args.ot_num_connections, args.ot_concurrency)), args.min_trials, args.eta)
+    elif hasattr(args, "ot_concurrency"):
+        fill_run_wan_defaults(args)
+        programs = [p for p in args.programs if not p.startswith("real")]
+        return len(programs) * trial_controller(args).max_trials * len(args.scenarios) * len(autotune.wan_settings(args.workers_per_node, args.ot_num_connections, args.ot_concurrency))
+    elif hasattr(args, "num_nodes"):
+        fill_run_lan_defaults(args, num_lan_machines)
+        return len(args.programs) * trial_controller(args).max_trials * len(args.scenarios)
+    elif hasattr(args, "sizes"):
+        if args.func is run_halfgates_baseline:
+            fill_halfgates_baseline_defaults(args)
+        else:
+            fill_ckks_baseline_defaults(args)
+        return len(args.sizes) * args.trials * len(args.scenarios)
+    return 0
+
+def run_plan(args):
+    groups = plan.load_plan(args.plan_file)
+    sessions = plan.compile_plan(groups)
+    past_times = journal.SweepJournal(None).elapsed_times()
+    experiment_minutes = plan.DEFAULT_EXPERIMENT_MINUTES
+    if len(past_times) != 0:
+        experiment_minutes = sum(past_times) / len(past_times) / 60.0
+    steps = plan.plan_steps(sessions, count_experiments, experiment_minutes)
+    plan.print_plan(steps)
+    if args.dry_run:
+        return
+    if os.path.exists("cluster.json"):
+        print("Cluster already exists!")
+        print("The plan spawns its own clusters, so first run \"{0} deallocate\"".format(sys.argv[0]))
+        sys.exit(1)
+
+    def execute(argv):
+        print("==> {0} {1}".format(sys.argv[0], " ".join(argv)))
+        step_args = build_parser().parse_args(argv)
+        step_args.func(step_args)
+
+    for shape, session_groups in sessions:
+        try:
+            execute(plan.spawn_argv(shape))
+            execute(["push-configs"])
+            for g in session_groups:
+                try:
+                    for argv, _ in g.runs:
+                        execute(argv)
+                finally:
+                    execute(["fetch-logs", "-a", g.logs_directory])
+        finally:
+            # Spawn writes cluster.json as soon as the machines exist, so this
+            # also deallocates a cluster whose provisioning failed
+            if os.path.exists("cluster.json"):
+                execute(["deallocate"])
+
 def logs_directory(c, id, logs_directory):
     if id < c.num_lan_machines:
         directory_name = "{0:02d}".format(id)
@@ -250,21 +781,77 @@ def logs_directory(c, id, logs_directory):
                 break
     return os.path.join(".", logs_directory, directory_name)
 
+# Each machine's logs directory has a manifest of the files already fetched
+# into it, so that fetch-logs only transfers new or changed files.
+LOG_MANIFEST = ".manifest.json"
+FETCH_LOGS_BATCH_BYTES = 64 * 1024 * 1024
+FETCH_LOGS_MAX_CONCURRENCY = 8
+
+def load_log_manifest(directory):
+    manifest_file = os.path.join(directory, LOG_MANIFEST)
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file, "r") as f:
+        return json.load(f)
+
+def save_log_manifest(directory, manifest):
+    manifest_file = os.path.join(directory, LOG_MANIFEST)
+    with open(manifest_file + ".tmp", "w") as f:
+        json.dump(manifest, f, indent = 4, sort_keys = True)
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+def fetch_logs_once(c, args):
+    def fetch_logs_from(machine, id):
+        directory = logs_directory(c, id, args.directory)
+        manifest = load_log_manifest(directory)
+        remote_files = remote.list_files(machine.public_ip_address, "~/logs")
+        batches = []
+        batch_bytes = 0
+        for name, (size, mtime) in sorted(remote_files.items()):
+            entry = manifest.get(name)
+            local_file = os.path.join(directory, name)
+            if entry is not None and entry["size"] == size and entry["mtime"] == mtime and os.path.exists(local_file) and os.path.getsize(local_file) == size:
+                continue
+            if len(batches) == 0 or batch_bytes + size > FETCH_LOGS_BATCH_BYTES:
+                batches.append([])
+                batch_bytes = 0
+            batches[-1].append(name)
+            batch_bytes += size
+        for batch in batches:
+            remote.copy_files_compressed(machine.public_ip_address, "~/logs", batch, directory)
+            for name in batch:
+                size, mtime = remote_files[name]
+                manifest[name] = {"size": size, "mtime": mtime, "sha256": remote.file_digest(os.path.join(directory, name))}
+            save_log_manifest(directory, manifest)
+        if args.archive and len(remote_files) != 0:
+            # Every file listed is now fetched, so a later fetch into another
+            # directory (e.g., for the next group of a plan) leaves them be
+            remote.exec_sync(machine.public_ip_address, "mkdir -p {0} && cd ~/logs && xargs -0 mv -t {0}".format(experiment.ARCHIVED_LOGS_DIRECTORY), check_exitcode = True, input_data = "\0".join(sorted(remote_files)).encode())
+        return sum(len(batch) for batch in batches)
+
+    counts = c.for_each_concurrently(fetch_logs_from, max_concurrency = args.max_concurrency)
+    return sum(counts)
+
 def fetch_logs(args):
+    if args.archive and args.watch is not None:
+        print("Logs cannot be archived while watching, since experiments may still be writing them")
+        sys.exit(1)
     print("Fetching logs...")
     c = cluster.Cluster.load_from_file("cluster.json")
     for id in range(len(c.machines)):
         os.makedirs(logs_directory(c, id, args.directory), exist_ok = True)
 
-    def fetch_logs_from(machine, id):
-        directory = logs_directory(c, id, args.directory)
-        remote.copy_from(machine.public_ip_address, False, "~/logs/*", directory)
-
-    c.for_each_concurrently(fetch_logs_from)
+    while True:
+        count = fetch_logs_once(c, args)
+        print("Fetched {0} new or updated log files.".format(count))
+        if args.watch is None:
+            break
+        time.sleep(args.watch)
     print("Done.")
 
-if __name__ == "__main__":
+def build_parser():
     parser = argparse.ArgumentParser(description = "Run benchmark experiments on MAGE.")
+    parser.add_argument("--ssh-stats", action = "store_true")
     subparsers = parser.add_subparsers()
 
     parser_spawn = subparsers.add_parser("spawn")
@@ -277,28 +864,82 @@ if __name__ == "__main__":
     parser_spawn.add_argument("-c", "--checkout", default = "main")
     parser_spawn.add_argument("-i", "--image", action = "store_true")
     parser_spawn.add_argument("-p", "--project-gcloud", default = "rise-mage")
+    parser_spawn.add_argument("-j", "--max-concurrency", type = int)
+    parser_spawn.add_argument("-l", "--lazy-configs", action = "store_true")
+    parser_spawn.add_argument("--checkout-b")
+    parser_spawn.add_argument("--repository-b")
     parser_spawn.set_defaults(func = spawn)
 
     parser_provision = subparsers.add_parser("provision")
+    parser_provision.add_argument("-r", "--repository", default = "https://github.com/ucbrise/mage")
+    parser_provision.add_argument("-c", "--checkout", default = "main")
+    parser_provision.add_argument("-j", "--max-concurrency", type = int)
+    parser_provision.add_argument("-l", "--lazy-configs", action = "store_true")
+    parser_provision.add_argument("--checkout-b")
+    parser_provision.add_argument("--repository-b")
     parser_provision.set_defaults(func = provision)
 
+    parser_push_configs = subparsers.add_parser("push-configs")
+    parser_push_configs.add_argument("-j", "--max-concurrency", type = int)
+    parser_push_configs.set_defaults(func = push_configs)
+
     parser_run_lan = subparsers.add_parser("run-lan")
     parser_run_lan.add_argument("-p", "--programs", action = "extend", nargs = "+")
     parser_run_lan.add_argument("-s", "--scenarios", action = "extend", nargs = "+", choices = ("unbounded", "mage", "os"))
     parser_run_lan.add_argument("-m", "--mem-limit", type=str, default = "1gb")
     parser_run_lan.add_argument("-t", "--trials", type = int, default = 1)
+    parser_run_lan.add_argument("--target-width", type = float)
+    parser_run_lan.add_argument("--max-trials", type = int, default = trials.DEFAULT_MAX_TRIALS)
+    parser_run_lan.add_argument("--confidence", type = float, choices = sorted(trials.T_TABLE), default = trials.DEFAULT_CONFIDENCE)
+    parser_run_lan.add_argument("--resume", action = "store_true")
+    parser_run_lan.add_argument("--stream", action = "store_true")
+    parser_run_lan.add_argument("--sample-interval", type = int, default = experiment.SAMPLE_INTERVAL_MS)
+    parser_run_lan.add_argument("--concurrent", action = "store_true")
     parser_run_lan.add_argument("-n", "--num-nodes", type = int)
+    parser_run_lan.add_argument("--tuned-prefetch", action = "store_true")
     parser_run_lan.set_defaults(func = run_lan)
 
+    parser_ab = subparsers.add_parser("ab")
+    parser_ab.add_argument("-p", "--programs", action = "extend", nargs = "+")
+    parser_ab.add_argument("-s", "--scenarios", action = "extend", nargs = "+", choices = ("unbounded", "mage", "os"))
+    parser_ab.add_argument("-m", "--mem-limit", type=str, default = "1gb")
+    parser_ab.add_argument("-t", "--trials", type = int, default = 5)
+    parser_ab.add_argument("--confidence", type = float, choices = sorted(trials.T_TABLE), default = trials.DEFAULT_CONFIDENCE)
+    parser_ab.add_argument("--resume", action = "store_true")
+    parser_ab.add_argument("--stream", action = "store_true")
+    parser_ab.add_argument("--sample-interval", type = int, default = experiment.SAMPLE_INTERVAL_MS)
+    parser_ab.add_argument("-n", "--num-nodes", type = int)
+    parser_ab.set_defaults(func = run_ab)
+
+    parser_tune_prefetch = subparsers.add_parser("tune-prefetch")
+    parser_tune_prefetch.add_argument("-p", "--programs", action = "extend", nargs = "+")
+    parser_tune_prefetch.add_argument("-m", "--mem-limits", action = "extend", nargs = "+")
+    parser_tune_prefetch.add_argument("-b", "--buffer-sizes", type = int, action = "extend", nargs = "+")
+    parser_tune_prefetch.add_argument("-a", "--lookaheads", type = int, action = "extend", nargs = "+")
+    parser_tune_prefetch.add_argument("-n", "--num-nodes", type = int)
+    parser_tune_prefetch.add_argument("--min-trials", type = int, default = 1)
+    parser_tune_prefetch.add_argument("--eta", type = int, default = autotune.DEFAULT_ETA)
+    parser_tune_prefetch.add_argument("--resume", action = "store_true")
+    parser_tune_prefetch.add_argument("--stream", action = "store_true")
+    parser_tune_prefetch.add_argument("--sample-interval", type = int, default = experiment.SAMPLE_INTERVAL_MS)
+    parser_tune_prefetch.set_defaults(func = tune_prefetch)
+
     parser_run_wan = subparsers.add_parser("run-wan")
     parser_run_wan.add_argument("location", choices = ("oregon", "iowa", "virginia"))
     parser_run_wan.add_argument("-p", "--programs", action = "extend", nargs = "+")
     parser_run_wan.add_argument("-s", "--scenarios", action = "extend", nargs = "+", choices = ("unbounded", "mage", "os"))
     parser_run_wan.add_argument("-m", "--mem-limit", type=str, default = "1gb")
     parser_run_wan.add_argument("-t", "--trials", type = int, default = 1)
+    parser_run_wan.add_argument("--target-width", type = float)
+    parser_run_wan.add_argument("--max-trials", type = int, default = trials.DEFAULT_MAX_TRIALS)
+    parser_run_wan.add_argument("--confidence", type = float, choices = sorted(trials.T_TABLE), default = trials.DEFAULT_CONFIDENCE)
+    parser_run_wan.add_argument("--resume", action = "store_true")
+    parser_run_wan.add_argument("--stream", action = "store_true")
+    parser_run_wan.add_argument("--sample-interval", type = int, default = experiment.SAMPLE_INTERVAL_MS)
     parser_run_wan.add_argument("-w", "--workers-per-node", type = int, action = "extend", nargs = "+")
     parser_run_wan.add_argument("-o", "--ot-concurrency", type = int, action = "extend", nargs = "+")
     parser_run_wan.add_argument("-c", "--ot-num-connections", type = int, action = "extend", nargs = "+")
+    parser_run_wan.add_argument("--tuned", action = "store_true")
     parser_run_wan.set_defaults(func = make_run_wan(False))
 
     parser_run_paired_wan = subparsers.add_parser("run-paired-wan")
@@ -307,16 +948,41 @@ if __name__ == "__main__":
     parser_run_paired_wan.add_argument("-s", "--scenarios", action = "extend", nargs = "+", choices = ("unbounded", "mage", "os"))
     parser_run_paired_wan.add_argument("-m", "--mem-limit", type=str, default = "max")
     parser_run_paired_wan.add_argument("-t", "--trials", type = int, default = 1)
+    parser_run_paired_wan.add_argument("--target-width", type = float)
+    parser_run_paired_wan.add_argument("--max-trials", type = int, default = trials.DEFAULT_MAX_TRIALS)
+    parser_run_paired_wan.add_argument("--confidence", type = float, choices = sorted(trials.T_TABLE), default = trials.DEFAULT_CONFIDENCE)
+    parser_run_paired_wan.add_argument("--resume", action = "store_true")
+    parser_run_paired_wan.add_argument("--stream", action = "store_true")
+    parser_run_paired_wan.add_argument("--sample-interval", type = int, default = experiment.SAMPLE_INTERVAL_MS)
     parser_run_paired_wan.add_argument("-w", "--workers-per-node", type = int, action = "extend", nargs = "+")
     parser_run_paired_wan.add_argument("-o", "--ot-concurrency", type = int, action = "extend", nargs = "+")
     parser_run_paired_wan.add_argument("-c", "--ot-num-connections", type = int, action = "extend", nargs = "+")
+    parser_run_paired_wan.add_argument("--tuned", action = "store_true")
     parser_run_paired_wan.set_defaults(func = make_run_wan(True))
 
+    parser_autotune_wan = subparsers.add_parser("autotune-wan")
+    parser_autotune_wan.add_argument("location", choices = ("oregon", "iowa", "virginia"))
+    parser_autotune_wan.add_argument("-p", "--programs", action = "extend", nargs = "+")
+    parser_autotune_wan.add_argument("-s", "--scenario", choices = ("unbounded", "mage", "os"), default = "mage")
+    parser_autotune_wan.add_argument("-m", "--mem-limit", type=str)
+    parser_autotune_wan.add_argument("--paired", action = "store_true")
+    parser_autotune_wan.add_argument("--min-trials", type = int, default = 1)
+    parser_autotune_wan.add_argument("--eta", type = int, default = autotune.DEFAULT_ETA)
+    parser_autotune_wan.add_argument("--resume", action = "store_true")
+    parser_autotune_wan.add_argument("--stream", action = "store_true")
+    parser_autotune_wan.add_argument("--sample-interval", type = int, default = experiment.SAMPLE_INTERVAL_MS)
+    parser_autotune_wan.add_argument("-w", "--workers-per-node", type = int, action = "extend", nargs = "+")
+    parser_autotune_wan.add_argument("-o", "--ot-concurrency", type = int, action = "extend", nargs = "+")
+    parser_autotune_wan.add_argument("-c", "--ot-num-connections", type = int, action = "extend", nargs = "+")
+    parser_autotune_wan.set_defaults(func = autotune_wan)
+
     parser_run_hgb = subparsers.add_parser("run-halfgates-baseline")
     parser_run_hgb.add_argument("-z", "--sizes", action = "extend", nargs = "+", type = int)
     parser_run_hgb.add_argument("-s", "--scenarios", action = "extend", nargs = "+", choices = ("unbounded", "mage", "os", "emp"))
     parser_run_hgb.add_argument("-m", "--mem-limit", type=str, default = "1gb")
     parser_run_hgb.add_argument("-t", "--trials", type = int, default = 1)
+    parser_run_hgb.add_argument("--resume", action = "store_true")
+    parser_run_hgb.add_argument("--concurrent", action = "store_true")
     parser_run_hgb.set_defaults(func = run_halfgates_baseline)
 
     parser_run_ckb = subparsers.add_parser("run-ckks-baseline")
@@ -324,11 +990,22 @@ if __name__ == "__main__":
     parser_run_ckb.add_argument("-s", "--scenarios", action = "extend", nargs = "+", choices = ("unbounded", "mage", "os", "seal"))
     parser_run_ckb.add_argument("-m", "--mem-limit", type=str, default = "1gb")
     parser_run_ckb.add_argument("-t", "--trials", type = int, default = 1)
+    parser_run_ckb.add_argument("--resume", action = "store_true")
+    parser_run_ckb.add_argument("--concurrent", action = "store_true")
     parser_run_ckb.set_defaults(func = run_ckks_baseline)
 
     parser_deallocate = subparsers.add_parser("deallocate")
     parser_deallocate.set_defaults(func = deallocate)
 
+    parser_bake_image = subparsers.add_parser("bake-image")
+    parser_bake_image.add_argument("-n", "--name", default = "")
+    parser_bake_image.add_argument("-r", "--repository", default = "https://github.com/ucbrise/mage")
+    parser_bake_image.add_argument("-c", "--checkout", default = "main")
+    parser_bake_image.add_argument("-p", "--project-gcloud", default = "rise-mage")
+    parser_bake_image.add_argument("--providers", action = "extend", nargs = "+", choices = ("azure", "gcloud"))
+    parser_bake_image.add_argument("-v", "--version", type = int)
+    parser_bake_image.set_defaults(func = bake_image)
+
     parser_purge = subparsers.add_parser("purge")
     parser_purge.add_argument("-n", "--name", default = "")
     parser_purge.add_argument("-a", "--azure-machine-count", type = int, default = 2)
@@ -341,11 +1018,34 @@ if __name__ == "__main__":
 
     parser_fetch_logs = subparsers.add_parser("fetch-logs")
     parser_fetch_logs.add_argument("directory")
+    parser_fetch_logs.add_argument("-j", "--max-concurrency", type = int, default = FETCH_LOGS_MAX_CONCURRENCY)
+    parser_fetch_logs.add_argument("-w", "--watch", type = int)
+    parser_fetch_logs.add_argument("-a", "--archive", action = "store_true")
     parser_fetch_logs.set_defaults(func = fetch_logs)
 
+    parser_calibrate = subparsers.add_parser("calibrate")
+    parser_calibrate.add_argument("-p", "--protocols", action = "extend", nargs = "+", choices = ("halfgates", "ckks"))
+    parser_calibrate.add_argument("-m", "--limits", action = "extend", nargs = "+", choices = calibration.DEFAULT_LIMITS)
+    parser_calibrate.add_argument("--halfgates-program", default = "merge_sorted_1048576")
+    parser_calibrate.add_argument("--ckks-program", default = "real_statistics_16384")
+    parser_calibrate.add_argument("--margin", type = float, default = calibration.DEFAULT_MARGIN)
+    parser_calibrate.add_argument("-l", "--lazy-configs", action = "store_true")
+    parser_calibrate.set_defaults(func = calibrate)
+
+    parser_plan = subparsers.add_parser("plan")
+    parser_plan.add_argument("plan_file")
+    parser_plan.add_argument("-n", "--dry-run", action = "store_true")
+    parser_plan.set_defaults(func = run_plan)
+
+    return parser
+
+if __name__ == "__main__":
+    parser = build_parser()
     args = parser.parse_args()
     if hasattr(args, 'func'):
         args.func(args)
+        if args.ssh_stats:
+            remote.print_latency_stats()
     else:
         print("Nothing to do!")
         print("Try: {0} -h".format(sys.argv[0]))
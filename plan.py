@@ -0,0 +1,125 @@
+import collections
+import shlex
+
+import yaml
+
+# Rough costs used to estimate the wall time of a plan before running it. The
+# per-experiment cost is replaced by the mean of past experiments in the sweep
+# journal, when there are any.
+SPAWN_MINUTES_WITH_IMAGE = 10
+SPAWN_MINUTES_WITHOUT_IMAGE = 40
+PUSH_CONFIGS_MINUTES = 2
+FETCH_LOGS_MINUTES = 1
+DEALLOCATE_MINUTES = 5
+DEFAULT_EXPERIMENT_MINUTES = 5
+
+ClusterShape = collections.namedtuple("ClusterShape", ("azure_machine_count", "gcloud_machine_locations", "wan_setup", "large_work_disk", "image", "repository", "checkout", "project_gcloud"))
+
+class PlanGroup(object):
+    def __init__(self, name, shape, logs_directory, runs):
+        self.name = name
+        self.shape = shape
+        self.logs_directory = logs_directory
+        self.runs = runs # List of (argv, minutes or None)
+
+class PlanStep(object):
+    def __init__(self, name, argv, depends_on, minutes):
+        self.name = name
+        self.argv = argv
+        self.depends_on = depends_on
+        self.minutes = minutes
+
+def load_plan(filename):
+    # A plan file looks like this:
+    #
+    # defaults:
+    #   cluster: {image: true}
+    # groups:
+    #   - name: baseline
+    #     cluster: {azure: 2}
+    #     logs: logs-baseline
+    #     runs:
+    #       - run-halfgates-baseline -t 1 -s os unbounded mage emp
+    #       - {command: run-ckks-baseline -t 1, minutes_per_experiment: 2}
+    #
+    # Cluster keys are azure, gcloud, setup, large_work_disk, image,
+    # repository, checkout, and project; they default to the same values as
+    # the options of "magebench.py spawn".
+    with open(filename, "r") as f:
+        document = yaml.safe_load(f)
+    defaults = document.get("defaults", {}).get("cluster", {})
+    groups = []
+    for i, g in enumerate(document["groups"]):
+        c = dict(defaults)
+        c.update(g.get("cluster", {}))
+        shape = ClusterShape(int(c.get("azure", 2)), tuple(c.get("gcloud", ())), c.get("setup", "regular"), bool(c.get("large_work_disk", False)), bool(c.get("image", False)), c.get("repository", "https://github.com/ucbrise/mage"), c.get("checkout", "main"), c.get("project", "rise-mage"))
+        name = g.get("name", "group{0}".format(i))
+        if "logs" not in g:
+            raise RuntimeError("Plan group {0} does not say where to put its logs".format(name))
+        runs = []
+        for run in g.get("runs", ()):
+            if isinstance(run, str):
+                runs.append((shlex.split(run), None))
+            else:
+                runs.append((shlex.split(run["command"]), run.get("minutes_per_experiment")))
+        groups.append(PlanGroup(name, shape, g["logs"], runs))
+    return groups
+
+def compile_plan(groups):
+    # Groups that need the same cluster shape run back-to-back on one cluster,
+    # so each shape is spawned, provisioned, and sent its configs only once
+    sessions = collections.OrderedDict()
+    for g in groups:
+        sessions.setdefault(g.shape, []).append(g)
+    return list(sessions.items())
+
+def spawn_argv(shape):
+    # Configs are left to their own step (see plan_steps)
+    argv = ["spawn", "-a", str(shape.azure_machine_count), "-s", shape.wan_setup, "-r", shape.repository, "-c", shape.checkout, "-p", shape.project_gcloud, "-l"]
+    if len(shape.gcloud_machine_locations) != 0:
+        argv.append("-g")
+        argv.extend(shape.gcloud_machine_locations)
+    if shape.large_work_disk:
+        argv.append("-d")
+    if shape.image:
+        argv.append("-i")
+    return argv
+
+def plan_steps(sessions, count_experiments, experiment_minutes = DEFAULT_EXPERIMENT_MINUTES):
+    # Returns the dependency graph of the plan, in the order it will run.
+    # count_experiments(argv, num_lan_machines) gives the number of
+    # experiments that a run command expands to.
+    #
+    # Inputs and memory programs are not steps of their own: each run
+    # generates the ones it needs, and the node-side caches make the runs
+    # after the first that share an input reuse it. Each group's fetch moves
+    # the logs it fetched out of ~/logs on the nodes, so the next group on the
+    # same cluster must start after it, and fetches only its own logs.
+    steps = []
+    for i, (shape, groups) in enumerate(sessions):
+        spawn_name = "spawn{0}".format(i)
+        steps.append(PlanStep(spawn_name, spawn_argv(shape), [], SPAWN_MINUTES_WITH_IMAGE if shape.image else SPAWN_MINUTES_WITHOUT_IMAGE))
+        configs_name = "configs{0}".format(i)
+        steps.append(PlanStep(configs_name, ["push-configs"], [spawn_name], PUSH_CONFIGS_MINUTES))
+        previous = [configs_name]
+        fetch_names = []
+        for g in groups:
+            for j, (argv, minutes) in enumerate(g.runs):
+                run_name = "{0}.run{1}".format(g.name, j)
+                count = count_experiments(argv, shape.azure_machine_count)
+                steps.append(PlanStep(run_name, argv, previous, count * (experiment_minutes if minutes is None else minutes)))
+                previous = [run_name]
+            fetch_name = "{0}.fetch".format(g.name)
+            steps.append(PlanStep(fetch_name, ["fetch-logs", "-a", g.logs_directory], previous, FETCH_LOGS_MINUTES))
+            fetch_names.append(fetch_name)
+            previous = [configs_name, fetch_name]
+        steps.append(PlanStep("deallocate{0}".format(i), ["deallocate"], fetch_names, DEALLOCATE_MINUTES))
+    return steps
+
+def print_plan(steps):
+    for step in steps:
+        print("{0:<28} {1:>8.0f} min  {2}".format(step.name, step.minutes, " ".join(step.argv)))
+        if len(step.depends_on) != 0:
+            print("{0:<28} after {1}".format("", ", ".join(step.depends_on)))
+    total = sum(step.minutes for step in steps)
+    print("Estimated wall time: {0:.0f} minutes ({1:.1f} hours)".format(total, total / 60.0))
@@ -1,9 +1,89 @@
+import atexit
+import hashlib
 import os.path
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 
-def exec_sync(ip_address, command, check_exitcode = False):
-    result = subprocess.run(("ssh", "-q", "-o", "StrictHostKeyChecking=no", "-i", "mage", "mage@{0}".format(ip_address), command))
+import cancellation
+
+# All ssh/scp invocations to the same machine share one multiplexed SSH
+# connection (OpenSSH's ControlMaster), so only the first command to each
+# machine pays for the TCP and key-exchange handshake.
+CONTROL_DIRECTORY = os.path.join(tempfile.gettempdir(), "magebench-ssh-{0}".format(os.getpid()))
+CONTROL_PERSIST = "10m"
+
+session_lock = threading.Lock()
+session_ip_addresses = set()
+latency_stats = {}
+
+# Maps (ip_address, remote_name) to the SHA-256 digest of the script that the
+# machine is known to have, so that unchanged scripts are not uploaded again.
+deploy_lock = threading.Lock()
+deployed_scripts = {}
+
+def ssh_options(ip_address):
+    with session_lock:
+        if len(session_ip_addresses) == 0:
+            os.makedirs(CONTROL_DIRECTORY, mode = 0o700, exist_ok = True)
+        session_ip_addresses.add(ip_address)
+    return ("-o", "StrictHostKeyChecking=no", "-o", "ControlMaster=auto", "-o", "ControlPath={0}".format(os.path.join(CONTROL_DIRECTORY, "%C")), "-o", "ControlPersist={0}".format(CONTROL_PERSIST), "-o", "ServerAliveInterval=60", "-i", "mage")
+
+def record_latency(ip_address, kind, start):
+    elapsed = time.time() - start
+    with session_lock:
+        stats = latency_stats.setdefault((ip_address, kind), [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+
+def get_latency_stats():
+    with session_lock:
+        return {key: {"count": count, "total_s": total, "max_s": maximum} for key, (count, total, maximum) in latency_stats.items()}
+
+def print_latency_stats():
+    for (ip_address, kind), stats in sorted(get_latency_stats().items()):
+        print("{0} {1}: {2} commands, {3:.3f} s average, {4:.3f} s max".format(ip_address, kind, stats["count"], stats["total_s"] / stats["count"], stats["max_s"]))
+
+def close_sessions():
+    with session_lock:
+        ip_addresses = tuple(session_ip_addresses)
+        session_ip_addresses.clear()
+    for ip_address in ip_addresses:
+        subprocess.run(("ssh", "-q", "-o", "ControlPath={0}".format(os.path.join(CONTROL_DIRECTORY, "%C")), "-O", "exit", "mage@{0}".format(ip_address)), stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    try:
+        os.rmdir(CONTROL_DIRECTORY)
+    except OSError:
+        pass
+
+atexit.register(close_sessions)
+
+def forget_machines():
+    # Called when a cluster is deallocated, since a later cluster may be given
+    # the same IP addresses: its machines have none of the scripts deployed to
+    # the old ones, and must not reuse the old ones' SSH connections
+    close_sessions()
+    with deploy_lock:
+        deployed_scripts.clear()
+
+def run_process(command, stdout = None, universal_newlines = False, input_data = None):
+    # Like subprocess.run, except that the process is killed if the task
+    # running it is cancelled (see cancellation.py), which raises Cancelled
+    process = subprocess.Popen(command, stdin = None if input_data is None else subprocess.PIPE, stdout = stdout, universal_newlines = universal_newlines)
+    with cancellation.killed_on_cancel(process):
+        output, _ = process.communicate(input_data)
+    cancellation.check()
+    return subprocess.CompletedProcess(process.args, process.returncode, output)
+
+def exec_sync(ip_address, command, check_exitcode = False, get_output = False, input_data = None):
+    stdout_arg = None
+    if get_output:
+        stdout_arg = subprocess.PIPE
+    start = time.time()
+    result = run_process(("ssh", "-q") + ssh_options(ip_address) + ("mage@{0}".format(ip_address), command), stdout = stdout_arg, universal_newlines = get_output, input_data = input_data)
+    record_latency(ip_address, "exec", start)
     if result.returncode == 255:
         print("Got return code 255 from ssh: check your Internet connection")
         sys.exit(1)
@@ -11,38 +91,113 @@ def exec_sync(ip_address, command, check_exitcode = False):
         result.check_returncode()
     return result
 
+def exec_probe(ip_address, command, connect_timeout = 10):
+    # Unlike exec_sync, an unreachable machine is an expected outcome here
+    result = subprocess.run(("ssh", "-q", "-o", "ConnectTimeout={0}".format(connect_timeout), "-o", "BatchMode=yes") + ssh_options(ip_address) + ("mage@{0}".format(ip_address), command), stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    return result.returncode == 0
+
 def exec_async(ip_address, command, get_output = True):
     stdout_arg = None
     stderr_arg = None
     if get_output:
         stdout_arg = subprocess.PIPE
         stderr_arg = subprocess.PIPE
-    result = subprocess.Popen(("ssh", "-q", "-o", "StrictHostKeyChecking=no", "-i", "mage", "mage@{0}".format(ip_address), command), stdout = stdout_arg, stderr = stderr_arg)
+    result = subprocess.Popen(("ssh", "-q") + ssh_options(ip_address) + ("mage@{0}".format(ip_address), command), stdout = stdout_arg, stderr = stderr_arg)
     return result
 
 def copy_to(ip_address, directory, local_location, remote_location = "~"):
     assert local_location.strip() != ""
     assert remote_location.strip() != ""
-    command = ("scp", "-q", "-o", "StrictHostKeyChecking=no", "-i", "mage", local_location, "mage@{0}:{1}".format(ip_address, remote_location))
+    command = ("scp", "-q") + ssh_options(ip_address)
     if directory:
-        command = ("scp", "-q", "-o", "StrictHostKeyChecking=no", "-r") + command[4:]
-    subprocess.run(command, check = True)
+        command = command + ("-r",)
+    command = command + (local_location, "mage@{0}:{1}".format(ip_address, remote_location))
+    start = time.time()
+    run_process(command).check_returncode()
+    record_latency(ip_address, "copy_to", start)
 
 def copy_from(ip_address, directory, remote_location, local_location = "."):
     assert local_location.strip() != ""
     assert remote_location.strip() != ""
-    command = ("scp", "-q", "-o", "StrictHostKeyChecking=no", "-i", "mage", "mage@{0}:{1}".format(ip_address, remote_location), local_location)
+    command = ("scp", "-q") + ssh_options(ip_address)
     if directory:
-        command = ("scp", "-q", "-o", "StrictHostKeyChecking=no", "-r") + command[4:]
-    subprocess.run(command, check = True)
+        command = command + ("-r",)
+    command = command + ("mage@{0}:{1}".format(ip_address, remote_location), local_location)
+    start = time.time()
+    run_process(command).check_returncode()
+    record_latency(ip_address, "copy_from", start)
+
+def list_files(ip_address, remote_directory):
+    # Returns a dictionary mapping the name of each regular file directly in
+    # remote_directory to its (size, mtime), where mtime is kept as the string
+    # that find printed so that it compares exactly.
+    result = exec_sync(ip_address, "find {0} -maxdepth 1 -type f -printf '%f\\t%s\\t%T@\\n'".format(remote_directory), check_exitcode = True, get_output = True)
+    files = {}
+    for line in result.stdout.splitlines():
+        tokens = line.split("\t")
+        if len(tokens) == 3:
+            files[tokens[0]] = (int(tokens[1]), tokens[2])
+    return files
+
+def copy_files_compressed(ip_address, remote_directory, names, local_location):
+    # Copies the named files out of remote_directory as one gzipped tar stream
+    # over the existing SSH connection, which is much faster than scp for many
+    # small, compressible files such as logs. A file that is still being
+    # written is copied as it was when tar read it.
+    assert local_location.strip() != ""
+    start = time.time()
+    sender = subprocess.Popen(("ssh", "-q") + ssh_options(ip_address) + ("mage@{0}".format(ip_address), "tar -C {0} -czf - --warning=no-file-changed --null -T -; test $? -le 1".format(remote_directory)), stdin = subprocess.PIPE, stdout = subprocess.PIPE)
+    receiver = subprocess.Popen(("tar", "-C", local_location, "-xzf", "-"), stdin = sender.stdout)
+    sender.stdout.close()
+    sender.stdin.write(b"".join(name.encode() + b"\0" for name in names))
+    sender.stdin.close()
+    receiver.wait()
+    sender.wait()
+    record_latency(ip_address, "copy_from", start)
+    if sender.returncode != 0:
+        raise subprocess.CalledProcessError(sender.returncode, sender.args)
+    if receiver.returncode != 0:
+        raise subprocess.CalledProcessError(receiver.returncode, receiver.args)
+
+def file_digest(local_location):
+    h = hashlib.sha256()
+    with open(local_location, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def deploy_script(ip_address, local_location, remote_name = None):
+    if remote_name is None:
+        remote_name = os.path.join("~", os.path.basename(local_location))
+    digest = file_digest(local_location)
+    key = (ip_address, remote_name)
+    with deploy_lock:
+        deployed_digest = deployed_scripts.get(key)
+    if deployed_digest is None:
+        # First use of this script by this process: ask the machine what it has
+        result = exec_sync(ip_address, "sha256sum {0} 2>/dev/null".format(remote_name), get_output = True)
+        tokens = result.stdout.split()
+        if result.returncode == 0 and len(tokens) != 0:
+            deployed_digest = tokens[0]
+    if deployed_digest != digest:
+        copy_to(ip_address, False, local_location, remote_name)
+    with deploy_lock:
+        deployed_scripts[key] = digest
+    return remote_name
+
+def with_environment(command, environment):
+    # Prefixes the command with VARIABLE=value assignments
+    if not environment:
+        return command
+    return " ".join("{0}={1}".format(name, value) for name, value in sorted(environment.items())) + " " + command
 
-def exec_script(ip_address, local_location, args = "", sync = True):
-    remote_name = os.path.join("~", os.path.basename(local_location))
+def exec_script(ip_address, local_location, args = "", sync = True, check_exitcode = False, environment = None):
+    remote_name = deploy_script(ip_address, local_location)
     remote_command = remote_name
     if args.strip() != "":
         remote_command = remote_command + " " + args
-    copy_to(ip_address, False, local_location, remote_name)
+    remote_command = with_environment(remote_command, environment)
     if sync:
-        return exec_sync(ip_address, remote_command)
+        return exec_sync(ip_address, remote_command, check_exitcode)
     else:
         return exec_async(ip_address, remote_command)
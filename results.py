@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+import argparse
+import concurrent.futures
+import importlib.util
+import os
+import sqlite3
+
+import numpy as np
+
+spec = importlib.util.spec_from_file_location("sample_resources", os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts", "sample_resources.py"))
+sample_resources = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(sample_resources)
+
+# Parsers for the files that the experiments leave in ~/logs, which
+# "magebench.py fetch-logs" copies into one directory per machine.
+
+class MageMeasurement(object):
+    def __init__(self, f):
+        self.stats = {}
+        lines = []
+        for line in f:
+            tokens = line.split()
+            if len(tokens) >= 2 and tokens[1] == "(ns)":
+                stats = Stats(line)
+                if stats.name not in self.stats:
+                    self.stats[stats.name] = []
+                self.stats[stats.name].append(stats.total)
+            elif len(tokens) == 3 and tokens[0] == "Timer:" and tokens[2] == "ns":
+                self.time_for_computation_ns = int(tokens[1])
+                self.time_for_computation_ms = self.time_for_computation_ns / 1000000.0
+            lines.append(line)
+        if len(lines) == 0:
+            return
+
+        tokens = lines[-1].split()
+        if len(tokens) == 2 and tokens[1] == "ms":
+            self.total_time_ms = int(tokens[0])
+        else:
+            assert(False)
+            self.total_time_ms = self.time_for_computation_ns / 1000000.0 # Hack to produce graphs with some missing data
+
+class EMPMeasurement(object):
+    def __init__(self, f):
+        lines = []
+        for line in f:
+            lines.append(line)
+        assert(len(lines) == 4)
+        assert(lines[0] == "connected\n")
+        assert(lines[2] == "PASS\n")
+        self.time_for_computation_ms = int(lines[1].split()[1])
+        self.total_time_ms = int(lines[3].split()[1])
+
+class PlanningMeasurement(object):
+    def __init__(self, f):
+        lines = []
+        for line in f:
+            lines.append(line)
+        assert(len(lines) == 6)
+        phase_times = lines[5].split()
+        self.placement_ms = int(phase_times[3])
+        self.replacement_ms = int(phase_times[4])
+        self.scheduling_ms = int(phase_times[5])
+        self.total_ms = self.placement_ms + self.replacement_ms + self.scheduling_ms
+
+class PlanStats(object):
+    def __init__(self, f):
+        for line in f:
+            line = line.strip()
+            tokens = line.split(":")
+            if len(tokens) == 2 and tokens[0] == "Maximum resident set size (kbytes)":
+                self.mem_usage_kb = int(tokens[1].strip())
+            elif len(tokens) == 6 and tokens[0] == "Elapsed (wall clock) time (h":
+                self.wall_clock_s = float(tokens[-1]) + (60 * int(tokens[-2]))
+            elif len(tokens) == 7 and tokens[0] == "Elapsed (wall clock) time (h":
+                self.wall_clock_s = float(tokens[-1]) + (60 * int(tokens[-2])) + (60 * 60 * int(tokens[-3]))
+
+class SEALMeasurement(object):
+    def __init__(self, f):
+        lines = []
+        for line in f:
+            lines.append(line)
+        assert(len(lines) == 1)
+        self.total_time_ms = int(lines[0].split()[0])
+
+class ResourceSamples(object):
+    # Summarizes the samples that scripts/sample_resources.py took during a run
+    def __init__(self, filename):
+        header, rows = sample_resources.read_samples(filename)
+        assert(len(rows) != 0)
+        columns = {name: i for i, name in enumerate(header["columns"])}
+        def column(name):
+            return [row[columns[name]] for row in rows]
+        def increase(name):
+            values = column(name)
+            return values[-1] - values[0]
+        self.sampled_s = increase("time_s")
+        self.peak_rss_bytes = max(column("rss_bytes"))
+        self.peak_cgroup_bytes = max(column("cgroup_bytes"))
+        self.swap_in_pages = increase("pswpin")
+        self.swap_out_pages = increase("pswpout")
+        self.major_faults = increase("pgmajfault")
+
+class Stats(object):
+    def __init__(self, line):
+        tokens = line.strip().split()
+        self.name = tokens[0]
+        self.unit = tokens[1][1:-2]
+        assert(tokens[3] == "min")
+        assert(tokens[6] == "avg")
+        assert(tokens[9] == "max")
+        assert(tokens[12] == "count")
+        assert(tokens[15] == "sum")
+        self.total = int(tokens[17])
+
+def generate_filename(prefix, program, scenario, tag):
+    if isinstance(tag, int):
+        tag = "t{0}".format(tag)
+    return "{0}_{1}_{2}_{3}.log".format(prefix, program, scenario, tag)
+
+def parse_emp_measurement_file(filename):
+    with open(filename) as f:
+        return EMPMeasurement(f)
+
+def parse_mage_measurement_file(filename):
+    with open(filename) as f:
+        return MageMeasurement(f)
+
+def parse_seal_measurement_file(filename):
+    with open(filename) as f:
+        return SEALMeasurement(f)
+
+def parse_planning_measurement_file(filename):
+    with open(filename) as f:
+        return PlanningMeasurement(f)
+
+def parse_plan_stats_file(filename):
+    with open(filename) as f:
+        return PlanStats(f)
+
+def parse_plan_size_file(filename):
+    with open(filename) as f:
+        return int(f.read().strip())
+
+def parse_samples_file(filename):
+    return ResourceSamples(filename)
+
+allowable_locations = ("oregon", "iowa", "virginia")
+extensions = ("log", "planning", "planstats", "plansize", "samples")
+
+def parse_machine_directory_name(mdir):
+    # Machine directories are named as in logs_directory in magebench.py
+    try:
+        return int(mdir)
+    except ValueError:
+        for loc in allowable_locations:
+            if mdir.startswith(loc):
+                return mdir
+    return None
+
+# Logs from these runs are not experiment results (calibration runs only feed
+# calibration.json), so they are left out rather than parsed as one
+SKIPPED_LOG_PREFIXES = ("calibrate_",)
+
+def wan_log_fields(kind, tokens):
+    # <kind>_<location>_<workers per node>_<OT pipeline depth>_<OT daemons>_
+    # <problem>_<size>_<scenario>_<tag>_w<worker>
+    if len(tokens) < 10 or not tokens[-1].startswith("w"):
+        return None
+    try:
+        workers_per_node = int(tokens[2])
+        ot_pipeline_depth = int(tokens[3])
+        ot_num_daemons = int(tokens[4])
+        size = int(tokens[-4])
+    except ValueError:
+        return None
+    return {"kind": kind, "experiment": "_".join(tokens[:2]), "location": tokens[1], "workers_per_node": workers_per_node, "ot_pipeline_depth": ot_pipeline_depth, "ot_num_daemons": ot_num_daemons, "problem": "_".join(tokens[5:-4]), "size": size, "scenario": tokens[-3], "tag": tokens[-2], "worker": tokens[-1]}
+
+def lan_log_fields(kind, experiment, tokens, scenario = None):
+    # <experiment>_<problem>_<size>_<scenario>_<tag>, where tokens are those
+    # after the experiment; runs of a single scenario leave it out of the name
+    try:
+        if scenario is None:
+            size = int(tokens[-3])
+            scenario = tokens[-2]
+            problem = tokens[:-3]
+        else:
+            size = int(tokens[-2])
+            problem = tokens[:-2]
+    except (ValueError, IndexError):
+        return None
+    if len(problem) == 0:
+        return None
+    return {"kind": kind, "experiment": experiment, "location": None, "workers_per_node": None, "ot_pipeline_depth": None, "ot_num_daemons": None, "problem": "_".join(problem), "size": size, "scenario": scenario, "tag": tokens[-1], "worker": None}
+
+def parse_log_name(name):
+    # Returns the fields encoded in a log name by magebench.py, or None if the
+    # name does not follow one of its naming schemes:
+    #
+    # workers_<n>_..., halfgates_baseline_..., ckks_baseline_...: LAN runs
+    # ab_<a or b>_workers_<n>_...: the two sides of "ab"
+    # prefetch_<limit>_<buffer size>_<lookahead>_<problem>_<size>_<tag>:
+    #     "tune-prefetch", whose runs all use the mage scenario
+    # wan_..., pairedwan_...: WAN runs, one log per worker
+    # autotunewan_..., autotunepaired-wan_...: "autotune-wan", likewise
+    if name.startswith(SKIPPED_LOG_PREFIXES):
+        return None
+    tokens = name.split("_")
+    if len(tokens) < 5:
+        return None
+    if tokens[0] in ("wan", "pairedwan") or tokens[0].startswith("autotune"):
+        return wan_log_fields(tokens[0], tokens)
+    elif tokens[0] == "ab":
+        if tokens[1] not in ("a", "b") or tokens[2] != "workers":
+            return None
+        return lan_log_fields("ab", "_".join(tokens[:4]), tokens[4:])
+    elif tokens[0] == "prefetch":
+        return lan_log_fields("prefetch", "_".join(tokens[:4]), tokens[4:], "mage")
+    elif tokens[0] in ("workers", "halfgates", "ckks"):
+        return lan_log_fields(tokens[0], "_".join(tokens[:2]), tokens[2:])
+    return None
+
+def parse_log_file(log_path, extension, scenario):
+    # Returns the parsed measurement, or None if the file's scenario is unknown
+    if extension == "samples":
+        return parse_samples_file(log_path)
+    elif scenario in ("os", "unbounded", "mage"):
+        if extension == "log":
+            return parse_mage_measurement_file(log_path)
+        elif extension == "planning":
+            return parse_planning_measurement_file(log_path)
+        elif extension == "planstats":
+            return parse_plan_stats_file(log_path)
+        elif extension == "plansize":
+            return parse_plan_size_file(log_path)
+    elif scenario == "emp":
+        return parse_emp_measurement_file(log_path)
+    elif scenario == "seal":
+        return parse_seal_measurement_file(log_path)
+    return None
+
+def list_log_files(directory):
+    # Yields (machine_id, log_path, extension, name) for every log file in a
+    # directory written by "magebench.py fetch-logs"
+    for mdir in sorted(os.listdir(directory)):
+        machine_id = parse_machine_directory_name(mdir)
+        if machine_id is None:
+            print("Skipping directory {0}".format(os.path.join(directory, mdir)))
+            continue
+        for log_file in sorted(os.listdir(os.path.join(directory, mdir))):
+            parts = log_file.split(".")
+            if len(parts) < 2 or parts[-1] not in extensions:
+                continue
+            yield (machine_id, os.path.join(directory, mdir, log_file), parts[-1], ".".join(parts[:-1]))
+
+def parse_log_directory(directory):
+    # Returns the nested dictionaries that the notebook indexes into
+    logs = {}
+    for machine_id, log_path, extension, name in list_log_files(directory):
+        machine_logs = logs.setdefault(machine_id, {})
+
+        if os.stat(log_path).st_size == 0:
+            print("Skpping empty file {0}".format(log_path))
+            continue
+
+        ext_logs = machine_logs.setdefault(extension, {})
+
+        fields = parse_log_name(name)
+        if fields is None:
+            print("Skipping file {0}".format(log_path))
+            continue
+        scenario = fields["scenario"]
+        tag = fields["tag"]
+        if fields["worker"] is not None:
+            experiments = ext_logs.setdefault(fields["kind"], {}).setdefault(fields["location"], {}).setdefault(fields["workers_per_node"], {}).setdefault(fields["problem"], {}).setdefault(fields["size"], {}).setdefault(fields["ot_pipeline_depth"], {}).setdefault(fields["ot_num_daemons"], {}).setdefault(scenario, {}).setdefault(fields["worker"], {})
+        else:
+            experiments = ext_logs.setdefault(fields["experiment"], {}).setdefault(fields["problem"], {}).setdefault(fields["size"], {}).setdefault(scenario, {})
+        if tag in experiments:
+            print("Skipping {0} (duplicate for {1})".format(log_path, (fields["experiment"], fields["problem"], fields["size"], scenario, tag)))
+            continue
+
+        try:
+            parsed = parse_log_file(log_path, extension, scenario)
+            if parsed is None:
+                print("Skipping {0} (unknown scenario {1})".format(log_path, scenario))
+                continue
+            experiments[tag] = parsed
+        except AssertionError as ae:
+            print("Skipping {0} (assertion failure: {1})".format(log_path, str(ae)))
+    return logs
+
+# The results store is a SQLite database with one row in the results table
+# per (log directory, machine, log name), that is, per experiment, worker, and
+# trial. Each kind of file that an experiment leaves fills in some of the
+# row's columns, and the per-operation stats in MAGE's logs go in op_stats.
+
+RESULTS_DATABASE = "results.db"
+
+KEY_COLUMNS = ("log_directory", "machine", "name")
+FIELD_COLUMNS = ("kind", "experiment", "location", "workers_per_node", "ot_pipeline_depth", "ot_num_daemons", "problem", "size", "scenario", "tag", "worker")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    log_directory TEXT NOT NULL,
+    machine TEXT NOT NULL,
+    name TEXT NOT NULL,
+    kind TEXT,
+    experiment TEXT,
+    location TEXT,
+    workers_per_node INTEGER,
+    ot_pipeline_depth INTEGER,
+    ot_num_daemons INTEGER,
+    problem TEXT,
+    size INTEGER,
+    scenario TEXT,
+    tag TEXT,
+    worker TEXT,
+    total_time_ms REAL,
+    compute_time_ms REAL,
+    planning_ms REAL,
+    placement_ms REAL,
+    replacement_ms REAL,
+    scheduling_ms REAL,
+    planning_max_rss_kb INTEGER,
+    planning_wall_clock_s REAL,
+    plan_size INTEGER,
+    sampled_s REAL,
+    peak_rss_bytes INTEGER,
+    peak_cgroup_bytes INTEGER,
+    swap_in_pages INTEGER,
+    swap_out_pages INTEGER,
+    major_faults INTEGER,
+    UNIQUE (log_directory, machine, name)
+);
+CREATE INDEX IF NOT EXISTS results_experiment ON results (experiment, problem, size, scenario);
+CREATE TABLE IF NOT EXISTS op_stats (
+    result_id INTEGER NOT NULL REFERENCES results (id) ON DELETE CASCADE,
+    op TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    total_ns INTEGER NOT NULL,
+    PRIMARY KEY (result_id, op)
+);
+CREATE TABLE IF NOT EXISTS ingested_files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    error TEXT
+);
+"""
+
+# Added after the first results stores were made, which open_results adds to
+SAMPLE_COLUMNS = ("sampled_s", "peak_rss_bytes", "peak_cgroup_bytes", "swap_in_pages", "swap_out_pages", "major_faults")
+SAMPLE_COLUMN_TYPES = ("REAL", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER")
+
+# Fewer files than this are parsed in this process, since starting the pool
+# would take longer than parsing them
+MIN_FILES_FOR_POOL = 64
+
+def open_results(filename = RESULTS_DATABASE):
+    connection = sqlite3.connect(filename)
+    connection.execute("PRAGMA foreign_keys = ON")
+    connection.executescript(SCHEMA)
+    existing = set(row[1] for row in connection.execute("PRAGMA table_info(results)"))
+    for column, column_type in zip(SAMPLE_COLUMNS, SAMPLE_COLUMN_TYPES):
+        if column not in existing:
+            connection.execute("ALTER TABLE results ADD COLUMN {0} {1}".format(column, column_type))
+    return connection
+
+def measurement_columns(extension, parsed):
+    # Maps a parsed file to the values it contributes to its row
+    if extension == "planning":
+        return {"planning_ms": parsed.total_ms, "placement_ms": parsed.placement_ms, "replacement_ms": parsed.replacement_ms, "scheduling_ms": parsed.scheduling_ms}
+    elif extension == "planstats":
+        return {"planning_max_rss_kb": getattr(parsed, "mem_usage_kb", None), "planning_wall_clock_s": getattr(parsed, "wall_clock_s", None)}
+    elif extension == "plansize":
+        return {"plan_size": parsed}
+    elif extension == "samples":
+        return {column: getattr(parsed, column) for column in SAMPLE_COLUMNS}
+    return {"total_time_ms": getattr(parsed, "total_time_ms", None), "compute_time_ms": getattr(parsed, "time_for_computation_ms", None)}
+
+def parse_file(task):
+    # Runs in a worker process, so it returns plain values rather than the
+    # parsed measurement: (column values, op stats or None, error or None)
+    log_path, extension, scenario = task
+    try:
+        parsed = parse_log_file(log_path, extension, scenario)
+    except (AssertionError, ValueError, IndexError, RuntimeError) as e:
+        return (None, None, repr(e))
+    if parsed is None:
+        return (None, None, "unknown scenario {0}".format(scenario))
+    op_stats = None
+    if isinstance(parsed, MageMeasurement):
+        op_stats = {op: (len(totals), sum(totals)) for op, totals in parsed.stats.items()}
+    return (measurement_columns(extension, parsed), op_stats, None)
+
+def store_measurement(connection, key, fields, values, op_stats):
+    connection.execute("INSERT OR IGNORE INTO results ({0}) VALUES ({1})".format(", ".join(KEY_COLUMNS + FIELD_COLUMNS), ", ".join("?" * (len(KEY_COLUMNS) + len(FIELD_COLUMNS)))), key + tuple(fields[column] for column in FIELD_COLUMNS))
+    connection.execute("UPDATE results SET {0} WHERE log_directory = ? AND machine = ? AND name = ?".format(", ".join("{0} = ?".format(column) for column in values)), tuple(values.values()) + key)
+    if op_stats is not None:
+        result_id, = connection.execute("SELECT id FROM results WHERE log_directory = ? AND machine = ? AND name = ?", key).fetchone()
+        connection.execute("DELETE FROM op_stats WHERE result_id = ?", (result_id,))
+        connection.executemany("INSERT INTO op_stats (result_id, op, count, total_ns) VALUES (?, ?, ?, ?)", ((result_id, op, count, total) for op, (count, total) in op_stats.items()))
+
+def ingest_log_directory(connection, directory, processes = None):
+    # Parses the log files in the directory into the results store, using a
+    # pool of processes, and returns the number of files parsed. A file whose
+    # path, size, and mtime match what was ingested before (successfully or
+    # not) is not parsed again, so re-running this after fetching more logs
+    # only parses the new or changed files.
+    log_directory = os.path.basename(os.path.normpath(directory))
+    ingested = {path: (size, mtime_ns) for path, size, mtime_ns in connection.execute("SELECT path, size, mtime_ns FROM ingested_files")}
+    tasks = []
+    for machine_id, log_path, extension, name in list_log_files(directory):
+        st = os.stat(log_path)
+        path = os.path.abspath(log_path)
+        if st.st_size == 0 or ingested.get(path) == (st.st_size, st.st_mtime_ns):
+            continue
+        fields = parse_log_name(name)
+        if fields is None:
+            # Recorded as ingested, so that it is reported only once
+            print("Skipping {0} (not an experiment log)".format(log_path))
+            with connection:
+                connection.execute("INSERT OR REPLACE INTO ingested_files (path, size, mtime_ns, error) VALUES (?, ?, ?, ?)", (path, st.st_size, st.st_mtime_ns, "not an experiment log"))
+            continue
+        tasks.append((path, st.st_size, st.st_mtime_ns, (log_directory, str(machine_id), name), fields, extension))
+
+    arguments = [(path, extension, fields["scenario"]) for path, _, _, _, fields, extension in tasks]
+    if len(tasks) < MIN_FILES_FOR_POOL:
+        parsed = [parse_file(argument) for argument in arguments]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+            chunksize = max(1, len(tasks) // (4 * (processes or os.cpu_count() or 1)))
+            parsed = list(pool.map(parse_file, arguments, chunksize = chunksize))
+
+    with connection:
+        for (path, size, mtime_ns, key, fields, extension), (values, op_stats, error) in zip(tasks, parsed):
+            if error is None:
+                store_measurement(connection, key, fields, values, op_stats)
+            else:
+                print("Skipping {0} ({1})".format(path, error))
+            connection.execute("INSERT OR REPLACE INTO ingested_files (path, size, mtime_ns, error) VALUES (?, ?, ?, ?)", (path, size, mtime_ns, error))
+    return len(tasks)
+
+def query_columns(connection, sql, parameters = ()):
+    # Runs a query and returns its result as a dictionary mapping each column
+    # name to a NumPy array, so that it can be aggregated without Python loops
+    cursor = connection.execute(sql, parameters)
+    names = [d[0] for d in cursor.description]
+    rows = cursor.fetchall()
+    columns = {}
+    for i, name in enumerate(names):
+        values = [row[i] for row in rows]
+        if all(isinstance(v, int) for v in values):
+            columns[name] = np.array(values, dtype = np.int64)
+        elif all(v is None or isinstance(v, (int, float)) for v in values):
+            columns[name] = np.array([np.nan if v is None else v for v in values], dtype = np.float64)
+        else:
+            columns[name] = np.array(values, dtype = object)
+    return columns
+
+def load_results(connection, **conditions):
+    # For example, load_results(c, experiment = "workers_1", scenario = "mage")
+    where = " AND ".join("{0} = ?".format(column) for column in conditions)
+    sql = "SELECT * FROM results"
+    if where != "":
+        sql += " WHERE " + where
+    return query_columns(connection, sql, tuple(conditions.values()))
+
+def group_statistics(columns, keys, value):
+    # Groups the rows by the given key columns and returns (groups, mean,
+    # stddev, count) for the value column, ignoring missing values
+    key_arrays = [np.asarray(columns[key]).astype(str) for key in keys]
+    values = columns[value]
+    present = ~np.isnan(values)
+    combined = np.array(["\0".join(t) for t in zip(*key_arrays)], dtype = object) if len(keys) != 0 else np.zeros(len(values), dtype = object)
+    unique, inverse = np.unique(combined[present].astype(str), return_inverse = True)
+    values = values[present]
+    count = np.bincount(inverse, minlength = len(unique))
+    total = np.bincount(inverse, weights = values, minlength = len(unique))
+    mean = total / np.maximum(count, 1)
+    squares = np.bincount(inverse, weights = (values - mean[inverse]) ** 2, minlength = len(unique))
+    stddev = np.sqrt(squares / np.maximum(count - 1, 1))
+    groups = [tuple(u.split("\0")) for u in unique]
+    return groups, mean, stddev, count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Load experiment logs into the results store.")
+    parser.add_argument("directories", nargs = "+")
+    parser.add_argument("-d", "--database", default = RESULTS_DATABASE)
+    parser.add_argument("-j", "--processes", type = int)
+    args = parser.parse_args()
+
+    connection = open_results(args.database)
+    for directory in args.directories:
+        count = ingest_log_directory(connection, directory, args.processes)
+        print("Parsed {0} new or changed files from {1}".format(count, directory))
+    connection.close()
@@ -0,0 +1,89 @@
+import threading
+import time
+
+class Job(object):
+    def __init__(self, description, two_party, function):
+        self.description = description
+        self.two_party = two_party
+        self.function = function
+
+class ExperimentScheduler(object):
+    # Packs independent LAN experiments onto disjoint groups of machines.
+    #
+    # The LAN machines are divided into units of nodes_per_party machines,
+    # following the same pairing as generate_config_dict in
+    # scripts/generate_configs.py: evaluator unit k holds machines
+    # [k * nodes_per_party, (k + 1) * nodes_per_party) and garbler unit k holds
+    # the machines half a cluster above those. A two-party (halfgates) job
+    # needs evaluator unit k and garbler unit k together, so the configs
+    # already generated on each machine pair them up correctly. A
+    # single-party (CKKS) job runs on one evaluator unit, since its workers
+    # take their party from their machine and CKKS has always run as party 0.
+    # No machine is ever given to two jobs at once.
+    def __init__(self, c, nodes_per_party):
+        half = c.num_lan_machines // 2
+        if nodes_per_party <= 0 or half == 0 or half % nodes_per_party != 0:
+            raise RuntimeError("Cannot divide {0} machines into groups of {1} nodes per party".format(c.num_lan_machines, nodes_per_party))
+        self.units = []
+        for first in range(0, half, nodes_per_party):
+            self.units.append(tuple(range(first, first + nodes_per_party)))
+            self.units.append(tuple(range(half + first, half + first + nodes_per_party)))
+        self.jobs = []
+
+    def submit(self, description, two_party, function):
+        self.jobs.append(Job(description, two_party, function))
+
+    def allocate(self, job, free):
+        if job.two_party:
+            for k in range(0, len(self.units), 2):
+                if k in free and k + 1 in free:
+                    return (k, k + 1)
+            return None
+        for k in range(0, len(self.units), 2):
+            if k in free:
+                return (k,)
+        return None
+
+    def run(self):
+        condition = threading.Condition()
+        pending = list(self.jobs)
+        free = set(range(len(self.units)))
+        running = [0]
+        errors = []
+
+        def execute(job, units):
+            worker_ids = tuple(id for u in units for id in self.units[u])
+            start = time.time()
+            try:
+                job.function(worker_ids)
+                print("Finished {0} on machines {1} in {2:.0f} seconds".format(job.description, list(worker_ids), time.time() - start))
+            except BaseException as e:
+                print("Failed {0} on machines {1}: {2!r}".format(job.description, list(worker_ids), e))
+                with condition:
+                    errors.append(e)
+            finally:
+                with condition:
+                    free.update(units)
+                    running[0] -= 1
+                    condition.notify_all()
+
+        with condition:
+            while len(pending) != 0 or running[0] != 0:
+                if len(errors) == 0:
+                    for job in pending:
+                        units = self.allocate(job, free)
+                        if units is not None:
+                            pending.remove(job)
+                            free.difference_update(units)
+                            running[0] += 1
+                            threading.Thread(target = execute, args = (job, units)).start()
+                            break
+                    else:
+                        condition.wait()
+                elif running[0] != 0:
+                    condition.wait()
+                else:
+                    break
+        self.jobs = []
+        if len(errors) != 0:
+            raise errors[0]
@@ -96,9 +96,128 @@ def generate_paired_wan_config_dict(protocol, scenario, num_workers_per_party, i
     config["parties"] = [{"workers": evaluator_workers}, {"workers": garbler_workers}]
     return config
 
+LAN_MEMORY_BOUNDS = ("unbounded", "1gb", "2gb", "4gb", "8gb", "16gb", "30gb", "32gb", "60gb", "max")
+PAIRED_MEMORY_BOUNDS = ("unbounded", "max")
+WORKERS_PER_NODE = (1, 2, 4, 8, 16)
+OT_PARAMS = tuple(2 ** i for i in range(9))
+
+def config_path(mem_bound, protocol, a, b, c = None):
+    if c is None:
+        return os.path.join(mem_bound, "config_{0}_{1}_{2}.yaml".format(protocol, a, b))
+    return os.path.join(mem_bound, "config_{0}_{1}_{2}_{3}.yaml".format(protocol, a, b, c))
+
+def parse_config_path(path):
+    # Inverse of config_path: returns (mem_bound, protocol, numbers)
+    mem_bound, filename = os.path.split(os.path.normpath(path))
+    tokens = os.path.splitext(filename)[0].split("_")
+    if tokens[0] != "config" or len(tokens) not in (4, 5):
+        raise RuntimeError("Not a config path: {0}".format(path))
+    return os.path.basename(mem_bound), tokens[1], tuple(int(t) for t in tokens[2:])
+
+def apply_calibration(config, calibration, protocol, mem_bound, workers_per_node):
+    # calibration maps protocol -> memory bound -> workers per node to the
+    # num_pages measured by "magebench.py calibrate", replacing the estimate
+    if calibration is None:
+        return config
+    num_pages = calibration.get(protocol, {}).get(mem_bound, {}).get(str(workers_per_node))
+    if num_pages is not None:
+        config["num_pages"] = num_pages
+    return config
+
+def lan_party_sizes(cluster):
+    party_sizes = []
+    party_size = 1
+    while party_size < cluster["num_lan_machines"]:
+        party_sizes.append(party_size)
+        party_size *= 2
+    return party_sizes
+
+def lan_config_paths(cluster):
+    for protocol in ("halfgates", "ckks"):
+        for workers_per_node in WORKERS_PER_NODE:
+            for scenario in LAN_MEMORY_BOUNDS:
+                for party_size in lan_party_sizes(cluster):
+                    yield config_path(scenario, protocol, party_size, workers_per_node)
+
+def lan_config(cluster, id, path, no_swap_drive, calibration = None):
+    scenario, protocol, (party_size, workers_per_node) = parse_config_path(path)
+    if scenario == "max":
+        size = "60gb" # For the Azure machines
+    elif scenario == "unbounded":
+        size = "4096gb"
+    else:
+        size = scenario
+    return apply_calibration(generate_config_dict(protocol, size, workers_per_node, party_size, id, cluster, no_swap_drive), calibration, protocol, scenario, workers_per_node)
+
+def paired_wan_config_paths(cluster):
+    for scenario in PAIRED_MEMORY_BOUNDS:
+        for workers_per_node in WORKERS_PER_NODE:
+            party_size = cluster["num_lan_machines"] * workers_per_node
+            for ot_pipeline_depth in OT_PARAMS:
+                for ot_num_daemons in OT_PARAMS:
+                    yield config_path(scenario, "halfgates", party_size, ot_pipeline_depth, ot_num_daemons)
+
+def paired_wan_config(cluster, id, location, path, calibration = None):
+    scenario, protocol, (party_size, ot_pipeline_depth, ot_num_daemons) = parse_config_path(path)
+    num_lan_machines = cluster["num_lan_machines"]
+
+    azure_ids = range(num_lan_machines)
+    gcloud_ids = range(cluster["location_to_id"][location], cluster["location_to_id"][location] + num_lan_machines)
+
+    assert (id in azure_ids) or (id in gcloud_ids)
+
+    if scenario == "max":
+        if id in azure_ids:
+            size = "60gb"
+        elif id in gcloud_ids:
+            size = "30gb"
+    elif scenario == "unbounded":
+        size = "4096gb" # Larger than the standard "unbounded" size
+    else:
+        size = scenario
+    config = generate_paired_wan_config_dict(protocol, size, party_size, id, azure_ids, gcloud_ids, cluster, ot_pipeline_depth, ot_num_daemons)
+    if scenario == "max" and id in gcloud_ids:
+        return config # Calibrated on the Azure machines, which have more memory
+    return apply_calibration(config, calibration, protocol, scenario, party_size // num_lan_machines)
+
+def wan_config_paths(cluster):
+    for protocol in ("halfgates",):
+        for scenario in LAN_MEMORY_BOUNDS:
+            if scenario == "max":
+                continue # Max not needed here, but we can add support for it if needed
+            for party_size in WORKERS_PER_NODE:
+                for ot_pipeline_depth in OT_PARAMS:
+                    for ot_num_daemons in OT_PARAMS:
+                        yield config_path(scenario, protocol, party_size, ot_pipeline_depth, ot_num_daemons)
+
+def wan_config(cluster, id, location, path, calibration = None):
+    scenario, protocol, (party_size, ot_pipeline_depth, ot_num_daemons) = parse_config_path(path)
+    azure_id = id
+    gcloud_id = cluster["location_to_id"][location]
+    return apply_calibration(generate_wan_config_dict(protocol, scenario, party_size, azure_id, gcloud_id, cluster, ot_pipeline_depth, ot_num_daemons), calibration, protocol, scenario, party_size)
+
+def config_generator(cluster, id, location, no_swap_drive = False, calibration = None):
+    # Returns (paths, config) for the given lan/location argument, where
+    # paths() enumerates every config's path relative to the output directory
+    # and config(path) generates the config at that path
+    paired_ending = "-paired"
+    if location == "lan" or location == "local":
+        return (lambda: lan_config_paths(cluster), lambda path: lan_config(cluster, id, path, no_swap_drive, calibration))
+    elif location.endswith(paired_ending):
+        location = location[:-len(paired_ending)]
+        return (lambda: paired_wan_config_paths(cluster), lambda path: paired_wan_config(cluster, id, location, path, calibration))
+    else:
+        return (lambda: wan_config_paths(cluster), lambda path: wan_config(cluster, id, location, path, calibration))
+
+def write_config(config_dict, output_path):
+    os.makedirs(os.path.dirname(output_path), exist_ok = True)
+    with open(output_path, "w") as f:
+        yaml.dump(config_dict, f, sort_keys = False, default_flow_style = False)
+
 if __name__ == "__main__":
-    if len(sys.argv) not in (5, 6):
-        print("Usage: {0} cluster.json id lan/location output_dir no_swap_drive[true/false]".format(sys.argv[0]))
+    if len(sys.argv) < 5:
+        print("Usage: {0} cluster.json id lan/location output_dir [no_swap_drive[true/false] [config_path ...]]".format(sys.argv[0]))
+        print("Generates every config, or only the given ones (relative to output_dir) that do not exist yet")
         sys.exit(2)
 
     with open(sys.argv[1], "r") as f:
@@ -114,79 +233,14 @@ if __name__ == "__main__":
     if len(sys.argv) >= 6 and sys.argv[5] == "true":
         no_swap_drive = True
 
-    paired = False
-    paired_ending = "-paired"
-    if location.endswith(paired_ending):
-        paired = True
-        location = location[:-len(paired_ending)]
-
-    if paired:
-        memory_bounds = ("unbounded", "max")
-    else:
-        memory_bounds = ("unbounded", "1gb", "2gb", "4gb", "8gb", "16gb", "30gb", "32gb", "60gb", "max")
-    dir_paths = tuple(os.path.join(creation_dir, mem_bound) for mem_bound in memory_bounds)
-    for dir in dir_paths:
-        os.makedirs(dir, exist_ok = True)
-
-    if location == "lan" or location == "local":
-        party_sizes = []
-        party_size = 1
-        while party_size < cluster["num_lan_machines"]:
-            party_sizes.append(party_size)
-            party_size *= 2
-
-        for protocol in ("halfgates", "ckks"):
-            for workers_per_node in (1, 2, 4, 8, 16):
-                for scenario, output_dir_path in zip(memory_bounds, dir_paths):
-                    for party_size in party_sizes:
-                        if scenario == "max":
-                            size = "60gb" # For the Azure machines
-                        elif scenario == "unbounded":
-                            size = "4096gb"
-                        else:
-                            size = scenario
-                        config_dict = generate_config_dict(protocol, size, workers_per_node, party_size, id, cluster, no_swap_drive)
-                        output_path = os.path.join(output_dir_path, "config_{0}_{1}_{2}.yaml".format(protocol, party_size, workers_per_node))
-                        with open(output_path, "w") as f:
-                            yaml.dump(config_dict, f, sort_keys = False, default_flow_style = False)
-    elif paired:
-        num_lan_machines = cluster["num_lan_machines"]
-
-        azure_ids = range(num_lan_machines)
-        gcloud_ids = range(cluster["location_to_id"][location], cluster["location_to_id"][location] + num_lan_machines)
-
-        assert (id in azure_ids) or (id in gcloud_ids)
-
-        for scenario, output_dir_path in zip(memory_bounds, dir_paths):
-            for workers_per_node in (1, 2, 4, 8, 16):
-                party_size = num_lan_machines * workers_per_node
-                for ot_pipeline_depth in tuple(2 ** i for i in range(9)):
-                    for ot_num_daemons in tuple(2 ** i for i in range(9)):
-                        ot_params = (ot_pipeline_depth, ot_num_daemons)
-
-                        if scenario == "max":
-                            if id in azure_ids:
-                                size = "60gb"
-                            elif id in gcloud_ids:
-                                size = "30gb"
-                        elif scenario == "unbounded":
-                            size = "4096gb" # Larger than the standard "unbounded" size
-                        config_dict = generate_paired_wan_config_dict("halfgates", size, party_size, id, azure_ids, gcloud_ids, cluster, *ot_params)
-                        output_path = os.path.join(output_dir_path, "config_halfgates_{0}_{1}_{2}.yaml".format(party_size, ot_pipeline_depth, ot_num_daemons))
-                        with open(output_path, "w") as f:
-                            yaml.dump(config_dict, f, sort_keys = False, default_flow_style = False)
+    paths, config = config_generator(cluster, id, location, no_swap_drive)
+    if len(sys.argv) >= 7:
+        for path in sys.argv[6:]:
+            output_path = os.path.join(creation_dir, path)
+            if not os.path.exists(output_path):
+                # Write to a temporary file first, so that a config that exists is complete
+                write_config(config(path), output_path + ".tmp")
+                os.replace(output_path + ".tmp", output_path)
     else:
-        azure_id = id
-        gcloud_id = cluster["location_to_id"][location]
-        for protocol in ("halfgates",):
-            for scenario, output_dir_path in zip(memory_bounds, dir_paths):
-                for party_size in (1, 2, 4, 8, 16):
-                    for ot_pipeline_depth in tuple(2 ** i for i in range(9)):
-                        for ot_num_daemons in tuple(2 ** i for i in range(9)):
-                            ot_params = (ot_pipeline_depth, ot_num_daemons)
-                            if scenario == "max":
-                                continue # Max not needed here, but we can add support for it if needed
-                            config_dict = generate_wan_config_dict(protocol, scenario, party_size, azure_id, gcloud_id, cluster, *ot_params)
-                            output_path = os.path.join(output_dir_path, "config_halfgates_{0}_{1}_{2}.yaml".format(party_size, ot_pipeline_depth, ot_num_daemons))
-                            with open(output_path, "w") as f:
-                                yaml.dump(config_dict, f, sort_keys = False, default_flow_style = False)
+        for path in paths():
+            write_config(config(path), os.path.join(creation_dir, path))
@@ -14,13 +14,57 @@ then
 	exit 2
 fi
 
-pushd ~/work/mage/bin
+PROGRAM=${PROBLEM_NAME}_${PROBLEM_SIZE}
 
-./example_input $PROBLEM_NAME $PROBLEM_SIZE $NUM_WORKERS
+# Generated inputs are cached on the work disk, so each dataset is generated
+# only once per node, no matter how many workers, trials, and scenarios use
+# it. A flock serializes workers on the same node that need the same dataset.
+INPUT_CACHE=~/work/input_cache
+mkdir -p $INPUT_CACHE
+
+# The MAGE checkout to use; "magebench.py ab" points this at a second one
+MAGE_DIR=${MAGE_DIR:-$HOME/work/mage}
+
+pushd $MAGE_DIR/bin
+
+# Inputs made by a different build of example_input are not reused
+GENERATOR_HASH=$(sha256sum example_input | cut -c 1-16)
+PLAINTEXT_DIR=$INPUT_CACHE/${GENERATOR_HASH}/${PROGRAM}_${NUM_WORKERS}
+mkdir -p $(dirname $PLAINTEXT_DIR)
+(
+	flock 9
+	if [[ ! -e $PLAINTEXT_DIR/.complete ]]
+	then
+		rm -rf $PLAINTEXT_DIR
+		mkdir -p $PLAINTEXT_DIR
+		pushd $PLAINTEXT_DIR
+		$MAGE_DIR/bin/example_input $PROBLEM_NAME $PROBLEM_SIZE $NUM_WORKERS || exit 1
+		popd
+		touch $PLAINTEXT_DIR/.complete
+	fi
+) 9> $PLAINTEXT_DIR.lock || exit 1
+
+# Hard links are enough, since run_mage.sh only ever deletes these files
+shopt -s nullglob
+WORKER_FILES=($PLAINTEXT_DIR/${PROGRAM}_${WORKER}_* $PLAINTEXT_DIR/${PROGRAM}_${WORKER}.*)
+shopt -u nullglob
+if [[ ${#WORKER_FILES[@]} -eq 0 ]]
+then
+	echo "No cached input for worker" $WORKER "in" $PLAINTEXT_DIR
+	exit 1
+fi
+ln -f ${WORKER_FILES[@]} . || exit 1
 
 if [[ $PROTOCOL = "ckks" ]]
 then
-	./ckks_utils keygen
+	(
+		flock 9
+		# Keep the keys that were distributed when the cluster was provisioned
+		if ! compgen -G "*.ckks" > /dev/null
+		then
+			./ckks_utils keygen
+		fi
+	) 9> $INPUT_CACHE/keygen.lock
 	level=
 	if [[ $PROBLEM_NAME = "real_sum" ]]
 	then
@@ -31,5 +75,24 @@ then
 	else
 		level=1
 	fi
-	./ckks_utils encrypt_file 1 $level ${PROBLEM_NAME}_${PROBLEM_SIZE}_${WORKER}_garbler.input
+
+	# The encrypted input is only valid for the keys that encrypted it
+	KEY_HASH=$(cat *.ckks | sha256sum | cut -c 1-16)
+	CIPHERTEXT_DIR=$INPUT_CACHE/ckks_${KEY_HASH}/${PROGRAM}_${NUM_WORKERS}_${WORKER}
+	mkdir -p $(dirname $CIPHERTEXT_DIR)
+	(
+		flock 9
+		if [[ ! -e $CIPHERTEXT_DIR/.complete ]]
+		then
+			rm -rf $CIPHERTEXT_DIR
+			mkdir -p $CIPHERTEXT_DIR
+			rm -f ${PROGRAM}_${WORKER}_garbler.input
+			cp $PLAINTEXT_DIR/${PROGRAM}_${WORKER}_garbler.input . || exit 1
+			./ckks_utils encrypt_file 1 $level ${PROGRAM}_${WORKER}_garbler.input || exit 1
+			cp ${PROGRAM}_${WORKER}_garbler.input $CIPHERTEXT_DIR/ || exit 1
+			touch $CIPHERTEXT_DIR/.complete
+		fi
+	) 9> $CIPHERTEXT_DIR.lock || exit 1
+	rm -f ${PROGRAM}_${WORKER}_garbler.input
+	ln -f $CIPHERTEXT_DIR/${PROGRAM}_${WORKER}_garbler.input . || exit 1
 fi
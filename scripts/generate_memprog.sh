@@ -16,21 +16,53 @@ then
 	exit 2
 fi
 
-pushd ~/work/mage/bin
+# The MAGE checkout to use; "magebench.py ab" points this at a second one
+MAGE_DIR=${MAGE_DIR:-$HOME/work/mage}
+
+pushd $MAGE_DIR/bin
+
+PROGRAM=${PROBLEM_NAME}_${PROBLEM_SIZE}
+MEMPROG=${PROGRAM}_${WORKER}.memprog
+
+# The memory program depends only on the inputs below, so it is cached on the
+# work disk and reused by later trials and by the non-measured scenarios.
+MEMPROG_CACHE=~/work/memprog_cache
+CACHE_KEY=$( (echo $PROGRAM $PROTOCOL $CONFIG $PARTY $WORKER; sha256sum $CONFIG planner mage | cut -d " " -f 1) | sha256sum | cut -c 1-32)
+CACHE_DIR=$MEMPROG_CACHE/$CACHE_KEY
+mkdir -p $MEMPROG_CACHE
+
+if [[ -z $LOG_NAME && -e $CACHE_DIR/.complete ]]
+then
+	ln -f $CACHE_DIR/$MEMPROG . && exit 0
+fi
 
 sudo swapoff -a
 
+# Don't let the planner write through a hard link into the cache
+rm -f $MEMPROG
+
 if [[ -z $LOG_NAME ]]
 then
 	./planner $PROBLEM_NAME $PROTOCOL $CONFIG $PARTY $WORKER $PROBLEM_SIZE
+	PLANNER_STATUS=$?
 else
-	# Benchmark this one
+	# Benchmark this one (never from the cache, since planning time is measured)
 	sudo free
 	sudo sync
 	echo 3 | sudo tee /proc/sys/vm/drop_caches
 	sudo free
 
 	/usr/bin/time -v ./planner $PROBLEM_NAME $PROTOCOL $CONFIG $PARTY $WORKER $PROBLEM_SIZE > ~/logs/${LOG_NAME}.planning 2> ~/logs/${LOG_NAME}.planstats
+	PLANNER_STATUS=$?
 fi
 
 rm -f ${PROBLEM_NAME}_${PROBLEM_SIZE}_${WORKER}.prog ${PROBLEM_NAME}_${PROBLEM_SIZE}_${WORKER}.repprog ${PROBLEM_NAME}_${PROBLEM_SIZE}_${WORKER}.ann
+
+if [[ $PLANNER_STATUS -eq 0 && -e $MEMPROG ]]
+then
+	rm -rf $CACHE_DIR
+	mkdir -p $CACHE_DIR
+	ln -f $MEMPROG $CACHE_DIR/ && touch $CACHE_DIR/.complete
+fi
+
+exit $PLANNER_STATUS
@@ -8,6 +8,15 @@ do
             sudo apt update
             sudo apt install -y git build-essential clang cmake libssl-dev libaio-dev
 
+            # If MAGE_DEPS_ARCHIVE names an archive of the libraries below,
+            # built on another machine, install them from it instead
+            if [[ -n $MAGE_DEPS_ARCHIVE && -f $MAGE_DEPS_ARCHIVE ]]
+            then
+                sudo tar -xzf $MAGE_DEPS_ARCHIVE -C /
+                sudo ldconfig
+                continue
+            fi
+
             # Install yaml-cpp version 0.63
             wget https://github.com/jbeder/yaml-cpp/archive/yaml-cpp-0.6.3.tar.gz
             tar zxf yaml-cpp-0.6.3.tar.gz
@@ -36,6 +45,49 @@ do
             sudo cmake --install build
             popd
 
+            # Clone and build EMP-toolkit baseline, which stays in ~/work
+            pushd ~/work
+            if [[ ! -d emp-tool ]]
+            then
+                git clone https://github.com/emp-toolkit/emp-tool
+            fi
+            pushd emp-tool
+            git checkout 8f95ba4f79bc15d4646e9137f2018b1a12a1343a
+            cmake .
+            sudo make install
+            popd
+
+            if [[ ! -d emp-ot ]]
+            then
+                git clone https://github.com/emp-toolkit/emp-ot
+            fi
+            pushd emp-ot
+            git checkout 0f4a1e41a25cf1a034b5796752fde903a241f482
+            cmake .
+            sudo make install
+            popd
+
+            if [[ ! -d emp-sh2pc ]]
+            then
+                git clone https://github.com/samkumar/emp-sh2pc
+            fi
+            pushd emp-sh2pc
+            git checkout adef68a1631b4ab9f2027088ed1deee7e94024e9
+            cmake .
+            sudo make install
+            popd
+            popd
+
+            # Pack what was installed, as listed by each install, and the EMP
+            # builds, so that other machines can install them from
+            # MAGE_DEPS_ARCHIVE
+            if [[ -n $MAGE_DEPS_ARCHIVE ]]
+            then
+                mkdir -p $(dirname $MAGE_DEPS_ARCHIVE)
+                EMP_DIRS="$HOME/work/emp-tool $HOME/work/emp-ot $HOME/work/emp-sh2pc"
+                (cat yaml-cpp-yaml-cpp-0.6.3/build/install_manifest.txt tfhe/build/install_manifest.txt SEAL-3.6.1/build/install_manifest.txt; for dir in $EMP_DIRS; do cat $dir/install_manifest.txt; echo $dir; done) | tar -czPf ${MAGE_DEPS_ARCHIVE}.tmp -T - && mv ${MAGE_DEPS_ARCHIVE}.tmp $MAGE_DEPS_ARCHIVE
+            fi
+
             # Update shared libraries
             sudo ldconfig
             ;;
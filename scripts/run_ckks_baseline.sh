@@ -39,6 +39,7 @@ echo 3 | sudo tee /proc/sys/vm/drop_caches
 sudo free
 
 $PREFIX ./ckks_utils $PROBLEM_NAME $PROBLEM_SIZE ${PROGRAM}_${WORKER}_garbler.input ${PROGRAM}_${WORKER}.output > ~/logs/${LOG_NAME}.log
+BASELINE_STATUS=$?
 
 if [[ $CHECK_RESULT = true ]]
 then
@@ -47,3 +48,6 @@ then
 	./ckks_utils float_file_decode ${PROGRAM}_${WORKER}.expected > expected.output
 	diff decoded.output expected.output > ~/logs/${LOG_NAME}.result
 fi
+
+# Exit as the baseline did, so that a crashed or killed run is reported as failed
+exit $BASELINE_STATUS
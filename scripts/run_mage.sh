@@ -11,22 +11,28 @@ WORKER=$6
 PROGRAM=$7
 LOG_NAME=$8
 CHECK_RESULT=$9
+SAMPLE_INTERVAL_MS=${10:-200}
 
 if [[ -z $CHECK_RESULT ]]
 then
-	echo "Usage:" $0 "scenario limit protocol config party_id worker_id program_name log_file_name check_result[true/false]"
+	echo "Usage:" $0 "scenario limit protocol config party_id worker_id program_name log_file_name check_result[true/false] [sample_interval_ms]"
 	exit
 fi
 
-pushd ~/work/mage/bin
+# The MAGE checkout to use; "magebench.py ab" points this at a second one
+MAGE_DIR=${MAGE_DIR:-$HOME/work/mage}
+
+pushd $MAGE_DIR/bin
 
 PREFIX="sudo"
+CGROUP="-"
 if [[ $SCENARIO = "mage" ]]
 then
 	sudo swapoff -a
 	if [[ $LIMIT != "max" ]]
 	then
 		PREFIX="sudo cgexec -g memory:memprog${LIMIT}"
+		CGROUP="memprog${LIMIT}"
 	fi
 elif [[ $SCENARIO = "unbounded" ]]
 then
@@ -39,6 +45,7 @@ then
 	if [[ $LIMIT != "max" ]]
 	then
 		PREFIX="sudo cgexec -g memory:memprog${LIMIT}"
+		CGROUP="memprog${LIMIT}"
 	fi
 else
 	echo "Unknown scenario" $SCENARIO
@@ -50,7 +57,34 @@ sudo sync
 echo 3 | sudo tee /proc/sys/vm/drop_caches
 sudo free
 
-$PREFIX ./mage $PROTOCOL $CONFIG $PARTY $WORKER $PROGRAM > ~/logs/${LOG_NAME}.log
+$PREFIX ./mage $PROTOCOL $CONFIG $PARTY $WORKER $PROGRAM > ~/logs/${LOG_NAME}.log &
+MAGE_PID=$!
+
+# Sample resource usage next to the log while MAGE runs. The sampler follows
+# this worker's MAGE process, which descends from $MAGE_PID, since other
+# workers may be running on the same node. The disks sampled are the swap
+# device and the one holding MAGE's storage (either a raw partition or swap
+# files on the scratch disk).
+SAMPLER_PID=
+if [[ $SAMPLE_INTERVAL_MS -gt 0 && -e ~/sample_resources.py ]]
+then
+	STORAGE_PATH=$(grep -m 1 "storage_path:" $CONFIG | awk '{ print $2 }')
+	if [[ ! -b $STORAGE_PATH ]]
+	then
+		STORAGE_PATH=$(df --output=source ~/work/scratch | tail -n 1)
+	fi
+	nice -n 19 python3 ~/sample_resources.py ~/logs/${LOG_NAME}.samples $SAMPLE_INTERVAL_MS $CGROUP $MAGE_PID swap=$(readlink -f ~/swap_device) storage=$STORAGE_PATH &
+	SAMPLER_PID=$!
+fi
+
+wait $MAGE_PID
+MAGE_STATUS=$?
+
+if [[ -n $SAMPLER_PID ]]
+then
+	kill $SAMPLER_PID
+	wait $SAMPLER_PID
+fi
 
 if [[ $CHECK_RESULT = true ]]
 then
@@ -73,3 +107,6 @@ then
 		echo "Unknown protocol" $PROTOCOL
 	fi
 fi
+
+# Exit as MAGE did, so that a crashed or killed run is reported as failed
+exit $MAGE_STATUS
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import signal
+import struct
+import sys
+import time
+
+# The output file starts with MAGIC, followed by a little-endian uint32 giving
+# the length of a JSON header that names the columns, followed by one
+# fixed-size record per sample. Every column is a cumulative counter or a
+# gauge exactly as the kernel reports it; rates are computed when the samples
+# are read, which keeps the work done on the node per sample to a minimum.
+MAGIC = b"MAGESMP1"
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+SECTOR_SIZE = 512
+
+def read_cpu():
+    with open("/proc/stat", "r") as f:
+        tokens = f.readline().split()
+    # user, nice, system, idle, iowait, irq, softirq, steal (in clock ticks)
+    return [int(t) for t in tokens[1:9]]
+
+def read_vmstat():
+    values = {}
+    with open("/proc/vmstat", "r") as f:
+        for line in f:
+            key, value = line.split()
+            if key in ("pswpin", "pswpout", "pgmajfault"):
+                values[key] = int(value)
+    return [values.get("pswpin", 0), values.get("pswpout", 0), values.get("pgmajfault", 0)]
+
+def read_diskstats(devices):
+    sectors = {}
+    with open("/proc/diskstats", "r") as f:
+        for line in f:
+            tokens = line.split()
+            if tokens[2] in devices:
+                sectors[tokens[2]] = (int(tokens[5]), int(tokens[9]))
+    values = []
+    for device in devices:
+        read, written = sectors.get(device, (0, 0))
+        values.extend((read * SECTOR_SIZE, written * SECTOR_SIZE))
+    return values
+
+def read_network():
+    received = 0
+    sent = 0
+    with open("/proc/net/dev", "r") as f:
+        for line in f.readlines()[2:]:
+            interface, counters = line.split(":", 1)
+            if interface.strip() == "lo":
+                continue
+            tokens = counters.split()
+            received += int(tokens[0])
+            sent += int(tokens[8])
+    return [received, sent]
+
+def cgroup_memory_file(cgroup):
+    if cgroup == "-":
+        return None
+    for path in ("/sys/fs/cgroup/memory/{0}/memory.usage_in_bytes", "/sys/fs/cgroup/{0}/memory.current"):
+        path = path.format(cgroup)
+        if os.path.exists(path):
+            return path
+    return None
+
+def read_int(path):
+    try:
+        with open(path, "r") as f:
+            return int(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return 0
+
+class ProcessTracker(object):
+    # Finds the process with the given name that is, or descends from, the
+    # given process (e.g., sudo running MAGE for one worker), and looks for it
+    # again if it exits. Several workers on one node each have their own.
+    def __init__(self, name, root_pid):
+        self.name = name
+        self.root_pid = root_pid
+        self.pid = None
+
+    def descends_from_root(self, pid):
+        while pid not in ("0", "1"):
+            if pid == self.root_pid:
+                return True
+            try:
+                with open("/proc/{0}/stat".format(pid), "r") as f:
+                    # The name is in parentheses and may contain spaces
+                    pid = f.read().rsplit(")", 1)[1].split()[1]
+            except (OSError, IndexError):
+                return False
+        return False
+
+    def find(self):
+        for entry in os.listdir("/proc"):
+            if entry.isdigit() and entry != str(os.getpid()):
+                try:
+                    with open("/proc/{0}/comm".format(entry), "r") as f:
+                        if f.read().strip() == self.name and self.descends_from_root(entry):
+                            return entry
+                except OSError:
+                    pass
+        return None
+
+    def read_rss(self):
+        if self.pid is None:
+            self.pid = self.find()
+            if self.pid is None:
+                return 0
+        try:
+            with open("/proc/{0}/statm".format(self.pid), "r") as f:
+                return int(f.read().split()[1]) * PAGE_SIZE
+        except (OSError, ValueError, IndexError):
+            self.pid = None
+            return 0
+
+def sample(output_file, interval_ms, cgroup, root_pid, device_args):
+    # Each device argument is name=path, e.g., swap=/dev/sdb2
+    device_names = []
+    devices = []
+    for arg in device_args:
+        name, path = arg.split("=", 1)
+        if os.path.exists(path):
+            device_names.append(name)
+            devices.append(os.path.basename(os.path.realpath(path)))
+
+    columns = ["time_s", "cpu_user", "cpu_nice", "cpu_system", "cpu_idle", "cpu_iowait", "cpu_irq", "cpu_softirq", "cpu_steal", "rss_bytes", "cgroup_bytes", "pswpin", "pswpout", "pgmajfault"]
+    for name in device_names:
+        columns.extend((name + "_read_bytes", name + "_written_bytes"))
+    columns.extend(("net_received_bytes", "net_sent_bytes"))
+    header = {"columns": columns, "devices": dict(zip(device_names, devices)), "interval_ms": interval_ms, "clock_ticks_per_s": os.sysconf("SC_CLK_TCK")}
+    record = struct.Struct("<d{0}Q".format(len(columns) - 1))
+
+    cgroup_file = cgroup_memory_file(cgroup)
+    tracker = ProcessTracker("mage", root_pid)
+    stopped = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.append(signum))
+
+    with open(output_file, "wb") as f:
+        header_bytes = json.dumps(header).encode()
+        f.write(MAGIC + struct.pack("<I", len(header_bytes)) + header_bytes)
+        interval = interval_ms / 1000.0
+        next_sample = time.monotonic()
+        while len(stopped) == 0:
+            values = [time.time()] + read_cpu() + [tracker.read_rss(), read_int(cgroup_file) if cgroup_file is not None else 0] + read_vmstat() + read_diskstats(devices) + read_network()
+            f.write(record.pack(*values))
+            next_sample += interval
+            delay = next_sample - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_sample = time.monotonic()
+        f.flush()
+
+def read_samples(filename):
+    # Returns (header, rows), where each row is a tuple in the order of
+    # header["columns"]
+    with open(filename, "rb") as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise RuntimeError("{0} is not a resource sample file".format(filename))
+    offset = len(MAGIC)
+    header_length, = struct.unpack_from("<I", data, offset)
+    offset += 4
+    header = json.loads(data[offset:offset + header_length].decode())
+    offset += header_length
+    record = struct.Struct("<d{0}Q".format(len(header["columns"]) - 1))
+    end = offset + ((len(data) - offset) // record.size) * record.size
+    return header, [record.unpack_from(data, i) for i in range(offset, end, record.size)]
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--dump":
+        header, rows = read_samples(sys.argv[2])
+        print(",".join(header["columns"]))
+        for row in rows:
+            print(",".join(str(value) for value in row))
+    elif len(sys.argv) >= 5:
+        sample(sys.argv[1], int(sys.argv[2]), sys.argv[3], sys.argv[4], sys.argv[5:])
+    else:
+        print("Usage: {0} output_file interval_ms cgroup|- pid [name=device ...]".format(sys.argv[0]))
+        print("       {0} --dump output_file".format(sys.argv[0]))
+        sys.exit(2)
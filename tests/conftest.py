@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The modules under test live at the top of the repository, next to
+# magebench.py, which runs them from there
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,42 @@
+import math
+
+import pytest
+
+import autotune
+
+def test_successive_halving_finds_fastest():
+    speeds = {("a",): 30.0, ("b",): 10.0, ("c",): 20.0, ("d",): 40.0}
+    runs = []
+    def measure(candidate, trial):
+        runs.append((candidate, trial))
+        return speeds[candidate]
+    best, times = autotune.successive_halving(sorted(speeds), measure)
+    assert best == ("b",)
+    # Four candidates at one trial, two at two, one at four
+    assert len(runs) == autotune.count_runs(4) == 4 + 2 + 2
+    assert len(times[("b",)]) == 4
+    assert len(times[("d",)]) == 1
+
+def test_successive_halving_failures_are_slowest():
+    def measure(candidate, trial):
+        return None if candidate == ("a",) else 50.0
+    best, times = autotune.successive_halving([("a",), ("b",)], measure)
+    assert best == ("b",)
+    assert math.isinf(times[("a",)][0])
+
+def test_successive_halving_all_failed():
+    with pytest.raises(RuntimeError):
+        autotune.successive_halving([("a",), ("b",)], lambda candidate, trial: None)
+
+def test_count_runs_matches_successive_halving():
+    for num_candidates in range(1, 20):
+        for min_trials in (1, 2, 3):
+            for eta in (2, 3):
+                runs = []
+                autotune.successive_halving([(i,) for i in range(num_candidates)], lambda candidate, trial: runs.append(candidate) or float(candidate[0]), min_trials, eta)
+                assert len(runs) == autotune.count_runs(num_candidates, min_trials, eta)
+
+def test_wan_settings_drop_duplicates():
+    candidates = autotune.wan_settings((1,), (1, 2), (1, 2))
+    assert len(candidates) == len(set(candidates))
+    assert autotune.WanSettings(1, 1, 2) in candidates
@@ -0,0 +1,35 @@
+import json
+
+import pytest
+
+import calibration
+
+def test_fit_recovers_line():
+    fixed_bytes, page_bytes = calibration.fit([(1000, 50000000 + 1000 * 70000), (4000, 50000000 + 4000 * 70000)])
+    assert fixed_bytes == pytest.approx(50000000)
+    assert page_bytes == pytest.approx(70000)
+
+def test_fit_needs_distinct_page_counts():
+    with pytest.raises(RuntimeError):
+        calibration.fit([(1000, 1 << 30), (1000, 1 << 30)])
+
+def test_fit_rejects_shrinking_rss():
+    with pytest.raises(RuntimeError):
+        calibration.fit([(1000, 2 << 30), (2000, 1 << 30)])
+
+def test_safe_num_pages_shares_budget():
+    one = calibration.safe_num_pages(1 << 30, 1 << 26, 1 << 16, 1, 0.05)
+    two = calibration.safe_num_pages(1 << 30, 1 << 26, 1 << 16, 2, 0.05)
+    assert (1 << 26) + one * (1 << 16) <= (1 << 30) * 0.95
+    assert 2 * ((1 << 26) + two * (1 << 16)) <= (1 << 30) * 0.95
+    assert two < one
+
+def test_save_calibration_replaces_limit(tmp_path):
+    filename = str(tmp_path / "calibration.json")
+    calibration.save_calibration("halfgates", {"1gb": {"1": 100, "2": 40}}, {}, filename)
+    calibration.save_calibration("halfgates", {"1gb": {"1": 90}, "2gb": {"1": 200}}, {"page_bytes": 1}, filename)
+    calibration.save_calibration("ckks", {"1gb": {"1": 10}}, {}, filename)
+    with open(filename) as f:
+        saved = json.load(f)
+    assert saved["num_pages"] == {"halfgates": {"1gb": {"1": 90}, "2gb": {"1": 200}}, "ckks": {"1gb": {"1": 10}}}
+    assert saved["fits"]["halfgates"] == {"page_bytes": 1}
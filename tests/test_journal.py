@@ -0,0 +1,33 @@
+import pytest
+
+import journal
+
+def test_records_outcomes(tmp_path):
+    filename = str(tmp_path / "journal.jsonl")
+    j = journal.SweepJournal("cluster-a", filename)
+    assert j.run("ok_t1", lambda: 42) == 42
+    with pytest.raises(ValueError):
+        j.run("failed_t1", lambda: int("x"))
+    assert j.completed("ok_t1")
+    assert not j.completed("failed_t1")
+    assert not j.completed("missing_t1")
+
+def test_resumes_from_file(tmp_path):
+    filename = str(tmp_path / "journal.jsonl")
+    journal.SweepJournal("cluster-a", filename).run("a_t1", lambda: None)
+    journal.SweepJournal("cluster-b", filename).run("b_t1", lambda: None)
+    with open(filename, "a") as f:
+        f.write('{"cluster": "cluster-a", "log_na')
+    resumed = journal.SweepJournal("cluster-a", filename)
+    assert resumed.completed("a_t1")
+    assert not resumed.completed("b_t1")
+    assert len(journal.SweepJournal(None, filename).elapsed_times()) == 2
+
+def test_later_entry_wins(tmp_path):
+    filename = str(tmp_path / "journal.jsonl")
+    j = journal.SweepJournal("cluster-a", filename)
+    j.record("a_t1", "failed", 0.0, 1.0, "crashed")
+    j.record("a_t1", "ok", 2.0, 5.0)
+    resumed = journal.SweepJournal("cluster-a", filename)
+    assert resumed.completed("a_t1")
+    assert resumed.elapsed_times() == [3.0]
@@ -0,0 +1,39 @@
+import plan
+
+def shape(azure = 2, image = True):
+    return plan.ClusterShape(azure, (), "regular", False, image, "https://github.com/ucbrise/mage", "main", "rise-mage")
+
+def test_compile_plan_shares_clusters_by_shape():
+    groups = [plan.PlanGroup("a", shape(2), "logs-a", []), plan.PlanGroup("b", shape(8), "logs-b", []), plan.PlanGroup("c", shape(2), "logs-c", [])]
+    sessions = plan.compile_plan(groups)
+    assert [(s, [g.name for g in gs]) for s, gs in sessions] == [(shape(2), ["a", "c"]), (shape(8), ["b"])]
+
+def test_load_plan(tmp_path):
+    plan_file = tmp_path / "plan.yaml"
+    plan_file.write_text("""
+defaults:
+  cluster: {image: true}
+groups:
+  - name: baseline
+    cluster: {azure: 4}
+    logs: logs-baseline
+    runs:
+      - run-halfgates-baseline -t 1
+      - {command: run-ckks-baseline -t 1, minutes_per_experiment: 2}
+""")
+    groups = plan.load_plan(str(plan_file))
+    assert len(groups) == 1
+    assert groups[0].shape == shape(4, True)
+    assert groups[0].runs == [(["run-halfgates-baseline", "-t", "1"], None), (["run-ckks-baseline", "-t", "1"], 2)]
+
+def test_plan_steps_order_and_dependencies():
+    groups = [plan.PlanGroup("a", shape(), "logs-a", [(["run-lan"], None)]), plan.PlanGroup("b", shape(), "logs-b", [(["run-lan"], 3), (["run-ab"], None)])]
+    steps = plan.plan_steps(plan.compile_plan(groups), lambda argv, num_lan_machines: 2, 5)
+    names = [step.name for step in steps]
+    assert names == ["spawn0", "configs0", "a.run0", "a.fetch", "b.run0", "b.run1", "b.fetch", "deallocate0"]
+    by_name = {step.name: step for step in steps}
+    assert by_name["b.run0"].depends_on == ["configs0", "a.fetch"]
+    assert by_name["b.run0"].minutes == 6
+    assert by_name["a.run0"].minutes == 10
+    assert by_name["deallocate0"].depends_on == ["a.fetch", "b.fetch"]
+    assert by_name["b.fetch"].argv == ["fetch-logs", "-a", "logs-b"]
@@ -0,0 +1,87 @@
+import json
+import struct
+
+import results
+
+def test_lan_log_names():
+    fields = results.parse_log_name("workers_1_merge_sorted_1048576_mage_t0")
+    assert fields["kind"] == "workers"
+    assert fields["experiment"] == "workers_1"
+    assert fields["problem"] == "merge_sorted"
+    assert fields["size"] == 1048576
+    assert fields["scenario"] == "mage"
+    assert fields["tag"] == "t0"
+    assert fields["worker"] is None
+
+def test_baseline_log_names():
+    fields = results.parse_log_name("halfgates_baseline_merge_sorted_1048576_emp_t2")
+    assert (fields["experiment"], fields["problem"], fields["size"], fields["scenario"], fields["tag"]) == ("halfgates_baseline", "merge_sorted", 1048576, "emp", "t2")
+    fields = results.parse_log_name("ckks_baseline_real_statistics_4096_seal_t0")
+    assert (fields["experiment"], fields["problem"], fields["size"], fields["scenario"]) == ("ckks_baseline", "real_statistics", 4096, "seal")
+
+def test_ab_log_names():
+    fields = results.parse_log_name("ab_b_workers_2_merge_sorted_1048576_os_t3")
+    assert fields["kind"] == "ab"
+    assert fields["experiment"] == "ab_b_workers_2"
+    assert fields["problem"] == "merge_sorted"
+    assert fields["size"] == 1048576
+    assert fields["scenario"] == "os"
+    assert fields["tag"] == "t3"
+    assert results.parse_log_name("ab_c_workers_2_merge_sorted_1048576_os_t3") is None
+
+def test_prefetch_log_names():
+    fields = results.parse_log_name("prefetch_1gb_256_8192_merge_sorted_1048576_t1")
+    assert fields["kind"] == "prefetch"
+    assert fields["experiment"] == "prefetch_1gb_256_8192"
+    assert fields["problem"] == "merge_sorted"
+    assert fields["size"] == 1048576
+    assert fields["scenario"] == "mage"
+    assert fields["tag"] == "t1"
+
+def test_wan_log_names():
+    fields = results.parse_log_name("wan_oregon_4_16_2_merge_sorted_1048576_mage_t0_w3")
+    assert fields["kind"] == "wan"
+    assert fields["location"] == "oregon"
+    assert (fields["workers_per_node"], fields["ot_pipeline_depth"], fields["ot_num_daemons"]) == (4, 16, 2)
+    assert (fields["problem"], fields["size"], fields["scenario"], fields["tag"], fields["worker"]) == ("merge_sorted", 1048576, "mage", "t0", "w3")
+    assert results.parse_log_name("pairedwan_iowa_1_1_1_loop_join_2048_os_t1_w0")["kind"] == "pairedwan"
+
+def test_autotune_log_names():
+    fields = results.parse_log_name("autotunewan_oregon_2_4_8_merge_sorted_1048576_mage_t0_w1")
+    assert fields["kind"] == "autotunewan"
+    assert fields["experiment"] == "autotunewan_oregon"
+    assert (fields["workers_per_node"], fields["ot_pipeline_depth"], fields["ot_num_daemons"]) == (2, 4, 8)
+    assert (fields["problem"], fields["size"], fields["worker"]) == ("merge_sorted", 1048576, "w1")
+    assert results.parse_log_name("autotunepaired-wan_iowa_2_4_8_merge_sorted_1048576_max_t0_w0")["kind"] == "autotunepaired-wan"
+
+def test_skipped_log_names():
+    assert results.parse_log_name("calibrate_halfgates_1gb_65536") is None
+    assert results.parse_log_name("calibrate_ckks_max_4096") is None
+    assert results.parse_log_name("merge_sorted_1048576") is None
+    assert results.parse_log_name("wan_oregon_x_16_2_merge_sorted_1048576_mage_t0_w3") is None
+
+def write_samples(filename, rows):
+    columns = ["time_s", "cpu_user", "cpu_nice", "cpu_system", "cpu_idle", "cpu_iowait", "cpu_irq", "cpu_softirq", "cpu_steal", "rss_bytes", "cgroup_bytes", "pswpin", "pswpout", "pgmajfault", "net_received_bytes", "net_sent_bytes"]
+    header = json.dumps({"columns": columns, "devices": {}, "interval_ms": 200, "clock_ticks_per_s": 100}).encode()
+    record = struct.Struct("<d{0}Q".format(len(columns) - 1))
+    with open(filename, "wb") as f:
+        f.write(results.sample_resources.MAGIC + struct.pack("<I", len(header)) + header)
+        for row in rows:
+            values = dict(zip(("time_s", "rss_bytes", "cgroup_bytes", "pswpin", "pswpout", "pgmajfault"), row))
+            f.write(record.pack(*(values.get(column, 0) for column in columns)))
+
+def test_ingest_samples(tmp_path):
+    machine_directory = tmp_path / "logs" / "00"
+    machine_directory.mkdir(parents = True)
+    write_samples(str(machine_directory / "workers_1_merge_sorted_1024_mage_t0.samples"), [(10.0, 100, 200, 5, 7, 1), (10.5, 300, 250, 6, 9, 4), (11.0, 200, 220, 8, 9, 4)])
+    write_samples(str(machine_directory / "calibrate_halfgates_1gb_4096.samples"), [(10.0, 100, 200, 5, 7, 1)])
+    connection = results.open_results(str(tmp_path / "results.db"))
+    assert results.ingest_log_directory(connection, str(tmp_path / "logs")) == 1
+    rows = results.load_results(connection)
+    assert list(rows["name"]) == ["workers_1_merge_sorted_1024_mage_t0"]
+    assert rows["sampled_s"][0] == 1.0
+    assert rows["peak_rss_bytes"][0] == 300
+    assert rows["peak_cgroup_bytes"][0] == 250
+    assert (rows["swap_in_pages"][0], rows["swap_out_pages"][0], rows["major_faults"][0]) == (3, 2, 3)
+    # Nothing is parsed again, including the skipped file
+    assert results.ingest_log_directory(connection, str(tmp_path / "logs")) == 0
@@ -0,0 +1,56 @@
+import threading
+import time
+
+import pytest
+
+import scheduler
+
+class FakeCluster(object):
+    def __init__(self, num_lan_machines):
+        self.num_lan_machines = num_lan_machines
+
+def run_jobs(num_lan_machines, nodes_per_party, jobs):
+    # jobs is a list of two_party flags; returns the machines each job ran on
+    sched = scheduler.ExperimentScheduler(FakeCluster(num_lan_machines), nodes_per_party)
+    lock = threading.Lock()
+    busy = set()
+    allocations = {}
+    def job(i, worker_ids):
+        with lock:
+            assert busy.isdisjoint(worker_ids)
+            busy.update(worker_ids)
+            allocations[i] = worker_ids
+        time.sleep(0.01)
+        with lock:
+            busy.difference_update(worker_ids)
+    for i, two_party in enumerate(jobs):
+        sched.submit("job{0}".format(i), two_party, lambda worker_ids, i = i: job(i, worker_ids))
+    sched.run()
+    return allocations
+
+def test_units_are_disjoint():
+    allocations = run_jobs(8, 1, [True, False, True, False, False, True, True, False])
+    assert len(allocations) == 8
+
+def test_two_party_jobs_pair_evaluators_with_garblers():
+    allocations = run_jobs(8, 2, [True, True, True])
+    for worker_ids in allocations.values():
+        assert worker_ids in ((0, 1, 4, 5), (2, 3, 6, 7))
+
+def test_single_party_jobs_run_on_evaluators():
+    allocations = run_jobs(8, 1, [False] * 6)
+    for worker_ids in allocations.values():
+        assert len(worker_ids) == 1 and worker_ids[0] < 4
+
+def test_bad_division():
+    with pytest.raises(RuntimeError):
+        scheduler.ExperimentScheduler(FakeCluster(8), 3)
+
+def test_failure_is_raised():
+    sched = scheduler.ExperimentScheduler(FakeCluster(4), 1)
+    def fail(worker_ids):
+        raise ValueError("boom")
+    sched.submit("fails", True, fail)
+    sched.submit("after", True, lambda worker_ids: None)
+    with pytest.raises(ValueError):
+        sched.run()
@@ -0,0 +1,47 @@
+import math
+
+import pytest
+
+import trials
+
+def test_t_critical_table():
+    assert trials.t_critical(0.95, 1) == 12.706
+    assert trials.t_critical(0.95, 30) == 2.042
+    assert trials.t_critical(0.99, 10) == 3.169
+
+def test_t_critical_tail():
+    # Between the table's entries, and the normal distribution in the limit
+    assert 2.021 < trials.t_critical(0.95, 35) < 2.042
+    assert trials.t_critical(0.95, 40) == pytest.approx(2.021)
+    assert trials.t_critical(0.95, 1000000) == pytest.approx(1.960, abs = 1e-3)
+    values = [trials.t_critical(0.90, df) for df in range(1, 500)]
+    assert all(a >= b for a, b in zip(values, values[1:]))
+
+def test_t_critical_unknown_confidence():
+    with pytest.raises(RuntimeError):
+        trials.t_critical(0.8, 5)
+
+def test_welch_test_significant():
+    difference, half_width, significant = trials.welch_test([10.0, 11.0, 10.5, 10.2], [20.0, 21.0, 19.5, 20.4])
+    assert difference == pytest.approx(-9.8)
+    assert 0 < half_width < 9.8
+    assert significant
+
+def test_welch_test_not_significant():
+    difference, half_width, significant = trials.welch_test([10.0, 12.0, 11.0], [10.5, 11.5, 11.2])
+    assert abs(difference) < half_width
+    assert not significant
+
+def test_welch_test_too_few_samples():
+    difference, half_width, significant = trials.welch_test([10.0], [12.0, 13.0])
+    assert difference == -2.5
+    assert math.isinf(half_width)
+    assert not significant
+
+def test_controller_stops_when_narrow():
+    controller = trials.TrialController(2, target_width = 0.1, max_trials = 10)
+    for trial in (1, 2):
+        assert controller.needs("a", trial)
+        controller.record("a", 100.0 + trial / 10.0)
+    assert not controller.needs("a", 3)
+    assert not controller.needs("a", 11)
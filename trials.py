@@ -0,0 +1,126 @@
+import json
+import math
+import os
+import statistics
+import threading
+
+# Decides how many trials of each configuration to run. With a fixed count,
+# every configuration gets that many trials. With a target width, each
+# configuration gets at least min_trials, then more until the confidence
+# interval for the mean total time is narrower than the target (relative to
+# the mean) or max_trials have run. A sweep runs its trials in rounds, all
+# configurations' first trials, then all of their second trials, and so on,
+# so that any drift in the machines or the network affects them alike.
+
+PRECISION_FILE = "precision.json"
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_MAX_TRIALS = 30
+
+# Two-sided critical values of Student's t distribution, by degrees of freedom
+T_TABLE = {
+    0.90: (6.314, 2.920, 2.353, 2.132, 2.015, 1.943, 1.895, 1.860, 1.833, 1.812, 1.796, 1.782, 1.771, 1.761, 1.753, 1.746, 1.740, 1.734, 1.729, 1.725, 1.721, 1.717, 1.714, 1.711, 1.708, 1.706, 1.703, 1.701, 1.699, 1.697),
+    0.95: (12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042),
+    0.99: (63.657, 9.925, 5.841, 4.604, 4.032, 3.707, 3.499, 3.355, 3.250, 3.169, 3.106, 3.055, 3.012, 2.977, 2.947, 2.921, 2.898, 2.878, 2.861, 2.845, 2.831, 2.819, 2.807, 2.797, 2.787, 2.779, 2.771, 2.763, 2.756, 2.750),
+}
+# For more than 30 degrees of freedom: 40, 60, 120, and the normal distribution
+T_TABLE_TAIL = {
+    0.90: ((40, 1.684), (60, 1.671), (120, 1.658), (math.inf, 1.645)),
+    0.95: ((40, 2.021), (60, 2.000), (120, 1.980), (math.inf, 1.960)),
+    0.99: ((40, 2.704), (60, 2.660), (120, 2.617), (math.inf, 2.576)),
+}
+
+def t_critical(confidence, df):
+    if confidence not in T_TABLE:
+        raise RuntimeError("Confidence must be one of {0} (got {1})".format(", ".join(str(c) for c in sorted(T_TABLE)), confidence))
+    if df <= len(T_TABLE[confidence]):
+        return T_TABLE[confidence][df - 1]
+    # Interpolate linearly in 1 / df, which is how the values converge
+    lower_df, lower_t = len(T_TABLE[confidence]), T_TABLE[confidence][-1]
+    for upper_df, upper_t in T_TABLE_TAIL[confidence]:
+        if df <= upper_df:
+            fraction = (1.0 / lower_df - 1.0 / df) / (1.0 / lower_df - 1.0 / upper_df)
+            return lower_t + fraction * (upper_t - lower_t)
+        lower_df, lower_t = upper_df, upper_t
+
+def confidence_interval(samples, confidence = DEFAULT_CONFIDENCE):
+    # Returns (mean, half_width) for the mean of the samples
+    mean = statistics.mean(samples)
+    if len(samples) < 2:
+        return (mean, math.inf)
+    return (mean, t_critical(confidence, len(samples) - 1) * statistics.stdev(samples) / math.sqrt(len(samples)))
+
+def welch_test(a, b, confidence = DEFAULT_CONFIDENCE):
+    # Welch's t-test for a difference between the means of two samples with
+    # possibly unequal variances. Returns (difference, half_width,
+    # significant), where mean(a) - mean(b) lies within difference +/-
+    # half_width at the given confidence and significant says whether that
+    # interval excludes zero.
+    if len(a) < 2 or len(b) < 2:
+        return (statistics.mean(a) - statistics.mean(b), math.inf, False)
+    va = statistics.variance(a) / len(a)
+    vb = statistics.variance(b) / len(b)
+    difference = statistics.mean(a) - statistics.mean(b)
+    if va + vb == 0:
+        return (difference, 0.0, difference != 0)
+    df = (va + vb) ** 2 / (va ** 2 / (len(a) - 1) + vb ** 2 / (len(b) - 1))
+    # Rounding the degrees of freedom down keeps the test conservative
+    half_width = t_critical(confidence, max(int(df), 1)) * math.sqrt(va + vb)
+    return (difference, half_width, abs(difference) > half_width)
+
+class TrialController(object):
+    def __init__(self, min_trials, target_width = None, max_trials = DEFAULT_MAX_TRIALS, confidence = DEFAULT_CONFIDENCE):
+        self.min_trials = min_trials
+        self.target_width = target_width
+        self.max_trials = max(max_trials, min_trials) if target_width is not None else min_trials
+        self.confidence = confidence
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    @property
+    def adaptive(self):
+        return self.target_width is not None
+
+    def rounds(self):
+        return range(1, self.max_trials + 1)
+
+    def relative_width(self, key):
+        with self.lock:
+            samples = list(self.samples.get(key, ()))
+        if len(samples) == 0:
+            return math.inf
+        mean, half_width = confidence_interval(samples, self.confidence)
+        return 2 * half_width / mean
+
+    def needs(self, key, trial):
+        if trial <= self.min_trials:
+            return True
+        if not self.adaptive or trial > self.max_trials:
+            return False
+        return self.relative_width(key) > self.target_width
+
+    def record(self, key, total_ms):
+        with self.lock:
+            self.samples.setdefault(key, []).append(total_ms)
+
+    def summary(self, key):
+        with self.lock:
+            samples = list(self.samples.get(key, ()))
+        mean, half_width = confidence_interval(samples, self.confidence)
+        return {"trials": len(samples), "mean_ms": mean, "stdev_ms": statistics.stdev(samples) if len(samples) >= 2 else None, "ci_half_width_ms": half_width if not math.isinf(half_width) else None, "relative_width": 2 * half_width / mean if not math.isinf(half_width) else None, "confidence": self.confidence, "target_width": self.target_width, "converged": 2 * half_width / mean <= self.target_width}
+
+    def save(self, cluster_name, filename = PRECISION_FILE):
+        # Merges the precision achieved for each configuration into the file,
+        # under the cluster's name, since the logs it describes are there
+        if not self.adaptive or len(self.samples) == 0:
+            return
+        precision = {}
+        if os.path.exists(filename):
+            with open(filename, "r") as f:
+                precision = json.load(f)
+        entries = precision.setdefault(cluster_name, {})
+        for key in sorted(self.samples):
+            entries[key] = self.summary(key)
+            print("{0}: {1} trials, {2:.0f} ms mean, {3}".format(key, entries[key]["trials"], entries[key]["mean_ms"], "relative width {0:.3f}".format(entries[key]["relative_width"]) if entries[key]["relative_width"] is not None else "no interval"))
+        with open(filename + ".tmp", "w") as f:
+            json.dump(precision, f, indent = 4, sort_keys = True)
+        os.replace(filename + ".tmp", filename)